@@ -108,6 +108,25 @@ DATABASES = {
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'default': local-memory (por proceso), para la matriz de descuentos de convenios.
+# 'compartida': en la base de datos, común a todos los workers; guarda los sellos
+# de versión que invalidan las copias locales (ver ordenes.precios).
+# Requiere `python manage.py createcachetable`.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'avanzad-default',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'Cache_Compartida',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -155,7 +174,43 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Avanzad/settings.py
 AUTH_USER_MODEL = 'usuarios.Usuario'
 
+# Carga el usuario de la sesión junto con su rol (ver usuarios.permisos)
+AUTHENTICATION_BACKENDS = ['usuarios.permisos.UsuarioConRolBackend']
+
 # URLs de redirección para autenticación
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
-LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'
+
+# Generación de PDFs en segundo plano (comando `manage.py procesar_pdfs`)
+# Carpeta donde el worker deja los PDFs terminados para su descarga.
+PDF_TRABAJOS_DIR = BASE_DIR / 'pdf_trabajos'
+# Segundos que se conservan los trabajos terminados (Completado o Error) y su
+# archivo; después el worker los borra (ver ordenes.pdf.purgar_trabajos).
+PDF_TRABAJOS_RETENCION = 24 * 60 * 60
+
+# Caché en disco de PDFs inmutables (resultados validados y facturas emitidas).
+# Al superar el tamaño máximo se borran los menos usados (LRU).
+PDF_CACHE_DIR = BASE_DIR / 'pdf_cache'
+PDF_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+# Recursos de los PDFs: las imágenes más grandes que PDF_IMAGEN_MAX_PX (lado
+# mayor, en píxeles) se reducen una vez y se guardan aquí (ver ordenes.recursos_pdf).
+PDF_RECURSOS_DIR = BASE_DIR / 'pdf_recursos'
+PDF_IMAGEN_MAX_PX = 600
+
+# Los PDFs se generan en un archivo temporal que queda en memoria hasta este
+# tamaño y pasa a disco al superarlo (ver ordenes.pdf.TemporalPDF). Un
+# resultado o una factura pesan decenas de KB; los reportes largos y las
+# exportaciones por lotes no se quedan en la memoria del proceso.
+PDF_SPOOL_MAX_BYTES = 512 * 1024
+
+# Membrete de los documentos impresos (resultados y facturas). Cada tipo de
+# documento muestra su propio correo de contacto.
+EMPRESA = {
+    'nombre': 'Laboratorio Clínico Avanzado',
+    'direccion': 'Calle Principal #123, San Salvador',
+    'telefono': '2222-0000',
+    'email_resultados': 'resultados@labavanzado.com',
+    'email_facturas': 'info@labavanzado.com',
+}
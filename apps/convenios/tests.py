@@ -1,3 +1,84 @@
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+
+from categorias.models import CategoriaExamen
+from examenes.models import Examen
+from ordenes.precios import TablaDescuentos, estadisticas_cache, version_descuentos
+from paquetes.models import Paquete
+from roles.models import Rol
+from tipos_muestras.models import TipoMuestra
+from usuarios.models import Usuario
+from .models import Convenio, ConvenioPaquete
+
+
+class MatrizDescuentosCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+        tipo_muestra = TipoMuestra.objects.create(
+            nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+        )
+        cls.examen = Examen.objects.create(
+            nombre='Glucosa', codigo='GLU', precio=Decimal('5.00'),
+            categoria=categoria, tipo_muestra=tipo_muestra
+        )
+        cls.paquete = Paquete.objects.create(nombre='Perfil Lipídico', precio=Decimal('25.00'))
+        cls.convenio = Convenio.objects.create(
+            nombre='Empresa Uno', tipo='Empresa', persona_contacto='Luis',
+            telefono_contacto='22224444', correo_contacto='rrhh@example.com',
+            condiciones_pago='Crédito 30 días',
+            descuento_general_examenes=Decimal('10.00'),
+            descuento_general_paquetes=Decimal('5.00'),
+        )
+        rol = Rol.objects.create(nombre='Administrador', descripcion='Acceso total')
+        cls.usuario = Usuario.objects.create_user(
+            username='admin', password='clave-segura-123', email='admin@example.com',
+            nombre='Ada', apellido='Admin', dui='01234567-8', rol=rol
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.usuario)
+
+    def test_fallback_general_ya_aplicado(self):
+        tabla = TablaDescuentos.para_convenio(self.convenio.pk)
+        self.assertEqual(tabla.porcentaje_examen(self.examen.pk), Decimal('10.00'))
+        self.assertEqual(tabla.porcentaje_paquete(self.paquete.pk), Decimal('5.00'))
+
+    def test_hits_y_misses(self):
+        version_descuentos(self.convenio.pk)
+        misses, hits = estadisticas_cache['misses'], estadisticas_cache['hits']
+        # Cada lectura consulta el sello compartido; solo el miss trae la matriz
+        with self.assertNumQueries(2):
+            TablaDescuentos.para_convenio(self.convenio.pk)
+        with self.assertNumQueries(1):
+            TablaDescuentos.para_convenio(self.convenio.pk)
+        self.assertEqual(estadisticas_cache['misses'], misses + 1)
+        self.assertEqual(estadisticas_cache['hits'], hits + 1)
+
+        datos = self.client.get(reverse('convenio_cache_estadisticas')).json()
+        self.assertEqual(datos['hits'], estadisticas_cache['hits'])
+
+    def test_crear_descuento_examen_invalida_la_matriz(self):
+        TablaDescuentos.para_convenio(self.convenio.pk)
+        self.client.post(
+            reverse('add_desc_examen', kwargs={'convenio_pk': self.convenio.pk}),
+            {'examen': self.examen.pk, 'porcentaje_descuento': '30.00'}
+        )
+        tabla = TablaDescuentos.para_convenio(self.convenio.pk)
+        self.assertEqual(tabla.porcentaje_examen(self.examen.pk), Decimal('30.00'))
+
+    def test_eliminar_descuento_paquete_invalida_la_matriz(self):
+        descuento = ConvenioPaquete.objects.create(
+            convenio=self.convenio, paquete=self.paquete, porcentaje_descuento=Decimal('50.00')
+        )
+        tabla = TablaDescuentos.para_convenio(self.convenio.pk)
+        self.assertEqual(tabla.porcentaje_paquete(self.paquete.pk), Decimal('50.00'))
 
-# Create your tests here.
+        self.client.post(reverse('del_desc_paquete', kwargs={'pk': descuento.pk}))
+        tabla = TablaDescuentos.para_convenio(self.convenio.pk)
+        self.assertEqual(tabla.porcentaje_paquete(self.paquete.pk), Decimal('5.00'))
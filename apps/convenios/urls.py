@@ -22,4 +22,8 @@ urlpatterns = [
          views.ConvenioPaqueteCreateView.as_view(), name='add_desc_paquete'),
     path('gestion/convenios/eliminar-paquete/<int:pk>/', 
          views.ConvenioPaqueteDeleteView.as_view(), name='del_desc_paquete'),
+
+    # Monitoreo de la caché de descuentos
+    path('gestion/convenios/cache/estadisticas/',
+         views.DescuentosCacheEstadisticasView.as_view(), name='convenio_cache_estadisticas'),
 ]
\ No newline at end of file
@@ -1,18 +1,19 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
-from django.views.generic import ListView, CreateView, UpdateView, DetailView, DeleteView
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.views.generic import ListView, CreateView, UpdateView, DetailView, DeleteView, View
+from usuarios.permisos import CapacidadRequeridaMixin
 from django.db import IntegrityError
+from django.http import JsonResponse
 
 from .models import Convenio, ConvenioExamen, ConvenioPaquete
 from .forms import ConvenioForm, ConvenioExamenForm, ConvenioPaqueteForm
+from ordenes.precios import CACHE_TIMEOUT, estadisticas_cache, invalidar_descuentos
 
-# --- Mixin de Seguridad (Asumiendo que lo tienes en usuarios o ordenes) ---
-# Si no, cópialo aquí. Usaremos uno básico por ahora.
-class AdminRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
-    def test_func(self):
-        return self.request.user.is_authenticated and self.request.user.rol.nombre in ['Administrador', 'Jefe de Laboratorio']
+# --- Mixin de Seguridad ---
+class AdminRequiredMixin(CapacidadRequeridaMixin):
+    """ Administradores y Jefes de Laboratorio. """
+    capacidad = 'gestionar_convenios'
 
 # ==========================================
 # === CRUD PRINCIPAL (CONVENIOS) ===
@@ -43,7 +44,9 @@ class ConvenioUpdateView(AdminRequiredMixin, UpdateView):
 
     def form_valid(self, form):
         messages.success(self.request, "Datos del convenio actualizados.")
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        invalidar_descuentos(self.object.pk) # Pueden cambiar los descuentos generales
+        return response
 
     def get_success_url(self):
         return reverse('convenio_detail', kwargs={'pk': self.object.pk})
@@ -58,6 +61,7 @@ class ConvenioDeleteView(AdminRequiredMixin, DeleteView):
         self.object = self.get_object()
         try:
             self.object.delete()
+            invalidar_descuentos(self.kwargs['pk'])
             messages.success(request, f"Convenio '{self.object.nombre}' eliminado.")
             return redirect(self.success_url)
         except Exception as e:
@@ -93,17 +97,24 @@ class ConvenioExamenCreateView(AdminRequiredMixin, CreateView):
         convenio = get_object_or_404(Convenio, pk=self.kwargs['convenio_pk'])
         form.instance.convenio = convenio
         try:
-            return super().form_valid(form)
+            response = super().form_valid(form)
         except IntegrityError:
             form.add_error('examen', "Este examen ya tiene un descuento configurado.")
             return self.form_invalid(form)
+        invalidar_descuentos(convenio.pk)
+        return response
 
     def get_success_url(self):
         return reverse('convenio_detail', kwargs={'pk': self.kwargs['convenio_pk']})
 
 class ConvenioExamenDeleteView(AdminRequiredMixin, DeleteView):
     model = ConvenioExamen
-    
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        invalidar_descuentos(self.object.convenio_id)
+        return response
+
     def get_success_url(self):
         messages.warning(self.request, "Descuento específico eliminado. Aplicará el general.")
         return reverse('convenio_detail', kwargs={'pk': self.object.convenio.pk})
@@ -117,17 +128,39 @@ class ConvenioPaqueteCreateView(AdminRequiredMixin, CreateView):
         convenio = get_object_or_404(Convenio, pk=self.kwargs['convenio_pk'])
         form.instance.convenio = convenio
         try:
-            return super().form_valid(form)
+            response = super().form_valid(form)
         except IntegrityError:
             form.add_error('paquete', "Este paquete ya tiene un descuento configurado.")
             return self.form_invalid(form)
+        invalidar_descuentos(convenio.pk)
+        return response
 
     def get_success_url(self):
         return reverse('convenio_detail', kwargs={'pk': self.kwargs['convenio_pk']})
 
 class ConvenioPaqueteDeleteView(AdminRequiredMixin, DeleteView):
     model = ConvenioPaquete
-    
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        invalidar_descuentos(self.object.convenio_id)
+        return response
+
     def get_success_url(self):
         messages.warning(self.request, "Descuento específico eliminado.")
-        return reverse('convenio_detail', kwargs={'pk': self.object.convenio.pk})
\ No newline at end of file
+        return reverse('convenio_detail', kwargs={'pk': self.object.convenio.pk})
+
+# ==========================================
+# === MONITOREO DE LA CACHÉ DE DESCUENTOS ===
+# ==========================================
+
+class DescuentosCacheEstadisticasView(AdminRequiredMixin, View):
+    """ Contadores de aciertos/fallos de la caché de descuentos (por proceso). """
+    def get(self, request, *args, **kwargs):
+        total = estadisticas_cache['hits'] + estadisticas_cache['misses']
+        return JsonResponse({
+            'hits': estadisticas_cache['hits'],
+            'misses': estadisticas_cache['misses'],
+            'ratio_aciertos': round(estadisticas_cache['hits'] / total, 4) if total else None,
+            'timeout_segundos': CACHE_TIMEOUT,
+        })
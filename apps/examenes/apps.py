@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ExamenesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'examenes'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (descarta el predicado compilado al editar un rango)
@@ -1,6 +1,7 @@
 import re
 from django import forms
 from .models import Examen, MetodoExamen, ValorReferencia
+from .rangos import limites_rango
 from categorias.models import CategoriaExamen
 from tipos_muestras.models import TipoMuestra
 
@@ -80,13 +81,27 @@ class ValorReferenciaForm(forms.ModelForm):
     class Meta:
         model = ValorReferencia
         # Quitamos 'poblacion', agregamos sexo y edades
-        fields = ['sexo', 'edad_minima', 'edad_maxima', 'rango_referencia', 'unidad_medida', 'tipo_resultado', 'estado']
+        fields = ['sexo', 'edad_minima', 'edad_maxima', 'rango_referencia', 'critico_minimo', 'critico_maximo',
+                  'unidad_medida', 'tipo_resultado', 'estado']
         widgets = {
             'sexo': forms.Select(attrs={'class': 'form-select form-select-sm'}),
             'edad_minima': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'placeholder': '0'}),
             'edad_maxima': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'placeholder': '120'}),
             'rango_referencia': forms.TextInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Ej: 70-110'}),
+            'critico_minimo': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Crít. <', 'step': 'any'}),
+            'critico_maximo': forms.NumberInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Crít. >', 'step': 'any'}),
             'unidad_medida': forms.TextInput(attrs={'class': 'form-control form-control-sm', 'placeholder': 'Ej: mg/dL'}),
             'tipo_resultado': forms.Select(attrs={'class': 'form-select form-select-sm'}),
             'estado': forms.Select(attrs={'class': 'form-select form-select-sm'}),
-        }
\ No newline at end of file
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        # Un rango cuantitativo debe poder evaluarse al guardar resultados (banderas)
+        rango = cleaned_data.get('rango_referencia')
+        if rango and cleaned_data.get('tipo_resultado') == 'Cuantitativo' and limites_rango(rango) is None:
+            self.add_error('rango_referencia', "Use un rango numérico (Ej: 70-110, <5, >=1.2) o marque el tipo Cualitativo.")
+        minimo, maximo = cleaned_data.get('critico_minimo'), cleaned_data.get('critico_maximo')
+        if minimo is not None and maximo is not None and minimo >= maximo:
+            self.add_error('critico_maximo', "El límite crítico máximo debe ser mayor que el mínimo.")
+        return cleaned_data
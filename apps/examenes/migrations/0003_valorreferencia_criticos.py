@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('examenes', '0002_metodoexamen_estado_valorreferencia_estado_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='valorreferencia',
+            name='critico_maximo',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True, verbose_name='Crítico Máx'),
+        ),
+        migrations.AddField(
+            model_name='valorreferencia',
+            name='critico_minimo',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True, verbose_name='Crítico Mín'),
+        ),
+    ]
@@ -118,6 +118,12 @@ class ValorReferencia(models.Model):
         max_length=20, choices=TIPO_RESULTADO_CHOICES, default='Cuantitativo'
     )
     
+    # Límites críticos (opcionales): fuera de ellos el resultado se marca LL/HH
+    critico_minimo = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True,
+                                         verbose_name="Crítico Mín")
+    critico_maximo = models.DecimalField(max_digits=12, decimal_places=4, null=True, blank=True,
+                                         verbose_name="Crítico Máx")
+
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='Activo')
 
     # Generamos el texto automáticamente para que se lea bonito
@@ -0,0 +1,194 @@
+import re
+import unicodedata
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ValorReferencia
+
+# --- Resolución del valor de referencia aplicable a un paciente ---
+# Un examen puede tener varios ValorReferencia alternativos (por sexo y rango
+# de edad). El resolvedor carga los de varios exámenes en una consulta y los
+# indexa por (examen_id, sexo), ordenados por edad mínima: cada búsqueda es
+# una bisección sobre las edades mínimas.
+
+
+class ResolvedorRangos:
+
+    def __init__(self, valores):
+        self._por_examen = defaultdict(list)
+        self._indice = defaultdict(list)
+        for valor in valores:
+            self._por_examen[valor.examen_id].append(valor)
+            self._indice[(valor.examen_id, valor.sexo)].append(valor)
+        for lista in self._indice.values():
+            lista.sort(key=lambda v: (v.edad_minima, v.pk))
+        self._minimos = {clave: [v.edad_minima for v in lista] for clave, lista in self._indice.items()}
+
+    @classmethod
+    def cargar(cls, examen_ids):
+        """
+        Resolvedor con los valores activos de los exámenes dados (lista,
+        subconsulta de ids o un Q sobre examen_id), en una sola consulta.
+        """
+        filtro = examen_ids if isinstance(examen_ids, Q) else Q(examen_id__in=examen_ids)
+        return cls(ValorReferencia.objects.filter(
+            filtro, estado='Activo'
+        ).select_related('examen').order_by('examen__categoria__nombre', 'examen__nombre', 'pk'))
+
+    def examenes(self):
+        """ Ids de los exámenes cargados, en orden de reporte (categoría, nombre). """
+        return list(self._por_examen)
+
+    def rangos(self, examen_id):
+        """ Todos los valores activos del examen. """
+        return self._por_examen.get(examen_id, [])
+
+    def resolver(self, examen_id, sexo, edad):
+        """
+        Valor de referencia aplicable al paciente: primero los del mismo sexo y
+        luego los 'Indistinto'. None si ninguno cubre la edad (o no se conoce).
+        """
+        if edad is None:
+            return None
+        for clave in ((examen_id, sexo), (examen_id, 'Indistinto')):
+            lista = self._indice.get(clave)
+            if not lista:
+                continue
+            # Último intervalo que empieza en o antes de la edad; si se solapan
+            # y ese no la cubre, se prueba hacia atrás.
+            i = bisect_right(self._minimos[clave], edad) - 1
+            while i >= 0:
+                if lista[i].edad_maxima >= edad:
+                    return lista[i]
+                i -= 1
+        return None
+
+    def parametros(self, sexo, edad):
+        """
+        Un parámetro por examen (el valor que aplica al paciente). Si ninguno
+        aplica se devuelven todos los del examen, para no bloquear el ingreso.
+        """
+        parametros = []
+        for examen_id in self._por_examen:
+            valor = self.resolver(examen_id, sexo, edad)
+            parametros.extend([valor] if valor else self.rangos(examen_id))
+        return parametros
+
+
+def edad_en_toma(paciente, fecha_toma, respaldo):
+    """
+    Edad del paciente a la fecha de toma de la muestra (o `respaldo`, ej: la
+    fecha de la orden, si aún no hay muestras).
+    """
+    fecha = fecha_toma or respaldo
+    if fecha is None:
+        return paciente.edad
+    if hasattr(fecha, 'hour'):
+        fecha = timezone.localtime(fecha) if timezone.is_aware(fecha) else fecha
+        fecha = fecha.date()
+    return paciente.edad_en(fecha)
+
+
+# --- Banderas de resultados fuera de rango ---
+# Cada rango_referencia se compila una vez a un predicado que recibe el valor
+# obtenido (texto) y devuelve la bandera: 'N' normal, 'L'/'H' bajo/alto,
+# 'LL'/'HH' crítico (fuera de critico_minimo/critico_maximo), 'A' anormal
+# (cualitativo distinto al esperado) o '' si no se puede evaluar.
+BANDERAS_ANORMALES = ('L', 'H', 'LL', 'HH', 'A')
+
+_NUMERO = r'[-+]?\d+(?:[.,]\d+)?'
+_INTERVALO = re.compile(rf'^({_NUMERO})\s*(?:-|–|a)\s*({_NUMERO})')
+_LIMITE = re.compile(rf'^(<=|>=|≤|≥|<|>|hasta|menor (?:a|de)|mayor (?:a|de))\s*({_NUMERO})')
+_COMPARADORES = {'≤': '<=', '≥': '>=', 'hasta': '<=', 'menor a': '<', 'menor de': '<', 'mayor a': '>', 'mayor de': '>'}
+
+# pk -> (firma del rango, predicado). Se descarta al editar el ValorReferencia
+# (ver signals); la firma evita usar un predicado viejo si el aviso no llegó.
+_predicados = {}
+
+
+def _texto(valor):
+    """ Minúsculas, sin tildes ni espacios extra. """
+    valor = unicodedata.normalize('NFKD', valor or '').encode('ascii', 'ignore').decode()
+    return ' '.join(valor.lower().split())
+
+
+def _numero(texto):
+    """ Decimal del texto ('120.5', '120,5', '<0.5' -> 0.5) o None. """
+    coincidencia = re.search(_NUMERO, texto or '')
+    if not coincidencia:
+        return None
+    try:
+        return Decimal(coincidencia.group().replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+def limites_rango(rango):
+    """
+    (mínimo, incluye_mínimo, máximo, incluye_máximo) de un rango numérico
+    ("70-110", "<5", ">=1.2", "hasta 10"), o None si no es numérico.
+    """
+    texto = ' '.join((rango or '').strip().lower().split())
+    intervalo = _INTERVALO.match(texto)
+    if intervalo:
+        minimo, maximo = (_numero(n) for n in intervalo.groups())
+        return minimo, True, maximo, True
+    limite = _LIMITE.match(texto)
+    if limite:
+        comparador = _COMPARADORES.get(limite.group(1), limite.group(1))
+        numero = _numero(limite.group(2))
+        if comparador.startswith('<'):
+            return None, True, numero, comparador == '<='
+        return numero, comparador == '>=', None, True
+    return None
+
+
+def compilar_rango(rango, tipo='Cuantitativo', critico_minimo=None, critico_maximo=None):
+    """
+    Predicado valor -> bandera para un rango numérico (ver limites_rango) o
+    un valor cualitativo esperado ("Negativo").
+    """
+    limites = limites_rango(rango)
+    if limites is None:
+        esperado = _texto(rango)
+        if tipo != 'Cualitativo' or not esperado:
+            return lambda valor: ''
+        return lambda valor: '' if not _texto(valor) else ('N' if _texto(valor) == esperado else 'A')
+    minimo, incluye_minimo, maximo, incluye_maximo = limites
+
+    def evaluar(valor):
+        numero = _numero(valor)
+        if numero is None:
+            return ''
+        if critico_minimo is not None and numero < critico_minimo:
+            return 'LL'
+        if critico_maximo is not None and numero > critico_maximo:
+            return 'HH'
+        if minimo is not None and (numero < minimo or (numero == minimo and not incluye_minimo)):
+            return 'L'
+        if maximo is not None and (numero > maximo or (numero == maximo and not incluye_maximo)):
+            return 'H'
+        return 'N'
+    return evaluar
+
+
+def predicado(valor_referencia):
+    """ Predicado compilado del ValorReferencia (en caché por pk). """
+    firma = (
+        valor_referencia.rango_referencia, valor_referencia.tipo_resultado,
+        valor_referencia.critico_minimo, valor_referencia.critico_maximo,
+    )
+    guardado = _predicados.get(valor_referencia.pk)
+    if guardado is None or guardado[0] != firma:
+        guardado = (firma, compilar_rango(*firma))
+        if valor_referencia.pk is not None:
+            _predicados[valor_referencia.pk] = guardado
+    return guardado[1]
+
+
+def invalidar_predicado(pk):
+    _predicados.pop(pk, None)
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ValorReferencia
+from .rangos import invalidar_predicado
+
+
+@receiver([post_save, post_delete], sender=ValorReferencia)
+def invalidar_predicado_rango(sender, instance, **kwargs):
+    invalidar_predicado(instance.pk)
@@ -1,3 +1,104 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from categorias.models import CategoriaExamen
+from tipos_muestras.models import TipoMuestra
+from .models import Examen, ValorReferencia
+from .rangos import ResolvedorRangos, compilar_rango, predicado
+
+
+class ResolvedorRangosTests(SimpleTestCase):
+
+    def setUp(self):
+        def valor(pk, examen_id, sexo, minima, maxima, rango):
+            return ValorReferencia(
+                pk=pk, examen_id=examen_id, sexo=sexo,
+                edad_minima=minima, edad_maxima=maxima, rango_referencia=rango
+            )
+
+        self.resolvedor = ResolvedorRangos([
+            valor(1, 1, 'Indistinto', 0, 120, 'general'),
+            valor(2, 1, 'F', 18, 49, 'mujer fértil'),
+            valor(3, 1, 'F', 50, 120, 'mujer'),
+            valor(4, 1, 'M', 0, 17, 'niño'),
+            valor(5, 1, 'M', 10, 120, 'hombre'),  # Se solapa con 'niño'
+            valor(6, 2, 'M', 18, 120, 'solo adultos'),
+        ])
+
+    def rango(self, examen_id, sexo, edad):
+        valor = self.resolvedor.resolver(examen_id, sexo, edad)
+        return valor and valor.rango_referencia
+
+    def test_prefiere_el_sexo_del_paciente(self):
+        self.assertEqual(self.rango(1, 'F', 30), 'mujer fértil')
+        self.assertEqual(self.rango(1, 'F', 50), 'mujer')
+        self.assertEqual(self.rango(1, 'F', 49), 'mujer fértil')
+
+    def test_cae_en_indistinto(self):
+        self.assertEqual(self.rango(1, 'F', 12), 'general')
+
+    def test_intervalos_solapados(self):
+        self.assertEqual(self.rango(1, 'M', 5), 'niño')
+        self.assertEqual(self.rango(1, 'M', 15), 'hombre')  # El de mayor edad mínima
+
+    def test_sin_rango_aplicable(self):
+        self.assertIsNone(self.rango(2, 'M', 10))
+        self.assertIsNone(self.rango(2, 'F', 30))
+        self.assertIsNone(self.rango(1, 'F', None))
+        self.assertIsNone(self.rango(99, 'F', 30))
+
+    def test_parametros_uno_por_examen(self):
+        parametros = self.resolvedor.parametros('F', 30)
+        # El examen 2 no tiene valor para mujeres: se muestran todos los suyos
+        self.assertEqual([p.pk for p in parametros], [2, 6])
+
+
+class BanderasTests(SimpleTestCase):
+
+    def banderas(self, rango, valores, **kwargs):
+        evaluar = compilar_rango(rango, **kwargs)
+        return [evaluar(valor) for valor in valores]
+
+    def test_intervalo(self):
+        self.assertEqual(
+            self.banderas('70-110', ['69.9', '70', '95', '110', '110,5', '']),
+            ['L', 'N', 'N', 'N', 'H', '']
+        )
+        self.assertEqual(self.banderas('3,5 – 5,0 mg/dL', ['3.4', '5']), ['L', 'N'])
+
+    def test_limites(self):
+        self.assertEqual(self.banderas('<5', ['4.9', '5', '<1']), ['N', 'H', 'N'])
+        self.assertEqual(self.banderas('>=1.2', ['1.2', '1.1']), ['N', 'L'])
+        self.assertEqual(self.banderas('> 1.2', ['1.2']), ['L'])
+        self.assertEqual(self.banderas('Hasta 10', ['10', '11']), ['N', 'H'])
+
+    def test_criticos(self):
+        evaluar = compilar_rango('70-110', critico_minimo=Decimal('40'), critico_maximo=Decimal('400'))
+        self.assertEqual([evaluar(v) for v in ['39', '60', '401']], ['LL', 'L', 'HH'])
+
+    def test_cualitativo(self):
+        evaluar = compilar_rango('Negativo', tipo='Cualitativo')
+        self.assertEqual([evaluar(v) for v in ['negativo', 'Positivo', '']], ['N', 'A', ''])
+        # Texto en un rango cuantitativo o valor no numérico: no se evalúa
+        self.assertEqual(self.banderas('Ver comentario', ['5']), [''])
+        self.assertEqual(self.banderas('70-110', ['Hemolizada']), [''])
+
+
+class PredicadoEnCacheTests(TestCase):
+
+    def test_se_invalida_al_editar_el_rango(self):
+        examen = Examen.objects.create(
+            nombre='Glucosa', codigo='GLU', precio=Decimal('5.00'),
+            categoria=CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea'),
+            tipo_muestra=TipoMuestra.objects.create(
+                nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+            ),
+        )
+        valor = ValorReferencia.objects.create(examen=examen, rango_referencia='70-110')
+        self.assertIs(predicado(valor), predicado(ValorReferencia.objects.get(pk=valor.pk)))
+        self.assertEqual(predicado(valor)('120'), 'H')
+
+        valor.rango_referencia = '70-140'
+        valor.save()
+        self.assertEqual(predicado(ValorReferencia.objects.get(pk=valor.pk))('120'), 'N')
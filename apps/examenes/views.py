@@ -2,23 +2,15 @@ from django.urls import reverse_lazy, reverse
 from django.contrib import messages
 from django.shortcuts import redirect, get_object_or_404
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from usuarios.permisos import CapacidadRequeridaMixin
 from django.core.exceptions import ValidationError
 from django.db.models.deletion import ProtectedError
 from .models import Examen, MetodoExamen, ValorReferencia
 from .forms import ExamenForm, MetodoExamenForm, ValorReferenciaForm
 
 # --- Mixin de Seguridad (No cambia) ---
-class AdminTecnicoJefeRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
-    def test_func(self):
-        if not self.request.user.is_authenticated or not self.request.user.rol:
-            return False
-        roles_permitidos = ['Administrador', 'Tecnico', 'Jefe de Laboratorio']
-        return self.request.user.rol.nombre in roles_permitidos
-    
-    def handle_no_permission(self):
-        messages.error(self.request, "No tienes permiso para acceder a esta página.")
-        return redirect('dashboard' if self.request.user.is_authenticated else 'login')
+class AdminTecnicoJefeRequiredMixin(CapacidadRequeridaMixin):
+    capacidad = 'gestionar_examenes'
 
 # ===============================================
 # === CRUD para Examen (Principal)
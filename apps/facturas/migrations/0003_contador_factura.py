@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+def inicializar_contadores(apps, schema_editor):
+    """ Continúa la numeración existente: el contador arranca en el mayor correlativo emitido. """
+    Factura = apps.get_model('facturas', 'Factura')
+    ContadorFactura = apps.get_model('facturas', 'ContadorFactura')
+    for prefijo in ('FAC', 'CCF'):
+        ultimo = 0
+        for numero in Factura.objects.filter(numero_factura__startswith=f'{prefijo}-').values_list('numero_factura', flat=True).iterator():
+            correlativo = numero.split('-', 1)[1]
+            # Los números con fecha (respaldo del generador anterior: %Y%m%d%H%M) no cuentan
+            if correlativo.isdigit() and len(correlativo) < 12:
+                ultimo = max(ultimo, int(correlativo))
+        ContadorFactura.objects.create(prefijo=prefijo, ultimo=ultimo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facturas', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorFactura',
+            fields=[
+                ('prefijo', models.CharField(max_length=3, primary_key=True, serialize=False)),
+                ('ultimo', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Facturas',
+                'verbose_name_plural': 'Contadores de Facturas',
+                'db_table': 'Facturas_Contadores',
+            },
+        ),
+        migrations.RunPython(inicializar_contadores, migrations.RunPython.noop),
+    ]
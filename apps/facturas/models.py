@@ -56,4 +56,22 @@ class Factura(models.Model):
         db_table = 'Facturas'
         verbose_name = "Factura"
         verbose_name_plural = "Facturas"
-        ordering = ['-fecha_emision']
\ No newline at end of file
+        ordering = ['-fecha_emision']
+
+
+class ContadorFactura(models.Model):
+    """
+    Último correlativo emitido por prefijo (FAC, CCF). Se avanza con un solo
+    UPDATE atómico (ver facturas.utils.reservar_numeros) en lugar de leer la
+    última factura y sumar uno, que repetía números entre cajeros simultáneos.
+    """
+    prefijo = models.CharField(max_length=3, primary_key=True)
+    ultimo = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.prefijo}: {self.ultimo}"
+
+    class Meta:
+        db_table = 'Facturas_Contadores'
+        verbose_name = "Contador de Facturas"
+        verbose_name_plural = "Contadores de Facturas"
@@ -1,3 +1,71 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from . import utils
+from .models import ContadorFactura
+from .utils import generar_numero_factura, proximo_numero_factura, reservar_numeros
+
+
+class NumeracionFacturasTests(TestCase):
+
+    def setUp(self):
+        utils._bloques.clear()
+        ContadorFactura.objects.update_or_create(prefijo='FAC', defaults={'ultimo': 0})
+
+    def test_correlativo_por_prefijo(self):
+        ContadorFactura.objects.filter(prefijo='FAC').update(ultimo=41)
+        self.assertEqual(proximo_numero_factura('Particular'), 'FAC-000042')
+        self.assertEqual(proximo_numero_factura('Particular'), 'FAC-000042')  # Mostrar no reserva
+        self.assertEqual(generar_numero_factura('Particular'), 'FAC-000042')
+        self.assertEqual(generar_numero_factura('Particular'), 'FAC-000043')
+        self.assertEqual(generar_numero_factura('Convenio'), 'CCF-000001')
+
+    def test_prefijo_nuevo_crea_su_contador(self):
+        self.assertEqual(reservar_numeros('TST', 5), 5)
+        self.assertEqual(reservar_numeros('TST'), 6)
+
+    @override_settings(FACTURAS_BLOQUE_NUMEROS=10)
+    def test_bloques_por_proceso(self):
+        with self.assertNumQueries(1):
+            numeros = [generar_numero_factura('Particular') for _ in range(10)]
+        self.assertEqual(numeros[0], 'FAC-000001')
+        self.assertEqual(numeros[-1], 'FAC-000010')
+        self.assertEqual(ContadorFactura.objects.get(prefijo='FAC').ultimo, 10)
+        generar_numero_factura('Particular')
+        self.assertEqual(ContadorFactura.objects.get(prefijo='FAC').ultimo, 20)
+
+
+class NumeracionConcurrenteTests(TransactionTestCase):
+    """ Muchos hilos (cada uno con su conexión) emitiendo números a la vez. """
+    HILOS = 8
+    POR_HILO = 25
+
+    def setUp(self):
+        utils._bloques.clear()
+
+    def emitir(self, bloque):
+        inicio = threading.Barrier(self.HILOS)
+
+        def trabajar(_):
+            try:
+                inicio.wait()
+                return [generar_numero_factura('Particular') for _ in range(self.POR_HILO)]
+            finally:
+                connection.close()
+
+        with override_settings(FACTURAS_BLOQUE_NUMEROS=bloque):
+            with ThreadPoolExecutor(self.HILOS) as pool:
+                return [numero for lote in pool.map(trabajar, range(self.HILOS)) for numero in lote]
+
+    def test_sin_repetidos_ni_huecos(self):
+        numeros = self.emitir(bloque=1)
+        total = self.HILOS * self.POR_HILO
+        self.assertEqual(len(set(numeros)), total)
+        self.assertEqual(sorted(numeros), [f'FAC-{n:06d}' for n in range(1, total + 1)])
+
+    def test_sin_repetidos_con_bloques(self):
+        numeros = self.emitir(bloque=7)
+        self.assertEqual(len(set(numeros)), self.HILOS * self.POR_HILO)
@@ -1,27 +1,96 @@
-from datetime import timezone
-from .models import Factura
+import threading
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from .models import ContadorFactura
+
+# --- Numeración correlativa de facturas ---
+# Cada prefijo tiene una fila en ContadorFactura que se avanza con un único
+# UPDATE que devuelve el nuevo valor (OUTPUT en SQL Server, RETURNING en
+# SQLite/PostgreSQL): dos cajeros simultáneos nunca obtienen el mismo número.
+# Fuera de una transacción el UPDATE se confirma de inmediato (la fila queda
+# bloqueada solo durante esa sentencia); dentro de una, hasta el commit.
+#
+# FACTURAS_BLOQUE_NUMEROS > 1 reserva los números de a bloques por proceso
+# (menos contención, pero deja huecos y números fuera de orden entre
+# procesos); por defecto 1: correlativo sin huecos.
+_bloques = {}
+_candado = threading.Lock()
+
+
+def prefijo_factura(tipo_factura):
+    return 'CCF' if tipo_factura == 'Convenio' else 'FAC'
+
+
+def formatear_numero(prefijo, numero):
+    """ Formato: FAC-000001 o CCF-000001 """
+    return f"{prefijo}-{numero:06d}"
+
+
+def reservar_numeros(prefijo, cantidad=1):
+    """ Avanza el contador en `cantidad` y devuelve el último número reservado. """
+    while True:
+        ultimo = _avanzar(prefijo, cantidad)
+        if ultimo is not None:
+            return ultimo
+        _crear_contador(prefijo)
+
+
+def _avanzar(prefijo, cantidad):
+    """ Nuevo valor del contador, o None si el prefijo aún no tiene fila. """
+    tabla = ContadorFactura._meta.db_table
+    if connection.vendor == 'microsoft':
+        sql = f"UPDATE {tabla} SET ultimo = ultimo + %s OUTPUT inserted.ultimo WHERE prefijo = %s"
+    elif connection.features.can_return_columns_from_insert: # RETURNING: PostgreSQL, SQLite >= 3.35
+        sql = f"UPDATE {tabla} SET ultimo = ultimo + %s WHERE prefijo = %s RETURNING ultimo"
+    else:
+        with transaction.atomic():
+            contador = ContadorFactura.objects.select_for_update().filter(prefijo=prefijo).first()
+            if contador is None:
+                return None
+            contador.ultimo += cantidad
+            contador.save(update_fields=['ultimo'])
+            return contador.ultimo
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [cantidad, prefijo])
+        fila = cursor.fetchone()
+    return fila[0] if fila else None
+
+
+def _crear_contador(prefijo):
+    # Primer uso del prefijo: si otro proceso lo crea a la vez, gana uno y se reintenta el UPDATE
+    try:
+        with transaction.atomic():
+            ContadorFactura.objects.create(prefijo=prefijo)
+    except IntegrityError:
+        pass
+
+
+def siguiente_numero(prefijo):
+    """ Siguiente número del prefijo, tomado del bloque reservado por este proceso. """
+    tamano = max(1, getattr(settings, 'FACTURAS_BLOQUE_NUMEROS', 1))
+    if tamano == 1:
+        return reservar_numeros(prefijo)
+    with _candado:
+        siguiente, limite = _bloques.get(prefijo, (1, 0))
+        if siguiente > limite:
+            limite = reservar_numeros(prefijo, tamano)
+            siguiente = limite - tamano + 1
+        _bloques[prefijo] = (siguiente + 1, limite)
+        return siguiente
+
 
 def generar_numero_factura(tipo_factura):
     """
-    Genera el siguiente número correlativo basado en el tipo.
+    Reserva y devuelve el siguiente número correlativo según el tipo.
     Formato: FAC-000001 o CCF-000001
     """
-    prefijo = 'CCF' if tipo_factura == 'Convenio' else 'FAC'
-    
-    # Buscar la última factura de este tipo
-    ultima_factura = Factura.objects.filter(
-        numero_factura__startswith=prefijo
-    ).order_by('factura_id').last()
+    prefijo = prefijo_factura(tipo_factura)
+    return formatear_numero(prefijo, siguiente_numero(prefijo))
 
-    if not ultima_factura:
-        return f"{prefijo}-000001"
 
-    # Extraer el número, convertir a int e incrementar
-    try:
-        ultimo_numero = int(ultima_factura.numero_factura.split('-')[1])
-        nuevo_numero = ultimo_numero + 1
-        # Rellenar con ceros a la izquierda (6 dígitos)
-        return f"{prefijo}-{str(nuevo_numero).zfill(6)}"
-    except (IndexError, ValueError):
-        # Fallback por si el formato manual anterior era diferente
-        return f"{prefijo}-{timezone.now().strftime('%Y%m%d%H%M')}"
\ No newline at end of file
+def proximo_numero_factura(tipo_factura):
+    """ Número que probablemente tendrá la próxima factura (solo para mostrar: no reserva). """
+    prefijo = prefijo_factura(tipo_factura)
+    ultimo = ContadorFactura.objects.filter(prefijo=prefijo).values_list('ultimo', flat=True).first() or 0
+    return formatear_numero(prefijo, ultimo + 1)
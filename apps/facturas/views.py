@@ -1,95 +1,28 @@
-import os
-from django.conf import settings
-from django.http import HttpResponse
-from django.template.loader import get_template
-from django.contrib.staticfiles import finders
 from django.views.generic import CreateView, DetailView, View
 from django.shortcuts import redirect, get_object_or_404
 from django.urls import reverse
 from django.contrib import messages
-from django.utils import timezone
 
-# Importamos xhtml2pdf
-from xhtml2pdf import pisa
-
-from ordenes.models import Orden
+from ordenes.models import Orden, TrabajoPDF
 from .models import Factura
 from .forms import FacturaForm
-from .utils import generar_numero_factura
-from ordenes.views import PersonalAutorizadoRequiredMixin
-
-# --- FUNCIÓN DE AYUDA PARA ESTÁTICOS (Necesaria para xhtml2pdf) ---
-def link_callback(uri, rel):
-    """
-    Convierte URLs de HTML (ej: /static/css/style.css) a rutas absolutas
-    del sistema de archivos (C:\Protecto\static\css\style.css) para que
-    xhtml2pdf pueda encontrarlos.
-    """
-    result = finders.find(uri)
-    if result:
-        if not isinstance(result, (list, tuple)):
-            result = [result]
-        result = list(os.path.realpath(path) for path in result)
-        path=result[0]
-    else:
-        sUrl = settings.STATIC_URL        # Typically /static/
-        sRoot = settings.STATIC_ROOT      # Typically /home/userX/project_static/
-        mUrl = settings.MEDIA_URL         # Typically /media/
-        mRoot = settings.MEDIA_ROOT       # Typically /home/userX/project_media/
-
-        if uri.startswith(mUrl):
-            path = os.path.join(mRoot, uri.replace(mUrl, ""))
-        elif uri.startswith(sUrl):
-            path = os.path.join(sRoot, uri.replace(sUrl, ""))
-        else:
-            return uri
-
-    # Asegurarse de que el archivo exista
-    if not os.path.isfile(path):
-        raise Exception(
-            'media URI must start with %s or %s' % (sUrl, mUrl)
-        )
-    return path
+from .utils import generar_numero_factura, proximo_numero_factura
+from ordenes.views import PersonalAutorizadoRequiredMixin, pdf_desde_cache, respuesta_trabajo_pdf
 
 # --- VISTAS ---
 
 class FacturaPDFView(PersonalAutorizadoRequiredMixin, View):
+    """
+    PDF de la factura: desde la caché en disco si ya se generó con los mismos
+    datos; si no, se encola y se genera en segundo plano (procesar_pdfs).
+    """
     def get(self, request, pk):
         factura = get_object_or_404(Factura, pk=pk)
-        orden = factura.orden
-        
-        template_path = 'facturas/factura_pdf.html'
-        context = {
-            'factura': factura,
-            'items_examen': orden.ordenexamen_set.select_related('examen').all(),
-            'items_paquete': orden.ordenpaquete_set.select_related('paquete').all(),
-            'fecha_impresion': timezone.now(),
-            'empresa': {
-                'nombre': 'Laboratorio Clínico Avanzado',
-                'direccion': 'Calle Principal #123, San Salvador',
-                'telefono': '2222-0000',
-                'email': 'info@labavanzado.com'
-            }
-        }
-        
-        # Crear respuesta Django
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename="Factura_{factura.numero_factura}.pdf"'
-        
-        # Buscar template
-        template = get_template(template_path)
-        html = template.render(context)
-
-        # Crear PDF
-        pisa_status = pisa.CreatePDF(
-            html, dest=response, link_callback=link_callback
-        )
-
-        # Si hay error
-        if pisa_status.err:
-            return HttpResponse('Tuvimos algunos errores <pre>' + html + '</pre>')
-            
-        return response
+        respuesta = pdf_desde_cache(request, 'Factura', factura.pk, f"Factura_{factura.numero_factura}.pdf")
+        if respuesta:
+            return respuesta
+        trabajo = TrabajoPDF.encolar('Factura', factura.pk, request.user)
+        return respuesta_trabajo_pdf(request, trabajo)
 
 # (El resto de vistas CreateView y DetailView se quedan IGUAL que antes)
 class FacturaCreateView(PersonalAutorizadoRequiredMixin, CreateView):
@@ -109,7 +42,7 @@ class FacturaCreateView(PersonalAutorizadoRequiredMixin, CreateView):
         context['titulo'] = f"Generar Factura Automática - Orden #{self.orden.pk}"
         context['orden'] = self.orden
         tipo = 'Convenio' if self.orden.convenio else 'Particular'
-        context['proximo_numero'] = generar_numero_factura(tipo)
+        context['proximo_numero'] = proximo_numero_factura(tipo)
         return context
 
     def form_valid(self, form):
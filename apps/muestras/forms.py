@@ -5,12 +5,11 @@ from usuarios.models import Usuario
 class MuestraCreateForm(forms.ModelForm):
     class Meta:
         model = Muestra
-        fields = ['tipo_muestra', 'responsable_toma', 'codigo_barras', 'fecha_toma', 'observaciones']
+        # El código de barras no se edita: se asigna al guardar (ver muestras.utils)
+        fields = ['tipo_muestra', 'responsable_toma', 'fecha_toma', 'observaciones']
         widgets = {
             'tipo_muestra': forms.Select(attrs={'class': 'form-select'}),
             'responsable_toma': forms.Select(attrs={'class': 'form-select'}),
-            # CAMBIO: Readonly para el código automático
-            'codigo_barras': forms.TextInput(attrs={'class': 'form-control bg-light', 'readonly': 'readonly'}),
             'fecha_toma': forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}),
             'observaciones': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def inicializar_contadores(apps, schema_editor):
+    """ Continúa los códigos existentes: cada orden arranca en su mayor correlativo (M-{orden}-{NN}). """
+    Muestra = apps.get_model('muestras', 'Muestra')
+    ContadorMuestra = apps.get_model('muestras', 'ContadorMuestra')
+    ultimos = {}
+    for orden_id, codigo in Muestra.objects.values_list('orden_id', 'codigo_barras').iterator():
+        correlativo = 0
+        if codigo and codigo.startswith(f'M-{orden_id}-') and codigo.rsplit('-', 1)[1].isdigit():
+            correlativo = int(codigo.rsplit('-', 1)[1])
+        ultimos[orden_id] = max(ultimos.get(orden_id, 0), correlativo)
+    ContadorMuestra.objects.bulk_create(
+        [ContadorMuestra(orden_id=orden_id, ultimo=ultimo) for orden_id, ultimo in ultimos.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('muestras', '0002_initial'),
+        ('ordenes', '0003_trabajo_pdf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorMuestra',
+            fields=[
+                ('orden', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='contador_muestras', serialize=False, to='ordenes.orden')),
+                ('ultimo', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Muestras',
+                'verbose_name_plural': 'Contadores de Muestras',
+                'db_table': 'Muestras_Contadores',
+            },
+        ),
+        migrations.RunPython(inicializar_contadores, migrations.RunPython.noop),
+    ]
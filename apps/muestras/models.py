@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import OuterRef, Subquery
 from django.utils import timezone
+from examenes.models import Examen
 from ordenes.models import Orden
 from tipos_muestras.models import TipoMuestra # El 'tipo' de muestra (Suero, Orina)
 from usuarios.models import Usuario # El 'responsable' (Usuario del sistema)
@@ -58,4 +60,50 @@ class Muestra(models.Model):
         db_table = 'Muestras'
         verbose_name = "Muestra de Paciente"
         verbose_name_plural = "Muestras de Pacientes"
-        ordering = ['-fecha_toma']
\ No newline at end of file
+        ordering = ['-fecha_toma']
+
+
+class ContadorMuestra(models.Model):
+    """
+    Último correlativo de código de barras emitido por orden. Se avanza con
+    un solo UPDATE atómico (ver muestras.utils.reservar_codigos) en lugar de
+    contar las muestras de la orden, que repetía códigos al borrar una
+    muestra o al registrar dos a la vez.
+    """
+    orden = models.OneToOneField(
+        Orden,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='contador_muestras'
+    )
+    ultimo = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Orden #{self.orden_id}: {self.ultimo}"
+
+    class Meta:
+        db_table = 'Muestras_Contadores'
+        verbose_name = "Contador de Muestras"
+        verbose_name_plural = "Contadores de Muestras"
+
+
+def primera_toma(campo_orden='pk'):
+    """
+    Subconsulta con la fecha de la primera muestra tomada de la orden
+    referenciada por `campo_orden` (para anotar órdenes o resultados).
+    """
+    return Subquery(
+        Muestra.objects.filter(orden_id=OuterRef(campo_orden)).order_by('fecha_toma').values('fecha_toma')[:1]
+    )
+
+
+def tipos_pendientes(orden):
+    """
+    Tipos de muestra que piden los exámenes de la orden (directos o por
+    paquete) y que aún no tienen muestra registrada, en una sola consulta.
+    """
+    return TipoMuestra.objects.filter(
+        pk__in=Examen.objects.filter(orden.filtro_examenes('pk')).values('tipo_muestra_id')
+    ).exclude(
+        pk__in=Muestra.objects.filter(orden_id=orden.pk).values('tipo_muestra_id')
+    ).order_by('nombre')
@@ -1,3 +1,195 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from categorias.models import CategoriaExamen
+from examenes.models import Examen
+from ordenes.models import Orden, OrdenExamen, OrdenPaquete
+from pacientes.models import Paciente
+from paquetes.models import Paquete, PaqueteExamen
+from resultados.models import Resultado
+from roles.models import Rol
+from tipos_muestras.models import TipoMuestra
+from usuarios.models import Usuario
+from .models import ContadorMuestra, Muestra, tipos_pendientes
+from .utils import generar_codigo_muestra, registrar_muestras_pendientes, reservar_codigos
+
+
+def crear_datos():
+    """ Un técnico, una paciente y una orden con un examen de sangre y uno de orina. """
+    categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+    suero = TipoMuestra.objects.create(nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C')
+    orina = TipoMuestra.objects.create(nombre='Orina', descripcion='Frasco estéril', condiciones_almacenamiento='2-8 °C')
+    rol = Rol.objects.create(nombre='Técnico', descripcion='Toma muestras')
+    usuario = Usuario.objects.create_user(
+        username='tecnico', password='clave-segura-123', email='tecnico@example.com',
+        nombre='Tomás', apellido='Técnico', dui='09876543-2', rol=rol
+    )
+    paciente = Paciente.objects.create(
+        nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+        dui='01234567-8', telefono='22223333', correo='ana@example.com'
+    )
+    orden = Orden.objects.create(paciente=paciente)
+    for i, tipo in enumerate((suero, orina)):
+        examen = Examen.objects.create(
+            nombre=f'Examen {i}', codigo=f'EX{i}', precio=Decimal('10.00'), categoria=categoria, tipo_muestra=tipo
+        )
+        OrdenExamen.objects.create(orden=orden, examen=examen, precio_en_orden=examen.precio)
+    return usuario, orden, suero, orina
+
+
+class CodigosMuestraTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario, cls.orden, cls.suero, cls.orina = crear_datos()
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_reserva_por_orden(self):
+        otra = Orden.objects.create(paciente=self.orden.paciente)
+        self.assertEqual(reservar_codigos(self.orden.pk, 3), [f'M-{self.orden.pk}-{n:02d}' for n in (1, 2, 3)])
+        self.assertEqual(generar_codigo_muestra(self.orden.pk), f'M-{self.orden.pk}-04')
+        self.assertEqual(generar_codigo_muestra(otra.pk), f'M-{otra.pk}-01')
+        self.assertEqual(reservar_codigos(self.orden.pk, 0), [])
+
+    def test_borrar_una_muestra_no_repite_codigos(self):
+        primera = Muestra.objects.create(
+            orden=self.orden, tipo_muestra=self.suero, responsable_toma=self.usuario,
+            codigo_barras=generar_codigo_muestra(self.orden.pk)
+        )
+        Muestra.objects.create(
+            orden=self.orden, tipo_muestra=self.orina, responsable_toma=self.usuario,
+            codigo_barras=generar_codigo_muestra(self.orden.pk)
+        )
+        primera.delete()
+        # Contar las muestras (1) habría devuelto M-{orden}-02, que ya existe
+        self.assertEqual(generar_codigo_muestra(self.orden.pk), f'M-{self.orden.pk}-03')
+
+    def test_el_codigo_se_asigna_al_guardar(self):
+        url = reverse('muestra_create', kwargs={'orden_pk': self.orden.pk})
+        self.client.get(url)
+        self.assertFalse(ContadorMuestra.objects.filter(orden=self.orden).exists())  # Mostrar no reserva
+
+        respuesta = self.client.post(url, {
+            'tipo_muestra': self.suero.pk, 'responsable_toma': self.usuario.pk,
+            'fecha_toma': '2026-10-18T08:30', 'codigo_barras': 'INVENTADO',
+        })
+        self.assertRedirects(respuesta, reverse('muestra_gestion', kwargs={'pk': self.orden.pk}))
+        muestra = Muestra.objects.get(orden=self.orden)
+        self.assertEqual(muestra.codigo_barras, f'M-{self.orden.pk}-01')
+        self.orden.refresh_from_db()
+        self.assertEqual(self.orden.estado, 'En Proceso')
+        self.assertTrue(Resultado.objects.filter(orden=self.orden).exists())
+
+    def test_etiquetas_de_todos_los_tubos(self):
+        Muestra.objects.create(orden=self.orden, tipo_muestra=self.suero, responsable_toma=self.usuario)
+        Muestra.objects.create(orden=self.orden, tipo_muestra=self.orina, responsable_toma=self.usuario)
+        url = reverse('muestra_etiquetas', kwargs={'pk': self.orden.pk})
+
+        respuesta = self.client.post(url)
+        etiquetas = respuesta.json()['etiquetas']
+        self.assertEqual([e['codigo_barras'] for e in etiquetas], [f'M-{self.orden.pk}-01', f'M-{self.orden.pk}-02'])
+        self.assertEqual([e['tipo_muestra'] for e in etiquetas], ['Suero', 'Orina'])
+        self.assertEqual(ContadorMuestra.objects.get(orden=self.orden).ultimo, 2)
+
+        # Reimprimir no reserva códigos nuevos
+        self.assertEqual(self.client.post(url).json()['etiquetas'], etiquetas)
+        self.assertEqual(ContadorMuestra.objects.get(orden=self.orden).ultimo, 2)
+
+
+class RegistroPendientesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario, cls.orden, cls.suero, cls.orina = crear_datos()
+        # Varios paquetes: uno pide un tipo nuevo (heces) y los demás repiten suero
+        cls.heces = TipoMuestra.objects.create(nombre='Heces', descripcion='Frasco', condiciones_almacenamiento='Ambiente')
+        categoria = CategoriaExamen.objects.get()
+        for i, tipo in enumerate((cls.heces, cls.suero, cls.suero)):
+            examen = Examen.objects.create(
+                nombre=f'Perfil {i}', codigo=f'PF{i}', precio=Decimal('5.00'), categoria=categoria, tipo_muestra=tipo
+            )
+            paquete = Paquete.objects.create(nombre=f'Paquete {i}', precio=Decimal('5.00'))
+            PaqueteExamen.objects.create(paquete=paquete, examen=examen)
+            OrdenPaquete.objects.create(orden=cls.orden, paquete=paquete, precio_en_orden=paquete.precio)
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+        self.url = reverse('muestra_registrar_pendientes', kwargs={'pk': self.orden.pk})
+
+    def test_tipos_pendientes_en_una_consulta(self):
+        Muestra.objects.create(orden=self.orden, tipo_muestra=self.orina, responsable_toma=self.usuario)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(tipos_pendientes(self.orden)), [self.heces, self.suero])
+
+    def test_registra_todas_en_una_transaccion(self):
+        Muestra.objects.create(
+            orden=self.orden, tipo_muestra=self.orina, responsable_toma=self.usuario,
+            codigo_barras=generar_codigo_muestra(self.orden.pk)
+        )
+        respuesta = self.client.post(self.url)
+        self.assertRedirects(respuesta, reverse('muestra_gestion', kwargs={'pk': self.orden.pk}))
+
+        nuevas = Muestra.objects.filter(orden=self.orden).exclude(tipo_muestra=self.orina).order_by('codigo_barras')
+        self.assertEqual(
+            [(m.tipo_muestra, m.codigo_barras) for m in nuevas],
+            [(self.heces, f'M-{self.orden.pk}-02'), (self.suero, f'M-{self.orden.pk}-03')],
+        )
+        self.assertEqual({m.responsable_toma_id for m in nuevas}, {self.usuario.pk})
+        self.orden.refresh_from_db()
+        self.assertEqual(self.orden.estado, 'En Proceso')
+        self.assertEqual(Resultado.objects.filter(orden=self.orden).count(), 1)
+
+        # Repetir no crea tubos ni reserva códigos
+        self.client.post(self.url)
+        self.assertEqual(Muestra.objects.filter(orden=self.orden).count(), 3)
+        self.assertEqual(ContadorMuestra.objects.get(orden=self.orden).ultimo, 3)
+
+    def test_consultas_fijas(self):
+        # Las mismas consultas para 3 paquetes y 3 tubos que para un examen y un tubo
+        sola = Orden.objects.create(paciente=self.orden.paciente)
+        OrdenExamen.objects.create(orden=sola, examen=Examen.objects.get(codigo='EX0'), precio_en_orden=Decimal('10.00'))
+        consultas = []
+        for orden in (sola, self.orden):
+            with CaptureQueriesContext(connection) as capturadas:
+                registrar_muestras_pendientes(orden, self.usuario)
+            consultas.append(len(capturadas))
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertEqual(Muestra.objects.filter(orden=self.orden).count(), 3)
+
+    def test_orden_cerrada(self):
+        Orden.objects.filter(pk=self.orden.pk).update(estado='Cancelada')
+        self.client.post(self.url)
+        self.assertFalse(Muestra.objects.filter(orden=self.orden).exists())
+
+
+class CodigosConcurrentesTests(TransactionTestCase):
+    """ Varias estaciones reservando códigos de la misma orden a la vez. """
+    HILOS = 8
+    POR_HILO = 10
+
+    def test_sin_repetidos(self):
+        orden = crear_datos()[1]
+        inicio = threading.Barrier(self.HILOS)
+
+        def reservar(lote):
+            try:
+                inicio.wait()
+                return [codigo for _ in range(self.POR_HILO) for codigo in reservar_codigos(orden.pk, lote)]
+            finally:
+                connection.close()
+
+        # La mitad de los hilos reserva de a uno; la otra, de a tres (etiquetas de varios tubos)
+        with ThreadPoolExecutor(self.HILOS) as pool:
+            codigos = [c for lote in pool.map(reservar, [1, 3] * (self.HILOS // 2)) for c in lote]
+
+        total = self.HILOS // 2 * self.POR_HILO * 4
+        self.assertEqual(sorted(codigos), sorted(f'M-{orden.pk}-{n:02d}' for n in range(1, total + 1)))
@@ -12,6 +12,16 @@ urlpatterns = [
          views.MuestraGestionView.as_view(), 
          name='muestra_gestion'),
     
+    # Registrar todas las muestras pendientes de la orden
+    path('gestion/muestras/gestionar/<int:pk>/registrar-pendientes/', 
+         views.MuestraRegistrarPendientesView.as_view(), 
+         name='muestra_registrar_pendientes'),
+    
+    # Etiquetas de todos los tubos de la orden (JSON)
+    path('gestion/muestras/gestionar/<int:pk>/etiquetas/', 
+         views.MuestraEtiquetasView.as_view(), 
+         name='muestra_etiquetas'),
+    
     # --- CRUD Muestras (Acciones) ---
     path('gestion/orden/<int:orden_pk>/muestra/registrar/', 
          views.MuestraCreateView.as_view(), 
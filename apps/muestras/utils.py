@@ -1,18 +1,116 @@
-from .models import Muestra
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from ordenes.models import Orden
+from resultados.models import Resultado
+from .models import ContadorMuestra, Muestra, tipos_pendientes
 
-def generar_codigo_muestra(orden_id):
+# --- Códigos de barras de las muestras ---
+# Cada orden tiene una fila en ContadorMuestra que se avanza con un único
+# UPDATE que devuelve el nuevo valor (OUTPUT en SQL Server, RETURNING en
+# SQLite/PostgreSQL), igual que la numeración de facturas. Solo compiten
+# los registros de una misma orden, y la fila queda bloqueada hasta el
+# commit de la transacción que guarda la muestra: el código se asigna al
+# guardar, nunca al mostrar el formulario.
+
+
+def formatear_codigo(orden_id, correlativo):
     """
-    Genera un código único para la muestra basado en la orden.
     Formato: M-{ORDEN_ID}-{CORRELATIVO}
     Ejemplo: M-1005-01, M-1005-02
     """
-    # Contamos cuántas muestras hay ya en esta orden
-    count = Muestra.objects.filter(orden_id=orden_id).count()
-    
-    # El siguiente número es el conteo + 1
-    siguiente = count + 1
-    
-    # Formateamos con ceros a la izquierda (01, 02...)
-    codigo = f"M-{orden_id}-{str(siguiente).zfill(2)}"
-    
-    return codigo
\ No newline at end of file
+    return f"M-{orden_id}-{str(correlativo).zfill(2)}"
+
+
+def reservar_codigos(orden_id, cantidad=1):
+    """
+    Reserva `cantidad` códigos consecutivos de la orden en una sola
+    sentencia (ej: las etiquetas de todos los tubos) y los devuelve en orden.
+    """
+    if cantidad < 1:
+        return []
+    while True:
+        ultimo = _avanzar(orden_id, cantidad)
+        if ultimo is not None:
+            break
+        _crear_contador(orden_id)
+    return [formatear_codigo(orden_id, n) for n in range(ultimo - cantidad + 1, ultimo + 1)]
+
+
+def _avanzar(orden_id, cantidad):
+    """ Nuevo valor del contador, o None si la orden aún no tiene fila. """
+    tabla = ContadorMuestra._meta.db_table
+    if connection.vendor == 'microsoft':
+        sql = f"UPDATE {tabla} SET ultimo = ultimo + %s OUTPUT inserted.ultimo WHERE orden_id = %s"
+    elif connection.features.can_return_columns_from_insert: # RETURNING: PostgreSQL, SQLite >= 3.35
+        sql = f"UPDATE {tabla} SET ultimo = ultimo + %s WHERE orden_id = %s RETURNING ultimo"
+    else:
+        with transaction.atomic():
+            contador = ContadorMuestra.objects.select_for_update().filter(orden_id=orden_id).first()
+            if contador is None:
+                return None
+            contador.ultimo += cantidad
+            contador.save(update_fields=['ultimo'])
+            return contador.ultimo
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [cantidad, orden_id])
+        fila = cursor.fetchone()
+    return fila[0] if fila else None
+
+
+def _crear_contador(orden_id):
+    # Primera muestra de la orden: si otro registro la crea a la vez, gana uno y se reintenta el UPDATE
+    try:
+        with transaction.atomic():
+            ContadorMuestra.objects.create(orden_id=orden_id)
+    except IntegrityError:
+        pass
+
+
+def generar_codigo_muestra(orden_id):
+    """ Reserva y devuelve el siguiente código de la orden (llamar al guardar la muestra). """
+    return reservar_codigos(orden_id)[0]
+
+
+def asignar_codigos(muestras):
+    """
+    Asigna código a las muestras de una misma orden que no lo tienen, con una
+    sola reserva (las ya guardadas se actualizan con un bulk_update; las
+    nuevas quedan listas para su bulk_create). Devuelve las que recibieron código.
+    """
+    sin_codigo = [m for m in muestras if not m.codigo_barras]
+    if not sin_codigo:
+        return []
+    codigos = reservar_codigos(sin_codigo[0].orden_id, len(sin_codigo))
+    for muestra, codigo in zip(sin_codigo, codigos):
+        muestra.codigo_barras = codigo
+    Muestra.objects.bulk_update([m for m in sin_codigo if m.pk is not None], ['codigo_barras'])
+    return sin_codigo
+
+
+def registrar_muestras_pendientes(orden, responsable, fecha_toma=None):
+    """
+    Registra de una vez una muestra por cada tipo pendiente de la orden, con
+    sus códigos, pasa la orden a 'En Proceso' y crea su Resultado; todo en
+    una transacción. Devuelve las muestras creadas (vacío si no faltaba ninguna).
+    """
+    fecha_toma = fecha_toma or timezone.now()
+    with transaction.atomic():
+        # Bloquear la orden evita que dos registros simultáneos dupliquen los tubos
+        orden = Orden.objects.select_for_update().get(pk=orden.pk)
+        muestras = [
+            Muestra(
+                orden=orden, tipo_muestra_id=tipo_id, responsable_toma=responsable, fecha_toma=fecha_toma
+            )
+            for tipo_id in tipos_pendientes(orden).values_list('pk', flat=True)
+        ]
+        if not muestras:
+            return []
+        asignar_codigos(muestras)
+        Muestra.objects.bulk_create(muestras)
+
+        if orden.estado == 'Pendiente':
+            orden.estado = 'En Proceso'
+            orden.save(update_fields=['estado'])
+        Resultado.objects.get_or_create(orden=orden)
+    return muestras
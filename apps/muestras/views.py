@@ -1,14 +1,15 @@
 from django.urls import reverse
 from django.contrib import messages
+from django.db import transaction
+from django.http import JsonResponse
 from django.shortcuts import redirect, get_object_or_404
+from django.views import View
 from django.views.generic import CreateView, UpdateView, ListView
 from django.db.models import Q
-from examenes.models import Examen
 from ordenes.models import Orden
-from tipos_muestras.models import TipoMuestra
-from .models import Muestra
+from .models import Muestra, tipos_pendientes
 from .forms import MuestraCreateForm, MuestraUpdateForm
-from .utils import generar_codigo_muestra
+from .utils import asignar_codigos, generar_codigo_muestra, registrar_muestras_pendientes
 from ordenes.views import PersonalAutorizadoRequiredMixin # Reutilizamos el Mixin
 from resultados.models import Resultado
 # --- 2. Submenú: Gestión de Muestras ---
@@ -40,23 +41,11 @@ class MuestraGestionView(PersonalAutorizadoRequiredMixin, UpdateView):
         context = super().get_context_data(**kwargs)
         context['titulo'] = f"Gestionar Muestras - Orden #{self.object.pk}"
         
-        # 1. Obtener todos los Tipos de Muestra REQUERIDOS
-        examenes_directos = self.object.examenes.all()
-        examenes_paquetes = Examen.objects.filter(paquetes__in=self.object.paquetes.all())
-        todos_examenes = (examenes_directos | examenes_paquetes).distinct()
-        
-        tipos_requeridos = TipoMuestra.objects.filter(
-            examen__in=todos_examenes
-        ).distinct()
-        
+        # 1. Tipos de muestra requeridos que aún no se registran (una consulta)
+        context['muestras_pendientes'] = tipos_pendientes(self.object)
+
         # 2. Obtener las Muestras YA REGISTRADAS
-        muestras_registradas = self.object.muestras_registradas.all().select_related('tipo_muestra', 'responsable_toma')
-        
-        # 3. Comparar para encontrar las pendientes
-        tipos_registrados_ids = muestras_registradas.values_list('tipo_muestra_id', flat=True)
-        
-        context['muestras_pendientes'] = tipos_requeridos.exclude(pk__in=tipos_registrados_ids)
-        context['muestras_registradas'] = muestras_registradas
+        context['muestras_registradas'] = self.object.muestras_registradas.all().select_related('tipo_muestra', 'responsable_toma')
         
         return context
 
@@ -69,15 +58,6 @@ class MuestraCreateView(PersonalAutorizadoRequiredMixin, CreateView):
         self.orden = get_object_or_404(Orden, pk=self.kwargs['orden_pk'])
         return super().dispatch(request, *args, **kwargs)
 
-    def get_initial(self):
-        """
-        Pre-llenamos el formulario con valores automáticos.
-        """
-        initial = super().get_initial()
-        # GENERAR CÓDIGO AUTOMÁTICO
-        initial['codigo_barras'] = generar_codigo_muestra(self.orden.pk)
-        return initial
-
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         
@@ -85,26 +65,8 @@ class MuestraCreateView(PersonalAutorizadoRequiredMixin, CreateView):
         # === LÓGICA DE FILTRADO DE MUESTRAS (SOLO REQUERIDAS) ===
         # ===========================================================
         
-        # 1. Recolectar tipos de muestra de EXÁMENES SUELTOS
-        ids_requeridos = set(
-            self.orden.examenes.values_list('tipo_muestra_id', flat=True)
-        )
-        
-        # 2. Recolectar tipos de muestra de PAQUETES
-        for paquete in self.orden.paquetes.all():
-            ids_paquete = paquete.examenes.values_list('tipo_muestra_id', flat=True)
-            ids_requeridos.update(ids_paquete)
-            
-        # 3. Obtener tipos YA REGISTRADOS en esta orden
-        ids_registrados = set(
-            self.orden.muestras_registradas.values_list('tipo_muestra_id', flat=True)
-        )
-        
-        # 4. RESTA: Requeridos - Registrados = Pendientes
-        ids_pendientes = list(ids_requeridos - ids_registrados)
-        
-        # 5. Crear el QuerySet
-        tipos_requeridos_qs = TipoMuestra.objects.filter(pk__in=ids_pendientes)
+        # Requeridos (exámenes sueltos y de paquetes) - Registrados = Pendientes
+        tipos_requeridos_qs = tipos_pendientes(self.orden)
         
         # Pasamos los datos al formulario
         kwargs['tipos_requeridos_qs'] = tipos_requeridos_qs
@@ -120,27 +82,28 @@ class MuestraCreateView(PersonalAutorizadoRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.orden = self.orden
-        
-        # Generar código si no viene
-        if not form.instance.codigo_barras:
-             form.instance.codigo_barras = generar_codigo_muestra(self.orden.pk)
-             
-        # 1. Guardar la Muestra
-        self.object = form.save()
-        
-        # =======================================================
-        # === NUEVA LÓGICA: ACTIVAR EL PROCESO DE RESULTADOS ===
-        # =======================================================
-        
-        # Si la orden estaba 'Pendiente', ahora pasa a 'En Proceso'
-        # porque ya hay al menos una muestra física en el laboratorio.
-        if self.orden.estado == 'Pendiente':
-            self.orden.estado = 'En Proceso'
-            self.orden.save()
-            
-        # Creamos el objeto Resultado (Encabezado) vacío si no existe.
-        # Esto hace que la orden aparezca inmediatamente en "Gestión de Resultados"
-        Resultado.objects.get_or_create(orden=self.orden)
+
+        with transaction.atomic():
+            # El código se reserva aquí (no al mostrar el formulario): si la
+            # transacción falla no se guarda nada y no quedan códigos repetidos
+            form.instance.codigo_barras = generar_codigo_muestra(self.orden.pk)
+
+            # 1. Guardar la Muestra
+            self.object = form.save()
+
+            # =======================================================
+            # === NUEVA LÓGICA: ACTIVAR EL PROCESO DE RESULTADOS ===
+            # =======================================================
+
+            # Si la orden estaba 'Pendiente', ahora pasa a 'En Proceso'
+            # porque ya hay al menos una muestra física en el laboratorio.
+            if self.orden.estado == 'Pendiente':
+                self.orden.estado = 'En Proceso'
+                self.orden.save()
+
+            # Creamos el objeto Resultado (Encabezado) vacío si no existe.
+            # Esto hace que la orden aparezca inmediatamente en "Gestión de Resultados"
+            Resultado.objects.get_or_create(orden=self.orden)
         
         messages.success(self.request, f"Muestra registrada. La orden #{self.orden.pk} pasó a 'En Proceso'.")
         return redirect(self.get_success_url())
@@ -149,6 +112,52 @@ class MuestraCreateView(PersonalAutorizadoRequiredMixin, CreateView):
         return reverse('muestra_gestion', kwargs={'pk': self.orden.pk})
 
 
+class MuestraRegistrarPendientesView(PersonalAutorizadoRequiredMixin, View):
+    """ Registra todas las muestras pendientes de la orden con un clic (toma completa). """
+
+    def post(self, request, pk):
+        orden = get_object_or_404(Orden, pk=pk)
+        if orden.estado in ('Completada', 'Cancelada'):
+            messages.error(request, f"La orden #{orden.pk} está {orden.estado.lower()}: no se registran muestras.")
+        else:
+            muestras = registrar_muestras_pendientes(orden, request.user)
+            if muestras:
+                messages.success(
+                    request, f"{len(muestras)} muestra(s) registrada(s). La orden #{orden.pk} pasó a 'En Proceso'."
+                )
+            else:
+                messages.info(request, "Todas las muestras requeridas para esta orden ya estaban registradas.")
+        return redirect(reverse('muestra_gestion', kwargs={'pk': pk}))
+
+
+class MuestraEtiquetasView(PersonalAutorizadoRequiredMixin, View):
+    """
+    Etiquetas de todos los tubos de la orden en una llamada (JSON para la
+    estación de toma). Las muestras sin código reciben uno en una sola reserva.
+    """
+
+    def post(self, request, pk):
+        orden = get_object_or_404(Orden.objects.select_related('paciente'), pk=pk)
+        with transaction.atomic():
+            muestras = list(
+                orden.muestras_registradas.select_related('tipo_muestra').order_by('muestra_id')
+            )
+            asignar_codigos(muestras)
+        return JsonResponse({
+            'orden': orden.pk,
+            'paciente': str(orden.paciente),
+            'etiquetas': [
+                {
+                    'muestra': muestra.pk,
+                    'codigo_barras': muestra.codigo_barras,
+                    'tipo_muestra': muestra.tipo_muestra.nombre,
+                    'fecha_toma': muestra.fecha_toma.isoformat(),
+                }
+                for muestra in muestras
+            ],
+        })
+
+
 class MuestraUpdateView(PersonalAutorizadoRequiredMixin, UpdateView):
     model = Muestra
     form_class = MuestraUpdateForm
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class OrdenesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ordenes'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (caché de las APIs de búsqueda y exámenes efectivos)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import time
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+# --- Caché de las APIs de búsqueda del modal de órdenes ---
+# Se guarda la lista completa de resultados (hasta RESULTADOS_MAXIMOS) de cada
+# consulta normalizada; limit/cursor solo recortan esa lista, así pedir la
+# página siguiente no vuelve a ejecutar la búsqueda. Igual que la matriz de
+# descuentos (ordenes.precios), la clave lleva un sello de versión por entidad
+# que se incrementa cuando cambia un Paciente/Convenio (ver ordenes.signals).
+CACHE_PREFIJO = 'busqueda_api'
+CACHE_TIMEOUT = 60
+RESULTADOS_MAXIMOS = 100
+LIMITE_POR_DEFECTO = 20
+LIMITE_MAXIMO = 50
+
+
+def responder_busqueda(request, entidad, buscar, normalizar=str.lower):
+    """
+    Respuesta JSON paginada y condicional para una API de búsqueda.
+
+    - entidad: nombre de la lista en el JSON y de la versión en caché ('pacientes').
+    - buscar(query, limite): devuelve la lista de dicts ya serializables.
+    - normalizar(query): forma canónica de la consulta para la clave de caché.
+
+    Parámetros GET: q, limit (1..LIMITE_MAXIMO) y cursor (devuelto como
+    'siguiente' en la página anterior). El ETag depende del contenido de la
+    página, así un If-None-Match vigente se responde con 304 sin serializar.
+    """
+    query = normalizar(request.GET.get('q', '').strip())
+    limite = _leer_entero(request.GET.get('limit'), LIMITE_POR_DEFECTO, 1, LIMITE_MAXIMO)
+    inicio = _leer_entero(request.GET.get('cursor'), 0, 0, RESULTADOS_MAXIMOS)
+
+    if query:
+        resultados, huella = resultados_en_cache(entidad, query, buscar)
+    else:
+        resultados, huella = [], 'vacio'
+
+    etag = f'"{entidad}-{huella}-{inicio}-{limite}"'
+    respuesta = get_conditional_response(request, etag=etag)
+    if respuesta is None:
+        fin = inicio + limite
+        respuesta = JsonResponse({
+            entidad: resultados[inicio:fin],
+            'siguiente': str(fin) if fin < len(resultados) else None,
+        })
+    respuesta.headers['ETag'] = etag
+    # El navegador puede guardar la respuesta, pero debe revalidarla (If-None-Match)
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
+
+
+def resultados_en_cache(entidad, query, buscar):
+    """ Devuelve (resultados, huella) de la consulta, ejecutando buscar() solo si no está en caché. """
+    digest = hashlib.md5(query.encode()).hexdigest()
+    clave = f'{CACHE_PREFIJO}:{entidad}:v{version_busqueda(entidad)}:{digest}'
+    entrada = cache.get(clave)
+    if entrada is None:
+        resultados = buscar(query, RESULTADOS_MAXIMOS)
+        contenido = json.dumps(resultados, cls=DjangoJSONEncoder, sort_keys=True)
+        entrada = (resultados, hashlib.md5(contenido.encode()).hexdigest()[:16])
+        cache.set(clave, entrada, CACHE_TIMEOUT)
+    return entrada
+
+
+def _leer_entero(valor, por_defecto, minimo, maximo):
+    try:
+        return min(max(int(valor), minimo), maximo)
+    except (TypeError, ValueError):
+        return por_defecto
+
+
+def _clave_version(entidad):
+    return f'{CACHE_PREFIJO}:{entidad}:version'
+
+
+def version_busqueda(entidad):
+    """ Sello de versión vigente de las búsquedas de la entidad (ver precios.version_descuentos). """
+    clave = _clave_version(entidad)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, time.time_ns(), None)
+        version = cache.get(clave)
+    return version
+
+
+def invalidar_busqueda(entidad):
+    """ Descarta los resultados en caché de la entidad ('pacientes' o 'convenios'). """
+    try:
+        cache.incr(_clave_version(entidad))
+    except ValueError:
+        cache.set(_clave_version(entidad), time.time_ns(), None)
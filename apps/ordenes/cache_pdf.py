@@ -0,0 +1,160 @@
+import os
+import re
+import shutil
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+# --- Caché en disco de PDFs inmutables (resultados validados, facturas) ---
+# Cada archivo se llama <tipo>_<objeto_id>_<clave>.pdf, donde la clave es un
+# hash de todo lo que se imprime (ver pdf.clave_documento): si cambia un dato,
+# cambia la clave y el archivo viejo simplemente deja de pedirse.
+# Al leer se actualiza el mtime del archivo; al pasar de PDF_CACHE_MAX_BYTES se
+# borran los menos usados recientemente (LRU).
+# Recorrer el directorio es caro con miles de archivos: cada proceso lo hace al
+# guardar por primera vez y luego solo cuando ya escribió MARGEN_DESALOJO del
+# límite; entonces deja la caché en (1 - MARGEN_DESALOJO) del límite. Con N
+# workers el exceso queda acotado a N * MARGEN_DESALOJO.
+TAMANO_BLOQUE = 64 * 1024
+RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+MARGEN_DESALOJO = 0.1
+_escrito = {'bytes': None}  # Bytes guardados por este proceso desde su último desalojo
+
+
+def _ruta(tipo, objeto_id, clave):
+    return os.path.join(settings.PDF_CACHE_DIR, f"{tipo.lower()}_{objeto_id}_{clave}.pdf")
+
+
+def _prefijo(tipo, objeto_id):
+    return f"{tipo.lower()}_{objeto_id}_"
+
+
+def buscar(tipo, objeto_id, clave):
+    """ Ruta del PDF en caché o None. Marca el archivo como usado (LRU). """
+    ruta = _ruta(tipo, objeto_id, clave)
+    try:
+        os.utime(ruta)
+    except OSError:
+        return None
+    return ruta
+
+
+def guardar(tipo, objeto_id, clave, origen):
+    """
+    Copia el PDF `origen` a la caché y aplica el límite. Las versiones
+    anteriores del documento ya no se piden y salen por LRU.
+    """
+    os.makedirs(settings.PDF_CACHE_DIR, exist_ok=True)
+    ruta = _ruta(tipo, objeto_id, clave)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    shutil.copyfile(origen, temporal)
+    os.replace(temporal, ruta)
+
+    limite = settings.PDF_CACHE_MAX_BYTES
+    if _escrito['bytes'] is None:
+        desalojar(limite)
+    else:
+        _escrito['bytes'] += os.path.getsize(ruta)
+        if _escrito['bytes'] > limite * MARGEN_DESALOJO:
+            desalojar(int(limite * (1 - MARGEN_DESALOJO)))
+    return ruta
+
+
+def invalidar(tipo, objeto_id):
+    """ Borra todas las versiones en caché del documento (ej: resultado devuelto a corrección). """
+    prefijo = _prefijo(tipo, objeto_id)
+    for entrada in _archivos():
+        if entrada.name.startswith(prefijo):
+            _borrar(entrada.path)
+
+
+def desalojar(max_bytes):
+    """ Borra los archivos menos usados recientemente hasta quedar bajo max_bytes. """
+    _escrito['bytes'] = 0
+    archivos = []
+    total = 0
+    for entrada in _archivos():
+        try:
+            info = entrada.stat()
+        except OSError:
+            continue
+        archivos.append((info.st_mtime, info.st_size, entrada.path))
+        total += info.st_size
+
+    for _, tamano, ruta in sorted(archivos):
+        if total <= max_bytes:
+            break
+        _borrar(ruta)
+        total -= tamano
+
+
+def _archivos():
+    try:
+        return [e for e in os.scandir(settings.PDF_CACHE_DIR) if e.name.endswith('.pdf')]
+    except FileNotFoundError:
+        return []
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass # Otro proceso ya lo borró, o está abierto (Windows): se reintenta en el próximo desalojo
+
+
+def servir_pdf(request, ruta, nombre, etag, content_type='application/pdf'):
+    """
+    Respuesta para un PDF (u otro archivo: content_type) en disco: Content-Length, ETag (304 con If-None-Match)
+    y solicitudes Range de un solo intervalo (206/416), que usan los visores
+    de PDF del navegador para ir cargando el documento por partes.
+    """
+    tamano = os.path.getsize(ruta)
+    respuesta = get_conditional_response(request, etag=etag)
+    if respuesta is None:
+        rango = _leer_rango(request, tamano, etag)
+        if rango is False:
+            respuesta = HttpResponse(status=416)
+            respuesta.headers['Content-Range'] = f'bytes */{tamano}'
+        elif rango:
+            inicio, fin = rango
+            respuesta = StreamingHttpResponse(
+                _leer_bloques(ruta, inicio, fin - inicio + 1),
+                status=206, content_type=content_type
+            )
+            respuesta.headers['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+            respuesta.headers['Content-Length'] = str(fin - inicio + 1)
+        else:
+            respuesta = FileResponse(open(ruta, 'rb'), content_type=content_type, filename=nombre)
+    respuesta.headers['ETag'] = etag
+    respuesta.headers['Accept-Ranges'] = 'bytes'
+    return respuesta
+
+
+def _leer_rango(request, tamano, etag):
+    """ (inicio, fin) inclusivos, None si se sirve completo o False si el rango no es satisfacible. """
+    encabezado = request.headers.get('Range')
+    if not encabezado or request.headers.get('If-Range', etag) != etag:
+        return None
+    coincidencia = RANGO.match(encabezado.strip())
+    if not coincidencia or coincidencia.groups() == ('', ''):
+        return None # Rangos múltiples o mal formados: se ignora y se sirve completo
+    inicio, fin = coincidencia.groups()
+    if inicio == '':
+        # "bytes=-N": los últimos N bytes
+        inicio, fin = max(tamano - int(fin), 0), tamano - 1
+    else:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or inicio > fin:
+        return False
+    return inicio, fin
+
+
+def _leer_bloques(ruta, inicio, cantidad):
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        while cantidad > 0:
+            bloque = archivo.read(min(TAMANO_BLOQUE, cantidad))
+            if not bloque:
+                break
+            cantidad -= len(bloque)
+            yield bloque
@@ -1,4 +1,6 @@
+from datetime import datetime, time, timedelta
 from django import forms
+from django.utils import timezone
 from .models import Orden
 from pacientes.models import Paciente
 from convenios.models import Convenio # Importando tu modelo
@@ -50,4 +52,51 @@ class AddExamenForm(forms.Form):
 
 class AddPaqueteForm(forms.Form):
     """ Formulario simple para el botón "Añadir Paquete". """
-    paquete_id = forms.IntegerField(widget=forms.HiddenInput())
\ No newline at end of file
+    paquete_id = forms.IntegerField(widget=forms.HiddenInput())
+
+# --- Filtros del listado de órdenes ---
+
+class OrdenFiltroForm(forms.Form):
+    """
+    Filtros (todos opcionales) para el listado de órdenes.
+    Cada filtro se resuelve en el servidor sobre columnas indexadas.
+    """
+    estado = forms.ChoiceField(
+        choices=[('', 'Todos los estados')] + Orden.ESTADO_CHOICES, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    estado_pago = forms.ChoiceField(
+        choices=[('', 'Todos los pagos')] + Orden.ESTADO_PAGO_CHOICES, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    prioridad = forms.ChoiceField(
+        choices=[('', 'Todas las prioridades')] + Orden.PRIORIDAD_CHOICES, required=False,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    convenio = forms.ModelChoiceField(
+        queryset=Convenio.objects.all(), required=False, empty_label="Todos los convenios",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    fecha_desde = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    fecha_hasta = forms.DateField(
+        required=False, widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+
+    def filtrar(self, queryset):
+        """ Aplica los filtros válidos al queryset (llamar después de is_valid()). """
+        datos = self.cleaned_data
+        for campo in ('estado', 'estado_pago', 'prioridad', 'convenio'):
+            if datos.get(campo):
+                queryset = queryset.filter(**{campo: datos[campo]})
+
+        # Rango de fechas como límites de datetime (no __date) para que el
+        # motor pueda usar el índice sobre fecha_creacion.
+        if datos.get('fecha_desde'):
+            inicio = timezone.make_aware(datetime.combine(datos['fecha_desde'], time.min))
+            queryset = queryset.filter(fecha_creacion__gte=inicio)
+        if datos.get('fecha_hasta'):
+            fin = timezone.make_aware(datetime.combine(datos['fecha_hasta'] + timedelta(days=1), time.min))
+            queryset = queryset.filter(fecha_creacion__lt=fin)
+        return queryset
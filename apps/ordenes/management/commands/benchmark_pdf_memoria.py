@@ -0,0 +1,111 @@
+import time
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+from io import BytesIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import get_template
+from pypdf import PdfReader # Dependencia de xhtml2pdf
+from xhtml2pdf import pisa
+
+from categorias.models import CategoriaExamen
+from examenes.models import Examen, ValorReferencia
+from ordenes.models import Orden
+from ordenes.pdf import DOCUMENTOS, documento_resultado, pdf_en_spool
+from ordenes.recursos_pdf import link_callback
+from pacientes.models import Paciente
+from resultados.models import Resultado, ResultadoDetalle
+from tipos_muestras.models import TipoMuestra
+
+# Filas de parámetros que caben en una página del reporte de resultados
+PARAMETROS_POR_PAGINA = 30
+PARAMETROS_POR_EXAMEN = 5
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la memoria máxima (tracemalloc) de generar un reporte de resultados de "
+        "--paginas páginas guardando el PDF en memoria (BytesIO, como la respuesta "
+        "HttpResponse) y en un TemporalPDF que pasa a disco al superar PDF_SPOOL_MAX_BYTES. "
+        "Los datos se crean dentro de una transacción que se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paginas', type=int, default=200)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                orden = self._crear_reporte(options['paginas'] * PARAMETROS_POR_PAGINA)
+                self._medir(orden)
+                raise _Revertir
+        except _Revertir:
+            self.stdout.write("Datos sintéticos revertidos.")
+
+    def _crear_reporte(self, parametros):
+        categoria = CategoriaExamen.objects.create(nombre='Benchmark PDF', descripcion='Datos sintéticos')
+        tipo_muestra = TipoMuestra.objects.create(
+            nombre='Benchmark PDF', descripcion='Datos sintéticos', condiciones_almacenamiento='-'
+        )
+        paciente = Paciente.objects.create(
+            nombre='Paciente', apellido='Benchmark', fecha_nacimiento=date(1990, 1, 1), sexo='F',
+            dui='99999999-9', telefono='70000000', correo='benchmark@example.com'
+        )
+        orden = Orden.objects.create(paciente=paciente)
+        resultado = Resultado.objects.create(orden=orden)
+
+        examenes = Examen.objects.bulk_create([
+            Examen(nombre=f'Benchmark PDF {i}', codigo=f'BPDF{i}', precio=Decimal('1.00'),
+                   categoria=categoria, tipo_muestra=tipo_muestra)
+            for i in range(-(-parametros // PARAMETROS_POR_EXAMEN))
+        ])
+        valores = ValorReferencia.objects.bulk_create([
+            ValorReferencia(examen=examenes[i // PARAMETROS_POR_EXAMEN], rango_referencia=f'{i}-{i + 10}',
+                            unidad_medida='mg/dL')
+            for i in range(parametros)
+        ])
+        ResultadoDetalle.objects.bulk_create([
+            ResultadoDetalle(resultado=resultado, valor_referencia=valor, valor_obtenido=str(i))
+            for i, valor in enumerate(valores)
+        ])
+        return orden
+
+    def _medir(self, orden):
+        template_path = DOCUMENTOS['Resultado'][0]
+        contexto, _ = documento_resultado(orden.pk)
+        get_template(template_path).render(contexto) # Calienta templates y recursos fuera de la medición
+
+        def en_memoria():
+            buffer = BytesIO()
+            html = get_template(template_path).render(contexto)
+            pisa.CreatePDF(html, dest=buffer, link_callback=link_callback)
+            return buffer
+
+        medidas = []
+        for nombre, generar in (("BytesIO", en_memoria), ("TemporalPDF", lambda: pdf_en_spool(template_path, contexto))):
+            inicio = time.perf_counter()
+            tracemalloc.start()
+            with generar() as archivo:
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                segundos = time.perf_counter() - inicio
+                archivo.seek(0)
+                paginas = len(PdfReader(archivo).pages)
+                tamano = archivo.seek(0, 2)
+            medidas.append(pico)
+            self.stdout.write(
+                f"{nombre:<12} {paginas} páginas, {tamano / 2**20:.2f} MB: "
+                f"pico {pico / 2**20:.1f} MB en {segundos:.1f} s"
+            )
+
+        self.stdout.write(
+            f"Límite en memoria: {settings.PDF_SPOOL_MAX_BYTES / 2**20:.1f} MB; "
+            f"diferencia de pico: {(medidas[0] - medidas[1]) / 2**20:.1f} MB"
+        )
+
+
+class _Revertir(Exception):
+    """ Fuerza el rollback de los datos sintéticos. """
@@ -0,0 +1,55 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from ordenes.pdf import INTERVALO_PURGA, procesar_trabajo, purgar_trabajos, reclamar_trabajo, resumen_metricas
+from ordenes.recursos_pdf import precalentar
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de PDFs (resultados y facturas): toma los trabajos "
+        "pendientes y deja el archivo listo para descarga. Se pueden ejecutar "
+        "varias instancias en paralelo; cada trabajo lo toma una sola. Cada "
+        "tanto borra los trabajos terminados más viejos que PDF_TRABAJOS_RETENCION."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Procesa lo pendiente y termina (útil para cron/tareas programadas).")
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help="Segundos de espera cuando la cola está vacía.")
+
+    def handle(self, *args, **options):
+        # Logo y CSS resueltos (y reducidos) antes del primer trabajo
+        precalentar()
+        procesados = 0
+        proxima_purga = timezone.now()
+        while True:
+            close_old_connections()
+            if timezone.now() >= proxima_purga:
+                # Trabajos terminados y sus archivos: sin esto crecen sin límite
+                borrados = purgar_trabajos()
+                if borrados:
+                    self.stdout.write(f"{borrados} trabajo(s) vencido(s) borrado(s).")
+                proxima_purga = timezone.now() + INTERVALO_PURGA
+            trabajo = reclamar_trabajo()
+            if trabajo is None:
+                if options['una_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            trabajo = procesar_trabajo(trabajo)
+            procesados += 1
+            if trabajo.estado == 'Completado':
+                self.stdout.write(f"{trabajo}: {trabajo.archivo}")
+            elif trabajo.estado == 'Procesando':
+                self.stdout.write(self.style.WARNING(f"{trabajo}: lo tomó otro worker, se descarta."))
+            else:
+                self.stdout.write(self.style.ERROR(f"{trabajo}:\n{trabajo.error}"))
+
+        for linea in resumen_metricas():
+            self.stdout.write(linea)
+        self.stdout.write(self.style.SUCCESS(f"{procesados} trabajo(s) procesado(s)."))
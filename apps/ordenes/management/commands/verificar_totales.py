@@ -0,0 +1,42 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ordenes.models import Orden
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica los totales mantenidos en modo incremental contra un "
+        "recálculo completo. Con --corregir aplica calcular_totales a las "
+        "órdenes con diferencias."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=7,
+                            help="Solo órdenes creadas en los últimos N días (0 = todas).")
+        parser.add_argument('--corregir', action='store_true',
+                            help="Recalcula por completo las órdenes con diferencias.")
+
+    def handle(self, *args, **options):
+        ordenes = Orden.objects.exclude(estado='Cancelada').select_related('convenio')
+        if options['dias']:
+            ordenes = ordenes.filter(fecha_creacion__gte=timezone.now() - timedelta(days=options['dias']))
+
+        revisadas = con_diferencias = 0
+        for orden in ordenes.iterator():
+            revisadas += 1
+            diferencias = orden.verificar_totales()
+            if not diferencias:
+                continue
+
+            con_diferencias += 1
+            detalle = ", ".join(f"{campo}: {guardado} != {esperado}"
+                                for campo, (guardado, esperado) in diferencias.items())
+            self.stdout.write(self.style.WARNING(f"Orden #{orden.pk}: {detalle}"))
+            if options['corregir']:
+                orden.calcular_totales()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{revisadas} órdenes revisadas, {con_diferencias} con diferencias."
+        ))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('convenios', '0001_initial'),
+        ('ordenes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['-fecha_creacion', '-orden_id'], name='orden_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['estado', '-fecha_creacion', '-orden_id'], name='orden_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['estado_pago', '-fecha_creacion', '-orden_id'], name='orden_pago_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['prioridad', '-fecha_creacion', '-orden_id'], name='orden_prioridad_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orden',
+            index=models.Index(fields=['convenio', '-fecha_creacion', '-orden_id'], name='orden_convenio_fecha_idx'),
+        ),
+    ]
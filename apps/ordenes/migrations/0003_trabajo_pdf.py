@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordenes', '0002_orden_indices_listado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoPDF',
+            fields=[
+                ('trabajo_id', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('Resultado', 'Resultado'), ('Factura', 'Factura')], max_length=20)),
+                ('objeto_id', models.IntegerField()),
+                ('estado', models.CharField(choices=[('Pendiente', 'Pendiente'), ('Procesando', 'Procesando'), ('Completado', 'Completado'), ('Error', 'Error')], default='Pendiente', max_length=20)),
+                ('archivo', models.CharField(blank=True, max_length=255)),
+                ('nombre_descarga', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('solicitado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'Trabajos_PDF',
+                'indexes': [models.Index(fields=['estado', 'trabajo_id'], name='trabajo_pdf_estado_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ('Pendiente', 'Procesando'))), fields=('tipo', 'objeto_id'), name='trabajo_pdf_activo_unico')],
+            },
+        ),
+    ]
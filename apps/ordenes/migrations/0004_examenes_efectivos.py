@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def materializar_examenes(apps, schema_editor):
+    """
+    Copia los exámenes que hoy ve cada orden: los directos y todos los
+    de sus paquetes (la consulta anterior no filtraba por estado).
+    """
+    OrdenExamen = apps.get_model('ordenes', 'OrdenExamen')
+    OrdenPaquete = apps.get_model('ordenes', 'OrdenPaquete')
+    PaqueteExamen = apps.get_model('paquetes', 'PaqueteExamen')
+    OrdenExamenEfectivo = apps.get_model('ordenes', 'OrdenExamenEfectivo')
+
+    contenido = {}
+    for paquete_id, examen_id in PaqueteExamen.objects.values_list('paquete_id', 'examen_id').iterator():
+        contenido.setdefault(paquete_id, []).append(examen_id)
+
+    def filas():
+        for orden_id, examen_id in OrdenExamen.objects.values_list('orden_id', 'examen_id').iterator():
+            yield OrdenExamenEfectivo(orden_id=orden_id, examen_id=examen_id)
+        for orden_id, paquete_id in OrdenPaquete.objects.values_list('orden_id', 'paquete_id').iterator():
+            for examen_id in contenido.get(paquete_id, ()):
+                yield OrdenExamenEfectivo(orden_id=orden_id, paquete_id=paquete_id, examen_id=examen_id)
+
+    lote = []
+    for fila in filas():
+        lote.append(fila)
+        if len(lote) == 500:
+            OrdenExamenEfectivo.objects.bulk_create(lote)
+            lote = []
+    OrdenExamenEfectivo.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('examenes', '0003_valorreferencia_criticos'),
+        ('ordenes', '0003_trabajo_pdf'),
+        ('paquetes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrdenExamenEfectivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('examen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='examenes.examen')),
+                ('orden', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='examenes_efectivos', to='ordenes.orden')),
+                ('paquete', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='paquetes.paquete')),
+            ],
+            options={
+                'db_table': 'Ordenes_Examenes_Efectivos',
+                'unique_together': {('orden', 'examen', 'paquete')},
+            },
+        ),
+        migrations.RunPython(materializar_examenes, migrations.RunPython.noop),
+    ]
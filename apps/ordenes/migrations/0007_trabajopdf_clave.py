@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordenes', '0006_trabajopdf_latido'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='trabajopdf',
+            name='trabajo_pdf_activo_unico',
+        ),
+        migrations.AddField(
+            model_name='trabajopdf',
+            name='clave',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='trabajopdf',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ('Pendiente', 'Procesando'))), fields=('tipo', 'objeto_id', 'clave'), name='trabajo_pdf_activo_unico'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordenes', '0007_trabajopdf_clave'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordenexamen',
+            name='precio_base_en_orden',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='ordenpaquete',
+            name='precio_base_en_orden',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+    ]
@@ -2,18 +2,27 @@ from django.db import models
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from decimal import Decimal, ROUND_HALF_UP
-from django.db.models import Sum
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Round
 
 # Importamos los modelos de las otras apps
 from pacientes.models import Paciente
 from examenes.models import Examen
-from paquetes.models import Paquete
+from paquetes.models import Paquete, PaqueteExamen
 # IMPORTANTE: Importamos los modelos de Convenio para leer los descuentos
-from convenios.models import Convenio, ConvenioExamen, ConvenioPaquete 
+from convenios.models import Convenio
+from .precios import TablaDescuentos
 
 # Constante de IVA (Ej: 13%)
 IVA_PORCENTAJE = Decimal('0.13')
 
+# Campos que se recalculan juntos en calcular_totales / actualizar_estado_pago
+CAMPOS_TOTALES = [
+    'subtotal', 'descuento_aplicado', 'iva', 'total_con_iva',
+    'monto_pagado', 'estado_pago',
+]
+
 class Orden(models.Model):
     orden_id = models.AutoField(primary_key=True)
     
@@ -67,87 +76,182 @@ class Orden(models.Model):
     # ==============================================================================
     # === LÓGICA DE NEGOCIO: APLICACIÓN DE DESCUENTOS ===
     # ==============================================================================
-    def calcular_totales(self):
+    def calcular_precios(self):
         """
         Recorre todos los ítems de la orden, verifica si el convenio tiene
-        descuentos aplicables (Específico > General) y actualiza los precios.
+        descuentos aplicables (Específico > General) y calcula en memoria
+        (sin guardar) el precio de cada línea y los totales de la orden.
+
+        Devuelve (lineas_cambiadas, totales):
+        - lineas_cambiadas: {Modelo: [ítems con precio_en_orden o
+          precio_base_en_orden actualizado]}
+        - totales: {campo: valor} para subtotal, descuento, IVA y total.
         """
+        tabla = TablaDescuentos.para_convenio(self.convenio_id)
+
         total_precio_base = Decimal('0.00') # Precio sin descuento (para calcular cuánto se ahorró)
         nuevo_subtotal = Decimal('0.00')    # Precio con descuento
+        lineas_cambiadas = {OrdenExamen: [], OrdenPaquete: []}
 
         # --- 1. PROCESAR EXÁMENES ---
-        # Usamos select_related para optimizar la consulta a la DB
-        for item in self.ordenexamen_set.select_related('examen').all():
-            precio_base = item.examen.precio
-            descuento_pct = Decimal('0.00')
-
-            # Solo aplicamos lógica si hay un convenio seleccionado
-            if self.convenio:
-                # A. Nivel 1: ¿Existe un descuento ESPECÍFICO para este examen?
-                try:
-                    desc_obj = ConvenioExamen.objects.get(convenio=self.convenio, examen=item.examen)
-                    descuento_pct = desc_obj.porcentaje_descuento
-                except ConvenioExamen.DoesNotExist:
-                    # B. Nivel 2: Si no, usar descuento GENERAL de exámenes
-                    descuento_pct = self.convenio.descuento_general_examenes
-
-            # Calcular el precio final para este ítem
-            # Fórmula: Precio * (1 - (Descuento / 100))
-            factor = (Decimal('100') - descuento_pct) / Decimal('100')
-            precio_final = (precio_base * factor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            
+        for item in self.ordenexamen_set.select_related('examen'):
+            precio_final = tabla.precio_examen(item.examen)
+
             # Guardamos el precio calculado en la línea de la orden (Snapshot)
-            if item.precio_en_orden != precio_final:
+            if item.precio_en_orden != precio_final or item.precio_base_en_orden != item.examen.precio:
                 item.precio_en_orden = precio_final
-                item.save()
+                item.precio_base_en_orden = item.examen.precio
+                lineas_cambiadas[OrdenExamen].append(item)
 
-            total_precio_base += precio_base
+            total_precio_base += item.examen.precio
             nuevo_subtotal += precio_final
 
         # --- 2. PROCESAR PAQUETES ---
-        for item in self.ordenpaquete_set.select_related('paquete').all():
-            precio_base = item.paquete.precio
-            descuento_pct = Decimal('0.00')
-
-            if self.convenio:
-                # A. Nivel 1: Descuento ESPECÍFICO para este paquete
-                try:
-                    desc_obj = ConvenioPaquete.objects.get(convenio=self.convenio, paquete=item.paquete)
-                    descuento_pct = desc_obj.porcentaje_descuento
-                except ConvenioPaquete.DoesNotExist:
-                    # B. Nivel 2: Descuento GENERAL de paquetes
-                    descuento_pct = self.convenio.descuento_general_paquetes
-
-            factor = (Decimal('100') - descuento_pct) / Decimal('100')
-            precio_final = (precio_base * factor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            
-            if item.precio_en_orden != precio_final:
+        for item in self.ordenpaquete_set.select_related('paquete'):
+            precio_final = tabla.precio_paquete(item.paquete)
+
+            if item.precio_en_orden != precio_final or item.precio_base_en_orden != item.paquete.precio:
                 item.precio_en_orden = precio_final
-                item.save()
+                item.precio_base_en_orden = item.paquete.precio
+                lineas_cambiadas[OrdenPaquete].append(item)
 
-            total_precio_base += precio_base
+            total_precio_base += item.paquete.precio
             nuevo_subtotal += precio_final
 
-        # --- 3. GUARDAR TOTALES GLOBALES ---
-        self.subtotal = nuevo_subtotal
-        # El descuento aplicado es la diferencia entre el precio de lista y lo que se cobra
-        self.descuento_aplicado = total_precio_base - nuevo_subtotal
-        
+        # --- 3. TOTALES GLOBALES ---
         # Cálculo de IVA (13%) sobre el subtotal con descuento
-        self.iva = (self.subtotal * IVA_PORCENTAJE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        
-        self.total_con_iva = (self.subtotal + self.iva).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        
-        self.save()
-        
-        # Actualizar si está pagada o pendiente
-        self.actualizar_estado_pago()
+        iva = (nuevo_subtotal * IVA_PORCENTAJE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        totales = {
+            'subtotal': nuevo_subtotal,
+            # El descuento aplicado es la diferencia entre el precio de lista y lo que se cobra
+            'descuento_aplicado': total_precio_base - nuevo_subtotal,
+            'iva': iva,
+            'total_con_iva': (nuevo_subtotal + iva).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP),
+        }
+        return lineas_cambiadas, totales
+
+    def calcular_totales(self):
+        """
+        Recálculo COMPLETO de la orden.
+
+        Los descuentos se cargan en memoria con una sola consulta, los precios
+        cambiados se escriben con un bulk_update por tabla y los totales con
+        un único UPDATE: el número de consultas no depende de las líneas.
+        """
+        with transaction.atomic():
+            lineas_cambiadas, totales = self.calcular_precios()
+
+            for modelo, items in lineas_cambiadas.items():
+                if items:
+                    modelo.objects.bulk_update(items, ['precio_en_orden', 'precio_base_en_orden'])
+
+            for campo, valor in totales.items():
+                setattr(self, campo, valor)
+
+            # Actualizar si está pagada o pendiente (mismo UPDATE que los totales)
+            self.calcular_estado_pago()
+            self.guardar_totales()
+
+    def ajustar_totales(self, delta_precio_base, delta_precio_final):
+        """
+        Recálculo INCREMENTAL: ajusta los totales por la diferencia de UNA
+        línea (positiva al añadir, negativa al quitar) con un único UPDATE
+        atómico basado en F(), sin releer ni repreciar el resto de la orden.
+        El IVA y el total se derivan del nuevo subtotal en la misma sentencia,
+        con el mismo redondeo que calcular_totales.
+        """
+        from facturas.models import Factura # Import local: facturas depende de ordenes
+
+        nuevo_subtotal = F('subtotal') + delta_precio_final
+        nuevo_iva = Round(nuevo_subtotal * IVA_PORCENTAJE, 2)
+        nuevo_total = nuevo_subtotal + nuevo_iva
+
+        Orden.objects.filter(pk=self.pk).update(
+            subtotal=nuevo_subtotal,
+            descuento_aplicado=F('descuento_aplicado') + (delta_precio_base - delta_precio_final),
+            iva=nuevo_iva,
+            total_con_iva=nuevo_total,
+            estado_pago=Case(
+                When(estado='Cancelada', then=Value('Anulada')),
+                When(monto_pagado__gte=nuevo_total, then=Value('Pagada')),
+                When(monto_pagado__gt=0, then=Value('Parcial')),
+                default=Value('Pendiente'),
+            ),
+        )
+        # Sincronizar con la factura si existe (lee el estado recién calculado)
+        Factura.objects.filter(orden_id=self.pk).update(
+            estado=Subquery(Orden.objects.filter(pk=OuterRef('orden_id')).values('estado_pago')[:1])
+        )
+        self.refresh_from_db(fields=CAMPOS_TOTALES)
+
+    def agregar_item(self, item):
+        """
+        Inserta una línea nueva (OrdenExamen u OrdenPaquete sin guardar),
+        preciando SOLO esa línea, y ajusta los totales por la diferencia.
+        Lanza IntegrityError si el ítem ya estaba en la orden.
+        """
+        tabla = TablaDescuentos.para_convenio(self.convenio_id)
+        if isinstance(item, OrdenExamen):
+            item.precio_base_en_orden = item.examen.precio
+            item.precio_en_orden = tabla.precio_examen(item.examen)
+        else:
+            item.precio_base_en_orden = item.paquete.precio
+            item.precio_en_orden = tabla.precio_paquete(item.paquete)
+
+        with transaction.atomic():
+            item.orden = self
+            item.save()
+            self.ajustar_totales(item.precio_base_en_orden, item.precio_en_orden)
+
+    def quitar_item(self, item):
+        """
+        Elimina una línea de la orden y descuenta sus snapshots de precio
+        (precio_base_en_orden y precio_en_orden) de los totales, sin repreciar
+        el resto. Las líneas sin precio base guardado (anteriores al
+        snapshot) recalculan la orden completa.
+        """
+        with transaction.atomic():
+            item.delete()
+            if item.precio_base_en_orden is None:
+                self.calcular_totales()
+            else:
+                self.ajustar_totales(-item.precio_base_en_orden, -item.precio_en_orden)
+
+    def verificar_totales(self):
+        """
+        Verificación periódica del modo incremental: recalcula la orden
+        completa en memoria y la compara con lo guardado, sin escribir nada.
+        Devuelve {campo: (guardado, esperado)}; vacío si todo cuadra.
+        """
+        lineas_cambiadas, totales = self.calcular_precios()
+        guardado = Orden.objects.filter(pk=self.pk).values(*totales).get()
+
+        diferencias = {
+            campo: (guardado[campo], valor)
+            for campo, valor in totales.items()
+            if guardado[campo] != valor
+        }
+        lineas_desactualizadas = sum(len(items) for items in lineas_cambiadas.values())
+        if lineas_desactualizadas:
+            diferencias['precio_en_orden'] = (lineas_desactualizadas, 0)
+        return diferencias
+
+    def filtro_examenes(self, campo='examen_id'):
+        """
+        Q que selecciona los exámenes de la orden (directos o por paquete)
+        con una subconsulta IN sobre la tabla materializada OrdenExamenEfectivo.
+        """
+        return Q(**{f'{campo}__in': OrdenExamenEfectivo.objects.filter(orden_id=self.pk).values('examen_id')})
 
     def actualizar_estado_pago(self):
+        self.calcular_estado_pago()
+        self.guardar_totales()
+
+    def calcular_estado_pago(self):
+        """ Calcula monto_pagado y estado_pago en memoria (no guarda). """
         if self.estado == 'Cancelada':
             self.estado_pago = 'Anulada'
             self.monto_pagado = Decimal('0.00')
-            self.save()
             return
 
         total_pagado = self.pagos.all().aggregate(Sum('monto'))['monto__sum'] or Decimal('0.00')
@@ -160,19 +264,34 @@ class Orden(models.Model):
             self.estado_pago = 'Parcial'
         else:
             self.estado_pago = 'Pendiente'
-            
-        self.save()
-        
-        # Sincronizar con la factura si existe
-        if hasattr(self, 'factura'):
-            self.factura.estado = self.estado_pago
-            self.factura.save()
+
+    def guardar_totales(self):
+        """
+        Persiste los campos de facturación con un solo UPDATE y sincroniza
+        el estado de la factura (si existe) sin cargarla.
+        """
+        from facturas.models import Factura # Import local: facturas depende de ordenes
+
+        Orden.objects.filter(pk=self.pk).update(
+            **{campo: getattr(self, campo) for campo in CAMPOS_TOTALES}
+        )
+        Factura.objects.filter(orden_id=self.pk).exclude(
+            estado=self.estado_pago
+        ).update(estado=self.estado_pago)
 
     class Meta:
         db_table = 'Ordenes'
         verbose_name = "Orden"
         verbose_name_plural = "Órdenes"
         ordering = ['-fecha_creacion']
+        # Índices para el listado paginado por (fecha_creacion, orden_id) y sus filtros
+        indexes = [
+            models.Index(fields=['-fecha_creacion', '-orden_id'], name='orden_fecha_idx'),
+            models.Index(fields=['estado', '-fecha_creacion', '-orden_id'], name='orden_estado_fecha_idx'),
+            models.Index(fields=['estado_pago', '-fecha_creacion', '-orden_id'], name='orden_pago_fecha_idx'),
+            models.Index(fields=['prioridad', '-fecha_creacion', '-orden_id'], name='orden_prioridad_fecha_idx'),
+            models.Index(fields=['convenio', '-fecha_creacion', '-orden_id'], name='orden_convenio_fecha_idx'),
+        ]
 
 # --- Tablas Intermedias (Sin cambios) ---
 
@@ -180,6 +299,8 @@ class OrdenExamen(models.Model):
     orden = models.ForeignKey(Orden, on_delete=models.CASCADE)
     examen = models.ForeignKey(Examen, on_delete=models.PROTECT)
     precio_en_orden = models.DecimalField(max_digits=8, decimal_places=2)
+    # Precio de lista con el que la línea entró en los totales (descuento_aplicado)
+    precio_base_en_orden = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
 
     class Meta:
         db_table = 'Ordenes_Examenes'
@@ -189,7 +310,134 @@ class OrdenPaquete(models.Model):
     orden = models.ForeignKey(Orden, on_delete=models.CASCADE)
     paquete = models.ForeignKey(Paquete, on_delete=models.PROTECT)
     precio_en_orden = models.DecimalField(max_digits=8, decimal_places=2)
+    precio_base_en_orden = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
     
     class Meta:
         db_table = 'Ordenes_Paquetes'
-        unique_together = ('orden', 'paquete')
\ No newline at end of file
+        unique_together = ('orden', 'paquete')
+
+class OrdenExamenEfectivo(models.Model):
+    """
+    Exámenes efectivos de la orden: los directos (paquete nulo) y los de
+    cada paquete, aplanados en una tabla indexada por orden. Los de un
+    paquete se copian al agregarlo a la orden (solo los activos en ese
+    momento), igual que su precio_en_orden: editar el paquete después no
+    cambia las órdenes ya creadas. Se mantiene con las señales de
+    OrdenExamen/OrdenPaquete y con `registrar` en las altas por lote.
+    """
+    orden = models.ForeignKey(Orden, on_delete=models.CASCADE, related_name='examenes_efectivos')
+    examen = models.ForeignKey(Examen, on_delete=models.CASCADE, related_name='+')
+    paquete = models.ForeignKey(Paquete, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+
+    class Meta:
+        db_table = 'Ordenes_Examenes_Efectivos'
+        unique_together = ('orden', 'examen', 'paquete')
+
+    @classmethod
+    def registrar(cls, orden_id, examen_ids=(), paquete_ids=()):
+        """ Agrega los exámenes directos y el contenido activo de los paquetes (2 consultas). """
+        filas = [cls(orden_id=orden_id, examen_id=examen_id) for examen_id in examen_ids]
+        if paquete_ids:
+            filas += [
+                cls(orden_id=orden_id, paquete_id=paquete_id, examen_id=examen_id)
+                for paquete_id, examen_id in PaqueteExamen.objects.filter(
+                    paquete_id__in=paquete_ids, estado='Activo'
+                ).values_list('paquete_id', 'examen_id')
+            ]
+        cls.objects.bulk_create(filas, ignore_conflicts=connection.features.supports_ignore_conflicts)
+
+    @classmethod
+    def quitar(cls, orden_id, examen_id=None, paquete_id=None):
+        """ Quita un examen directo o todo lo que aportaba un paquete. """
+        filas = cls.objects.filter(orden_id=orden_id)
+        if paquete_id is not None:
+            filas.filter(paquete_id=paquete_id).delete()
+        else:
+            filas.filter(paquete__isnull=True, examen_id=examen_id).delete()
+
+
+class TrabajoPDF(models.Model):
+    """
+    Cola de generación de PDFs (resultados, facturas y exportaciones de
+    resultados por lotes). La vista solo encola y el comando `procesar_pdfs`
+    genera el archivo fuera del ciclo de la petición.
+    Solo puede haber un trabajo activo por documento (tipo, objeto_id y
+    clave): las peticiones simultáneas del mismo PDF comparten el trabajo
+    (ver encolar).
+    """
+    TIPO_CHOICES = [
+        ('Resultado', 'Resultado'),
+        ('Factura', 'Factura'),
+        ('Exportacion', 'Exportación de resultados'),
+    ]
+    ESTADO_CHOICES = [
+        ('Pendiente', 'Pendiente'),
+        ('Procesando', 'Procesando'),
+        ('Completado', 'Completado'),
+        ('Error', 'Error'),
+    ]
+    ESTADOS_ACTIVOS = ('Pendiente', 'Procesando')
+
+    trabajo_id = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    # orden_id (Resultado), factura_id (Factura) o convenio_id / 0 (Exportacion)
+    objeto_id = models.IntegerField()
+    # SHA-256 de los filtros de una exportación; vacía en los demás tipos
+    clave = models.CharField(max_length=64, blank=True, default='')
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='Pendiente')
+    archivo = models.CharField(max_length=255, blank=True) # Ruta del PDF terminado
+    nombre_descarga = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    parametros = models.JSONField(default=dict, blank=True) # Filtros de la exportación
+    resumen = models.JSONField(default=dict, blank=True) # Resultado de la exportación (exportados, errores)
+    solicitado_por = models.ForeignKey(
+        'usuarios.Usuario', on_delete=models.SET_NULL, null=True, blank=True
+    )
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True) # Identifica la toma del worker actual
+    fecha_latido = models.DateTimeField(null=True, blank=True) # Último aviso de vida del worker
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'Trabajos_PDF'
+        constraints = [
+            # Deduplicación: un solo trabajo Pendiente/Procesando por documento
+            models.UniqueConstraint(
+                fields=['tipo', 'objeto_id', 'clave'],
+                condition=models.Q(estado__in=('Pendiente', 'Procesando')),
+                name='trabajo_pdf_activo_unico',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['estado', 'trabajo_id'], name='trabajo_pdf_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"PDF {self.tipo} #{self.objeto_id} ({self.estado})"
+
+    @classmethod
+    def encolar(cls, tipo, objeto_id, usuario=None, parametros=None, clave=''):
+        """
+        Devuelve el trabajo activo del documento o crea uno nuevo.
+        La restricción única parcial resuelve la carrera entre dos peticiones
+        simultáneas: la que pierde el INSERT reutiliza el trabajo de la otra.
+        """
+        activos = cls.objects.filter(
+            tipo=tipo, objeto_id=objeto_id, clave=clave, estado__in=cls.ESTADOS_ACTIVOS
+        )
+        trabajo = activos.first()
+        if trabajo:
+            return trabajo
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    tipo=tipo, objeto_id=objeto_id, clave=clave, solicitado_por=usuario,
+                    parametros=parametros or {},
+                )
+        except IntegrityError:
+            # Si el otro trabajo ya terminó entre tanto, se vuelve a intentar
+            return activos.first() or cls.encolar(tipo, objeto_id, usuario, parametros, clave)
+
+    @property
+    def terminado(self):
+        return self.estado not in self.ESTADOS_ACTIVOS
@@ -0,0 +1,116 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class PaginaKeyset:
+    """ Una página de resultados y los cursores para moverse a la siguiente/anterior. """
+
+    def __init__(self, objetos, cursor_siguiente=None, cursor_anterior=None):
+        self.objetos = objetos
+        self.cursor_siguiente = cursor_siguiente
+        self.cursor_anterior = cursor_anterior
+
+    @property
+    def tiene_siguiente(self):
+        return self.cursor_siguiente is not None
+
+    @property
+    def tiene_anterior(self):
+        return self.cursor_anterior is not None
+
+
+def paginar_keyset(queryset, orden, cursor=None, por_pagina=50):
+    """
+    Paginación por "seek" (keyset) en lugar de OFFSET: cada página se pide
+    con un WHERE sobre la última fila vista, así una página profunda cuesta lo
+    mismo que la primera si existe un índice con las columnas de `orden`.
+
+    - orden: campos de ordenamiento únicos en conjunto, con '-' para DESC.
+      Ej: ('-fecha_creacion', '-orden_id'). Pueden ser anotaciones del queryset.
+    - cursor: token opaco devuelto en una página anterior (None = primera página).
+    """
+    orden = list(orden)
+    direccion, valores = _leer_cursor(queryset.model, orden, cursor)
+
+    if direccion == 'anterior':
+        # Se recorre al revés desde el cursor y luego se reordena la página
+        invertido = [_invertir(campo) for campo in orden]
+        filas = list(
+            queryset.filter(_despues_de(invertido, valores)).order_by(*invertido)[:por_pagina + 1]
+        )
+        hay_mas = len(filas) > por_pagina
+        objetos = list(reversed(filas[:por_pagina]))
+        return PaginaKeyset(
+            objetos,
+            cursor_siguiente=_crear_cursor('siguiente', orden, objetos[-1]) if objetos else None,
+            cursor_anterior=_crear_cursor('anterior', orden, objetos[0]) if hay_mas else None,
+        )
+
+    if valores is not None:
+        queryset = queryset.filter(_despues_de(orden, valores))
+    filas = list(queryset.order_by(*orden)[:por_pagina + 1])
+    hay_mas = len(filas) > por_pagina
+    objetos = filas[:por_pagina]
+    return PaginaKeyset(
+        objetos,
+        cursor_siguiente=_crear_cursor('siguiente', orden, objetos[-1]) if hay_mas else None,
+        cursor_anterior=_crear_cursor('anterior', orden, objetos[0]) if (valores is not None and objetos) else None,
+    )
+
+
+def _invertir(campo):
+    return campo[1:] if campo.startswith('-') else f'-{campo}'
+
+
+def _despues_de(orden, valores):
+    """
+    Condición "estrictamente después de `valores`" en el orden dado, escrita
+    como OR de prefijos iguales (SQL Server no soporta comparar tuplas):
+    (a < x) OR (a = x AND b < y) ...
+    """
+    condicion = Q()
+    for i, campo in enumerate(orden):
+        nombre = campo.lstrip('-')
+        lookup = 'lt' if campo.startswith('-') else 'gt'
+        parte = Q(**{f'{nombre}__{lookup}': valores[i]})
+        for campo_previo, valor_previo in zip(orden[:i], valores[:i]):
+            parte &= Q(**{campo_previo.lstrip('-'): valor_previo})
+        condicion |= parte
+    return condicion
+
+
+def _crear_cursor(direccion, orden, objeto):
+    valores = [_serializar(getattr(objeto, campo.lstrip('-'))) for campo in orden]
+    datos = json.dumps({'d': direccion, 'v': valores}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode()).decode()
+
+
+def _serializar(valor):
+    # isoformat completo: el cursor debe conservar los microsegundos
+    return valor.isoformat() if hasattr(valor, 'isoformat') else valor
+
+
+def _leer_cursor(modelo, orden, cursor):
+    """ Devuelve (direccion, valores) o ('siguiente', None) si no hay cursor o es inválido. """
+    if not cursor:
+        return 'siguiente', None
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        direccion, crudos = datos['d'], datos['v']
+        if direccion not in ('siguiente', 'anterior') or len(crudos) != len(orden):
+            raise ValueError
+        valores = [_convertir(modelo, campo.lstrip('-'), valor) for campo, valor in zip(orden, crudos)]
+    except (binascii.Error, ValueError, KeyError, TypeError, ValidationError):
+        return 'siguiente', None
+    return direccion, valores
+
+
+def _convertir(modelo, nombre, valor):
+    try:
+        campo = modelo._meta.get_field(nombre)
+    except FieldDoesNotExist:
+        return valor # Anotación: se usa el valor tal cual (ej: enteros)
+    return campo.to_python(valor)
@@ -0,0 +1,411 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from xhtml2pdf import pisa
+
+from examenes.models import MetodoExamen
+from resultados.models import Resultado, ResultadoDetalle
+from . import cache_pdf
+from .models import Orden, OrdenExamen, OrdenPaquete, TrabajoPDF
+from .reporte import agrupar_detalles, reporte_de_orden
+from .recursos_pdf import medir_recursos
+
+logger = logging.getLogger(__name__)
+
+# Un trabajo 'Procesando' sin latido (ver latido) por más de esto se considera
+# abandonado (worker caído a mitad del render) y vuelve a la cola. Las
+# exportaciones laten en cada lote, así que pueden durar más que esto.
+TIEMPO_MAXIMO_PROCESO = timedelta(minutes=10)
+# Cada cuánto el worker purga los trabajos vencidos (ver purgar_trabajos)
+INTERVALO_PURGA = timedelta(minutes=10)
+
+
+# tipo de documento -> correo de contacto que imprime (claves de settings.EMPRESA)
+CORREOS_EMPRESA = {'Resultado': 'email_resultados', 'Factura': 'email_facturas'}
+
+# tipo -> fragmento fijo del documento (membrete), renderizado una vez por proceso
+MEMBRETES = {
+    'Resultado': 'resultados/resultado_pdf_membrete.html',
+    'Factura': 'facturas/factura_pdf_membrete.html',
+}
+
+# Fases medidas en cada PDF generado por la cola (ver metricas_pdf)
+FASES_PDF = ('datos', 'html', 'pisa', 'escritura')
+
+_membretes = {} # tipo -> (datos de la empresa, HTML)
+_candado = threading.Lock()
+
+# tipo -> {'documentos', 'bytes', 'fases': {fase: {'total_ms', 'max_ms'}}} (por proceso)
+metricas_pdf = {}
+
+
+class ErrorPDF(Exception):
+    pass
+
+
+class TemporalPDF(tempfile.SpooledTemporaryFile):
+    """
+    Archivo temporal en memoria hasta PDF_SPOOL_MAX_BYTES y en disco después.
+    pisa escribe el documento de una sola vez: si esa escritura supera el
+    límite, se pasa a disco antes (SpooledTemporaryFile la guardaría primero
+    en memoria y la copiaría al pasar a disco).
+    """
+
+    def __init__(self, max_size=None):
+        super().__init__(max_size=settings.PDF_SPOOL_MAX_BYTES if max_size is None else max_size)
+
+    def write(self, s):
+        if not self._rolled and self._max_size and self.tell() + len(s) > self._max_size:
+            self.rollover()
+        return super().write(s)
+
+    @property
+    def en_disco(self):
+        return self._rolled
+
+
+def empresa(tipo):
+    """ Datos del membrete (settings.EMPRESA) con el correo del tipo de documento. """
+    datos = settings.EMPRESA
+    return {
+        'nombre': datos['nombre'],
+        'direccion': datos['direccion'],
+        'telefono': datos['telefono'],
+        'email': datos[CORREOS_EMPRESA[tipo]],
+    }
+
+
+def membrete(tipo):
+    """ HTML del membrete del documento; se vuelve a renderizar solo si cambian los datos. """
+    datos = empresa(tipo)
+    guardado = _membretes.get(tipo)
+    if guardado is None or guardado[0] != datos or settings.DEBUG:
+        guardado = (datos, mark_safe(get_template(MEMBRETES[tipo]).render({'empresa': datos})))
+        _membretes[tipo] = guardado
+    return guardado[1]
+
+
+@contextmanager
+def medir_fase(tiempos, fase):
+    """ Guarda en tiempos[fase] los segundos que tarda el bloque. """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tiempos[fase] = time.perf_counter() - inicio
+
+
+def registrar_metricas(tipo, tiempos, bytes_escritos):
+    """ Acumula las fases de un PDF en metricas_pdf y las deja en el log. """
+    with _candado:
+        metricas = metricas_pdf.setdefault(tipo, {
+            'documentos': 0,
+            'bytes': 0,
+            'fases': {fase: {'total_ms': 0.0, 'max_ms': 0.0} for fase in FASES_PDF},
+        })
+        metricas['documentos'] += 1
+        metricas['bytes'] += bytes_escritos
+        for fase, segundos in tiempos.items():
+            acumulado = metricas['fases'][fase]
+            acumulado['total_ms'] += segundos * 1000
+            acumulado['max_ms'] = max(acumulado['max_ms'], segundos * 1000)
+    logger.info(
+        "PDF %s (%d bytes): %s", tipo, bytes_escritos,
+        ", ".join(f"{fase} {tiempos[fase] * 1000:.1f} ms" for fase in FASES_PDF if fase in tiempos)
+    )
+
+
+def resumen_metricas():
+    """ Una línea por tipo de documento con el promedio y el máximo de cada fase. """
+    lineas = []
+    for tipo, metricas in sorted(metricas_pdf.items()):
+        documentos = metricas['documentos']
+        fases = ", ".join(
+            f"{fase} {datos['total_ms'] / documentos:.1f}/{datos['max_ms']:.1f} ms"
+            for fase, datos in metricas['fases'].items()
+        )
+        lineas.append(f"{tipo}: {documentos} PDF(s), {metricas['bytes']} bytes; promedio/máximo: {fases}")
+    return lineas
+
+
+def documento_resultado(orden_id):
+    """ (contexto, nombre de descarga) del reporte de resultados de una orden. """
+    try:
+        orden, resultado, detalles = reporte_de_orden(orden_id)
+    except (Orden.DoesNotExist, Resultado.DoesNotExist):
+        raise Http404("La orden no existe o aún no tiene resultados.")
+    return contexto_resultado(orden, resultado, detalles), f"Resultados_Orden_{orden.pk}.pdf"
+
+
+def contexto_resultado(orden, resultado, detalles):
+    """
+    Contexto del template de resultados (PDF, vista previa y exportación por
+    lotes). `detalles` viene de ordenes.reporte, ya con métodos y rangos.
+    """
+    return {
+        'resultado': resultado,
+        'orden': orden,
+        'paciente': orden.paciente,
+        'detalles': detalles,
+        'grupos': agrupar_detalles(detalles),
+        'fecha_impresion': timezone.now(),
+        'empresa': empresa('Resultado'),
+        'membrete': membrete('Resultado'),
+    }
+
+
+def documento_factura(factura_id):
+    """ (contexto, nombre de descarga) de una factura. """
+    from facturas.models import Factura # Import local: facturas depende de ordenes
+
+    factura = get_object_or_404(Factura.objects.select_related('orden'), pk=factura_id)
+    orden = factura.orden
+    contexto = {
+        'factura': factura,
+        'items_examen': orden.ordenexamen_set.select_related('examen').all(),
+        'items_paquete': orden.ordenpaquete_set.select_related('paquete').all(),
+        'fecha_impresion': timezone.now(),
+        'empresa': empresa('Factura'),
+        'membrete': membrete('Factura'),
+    }
+    return contexto, f"Factura_{factura.numero_factura}.pdf"
+
+
+def firma_resultado(orden_id):
+    """
+    Datos que se imprimen en el reporte de resultados, o None si aún no es
+    cacheable (solo un resultado Validado es definitivo). El rango impreso es
+    el del valor de referencia de cada detalle.
+    """
+    cabecera = list(Resultado.objects.filter(orden_id=orden_id, estado='Validado').values_list(
+        'resultado_id', 'estado', 'observaciones_generales', 'fecha_validacion',
+        'validado_por__username', 'validado_por__nombre', 'validado_por__apellido',
+        'orden__fecha_creacion', 'orden__convenio__nombre',
+        'orden__paciente__nombre', 'orden__paciente__apellido',
+        'orden__paciente__dui', 'orden__paciente__sexo',
+    ))
+    if not cabecera:
+        return None
+    detalles = list(ResultadoDetalle.objects.filter(resultado__orden_id=orden_id).order_by('pk').values_list(
+        'pk', 'valor_obtenido', 'bandera', 'valor_referencia__rango_referencia', 'valor_referencia__unidad_medida',
+        'valor_referencia__examen_id', 'valor_referencia__examen__nombre',
+        'valor_referencia__examen__categoria__nombre',
+    ))
+    metodos = list(MetodoExamen.objects.filter(
+        examen_id__in={fila[5] for fila in detalles}, estado='Activo'
+    ).order_by('pk').values_list('pk', 'examen_id', 'metodo'))
+    return [cabecera, detalles, metodos, empresa('Resultado')]
+
+
+def firma_factura(factura_id):
+    """ Datos que se imprimen en la factura (siempre cacheable: ya fue emitida). """
+    from facturas.models import Factura
+
+    cabecera = list(Factura.objects.filter(pk=factura_id).values_list(
+        'factura_id', 'numero_factura', 'estado', 'tipo_factura', 'cliente_nombre', 'cliente_dui',
+        'fecha_emision', 'fecha_vencimiento', 'subtotal', 'descuento', 'iva', 'total',
+        'observaciones', 'orden_id',
+    ))
+    if not cabecera:
+        return None
+    orden_id = cabecera[0][-1]
+    examenes = list(OrdenExamen.objects.filter(orden_id=orden_id).order_by('pk').values_list(
+        'pk', 'precio_en_orden', 'examen__codigo', 'examen__nombre'))
+    paquetes = list(OrdenPaquete.objects.filter(orden_id=orden_id).order_by('pk').values_list(
+        'pk', 'precio_en_orden', 'paquete__nombre'))
+    return [cabecera, examenes, paquetes, empresa('Factura')]
+
+
+# tipo -> (template, documento, firma)
+DOCUMENTOS = {
+    'Resultado': ('resultados/resultado_pdf.html', documento_resultado, firma_resultado),
+    'Factura': ('facturas/factura_pdf.html', documento_factura, firma_factura),
+}
+
+
+def clave_documento(tipo, objeto_id):
+    """
+    Hash (clave de la caché en disco) de todo lo que determina el PDF: los
+    datos impresos y el código fuente del template. None si no es cacheable.
+    """
+    template_path, _, firma = DOCUMENTOS[tipo]
+    datos = firma(objeto_id)
+    if datos is None:
+        return None
+    fuentes = [get_template(template_path).template.source, get_template(MEMBRETES[tipo]).template.source]
+    contenido = json.dumps([tipo, objeto_id, datos, fuentes], default=str, sort_keys=True)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+def pdf_en_spool(template_path, contexto, tiempos=None):
+    """
+    Renderiza el template a PDF en un TemporalPDF (memoria hasta
+    PDF_SPOOL_MAX_BYTES, disco después) y lo devuelve al inicio, listo para
+    leer o servir (FileResponse calcula el Content-Length). Quien lo recibe
+    lo cierra. Si se pasa `tiempos`, guarda ahí las fases html y pisa.
+    """
+    tiempos = {} if tiempos is None else tiempos
+    with medir_fase(tiempos, 'html'):
+        html = get_template(template_path).render(contexto)
+    spool = TemporalPDF()
+    try:
+        with medir_fase(tiempos, 'pisa'), medir_recursos(template_path) as link_callback:
+            pisa_status = pisa.CreatePDF(html, dest=spool, link_callback=link_callback)
+        if pisa_status.err:
+            raise ErrorPDF(f"xhtml2pdf reportó {pisa_status.err} error(es) al generar {template_path}")
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def renderizar_pdf(template_path, contexto, ruta, tiempos=None):
+    """
+    Renderiza el template a PDF en `ruta` y devuelve los bytes escritos.
+    Si se pasa `tiempos`, guarda ahí las fases html, pisa y escritura.
+    """
+    tiempos = {} if tiempos is None else tiempos
+    with pdf_en_spool(template_path, contexto, tiempos) as spool:
+        with medir_fase(tiempos, 'escritura'), open(ruta, 'wb') as archivo:
+            shutil.copyfileobj(spool, archivo, cache_pdf.TAMANO_BLOQUE)
+            return archivo.tell()
+
+
+def reclamar_trabajo():
+    """
+    Toma el trabajo pendiente más antiguo. El paso Pendiente -> Procesando es
+    un UPDATE condicionado al estado, así varios workers no toman el mismo.
+    fecha_inicio identifica esta toma: si el trabajo se reencola y lo toma
+    otro worker, el primero ya no puede terminarlo (ver latido).
+    """
+    limite = timezone.now() - TIEMPO_MAXIMO_PROCESO
+    TrabajoPDF.objects.filter(estado='Procesando', fecha_latido__lt=limite).update(estado='Pendiente')
+
+    candidatos = TrabajoPDF.objects.filter(estado='Pendiente').order_by('trabajo_id')
+    for trabajo_id in candidatos.values_list('trabajo_id', flat=True)[:10]:
+        ahora = timezone.now()
+        tomado = TrabajoPDF.objects.filter(pk=trabajo_id, estado='Pendiente').update(
+            estado='Procesando', fecha_inicio=ahora, fecha_latido=ahora
+        )
+        if tomado:
+            return TrabajoPDF.objects.get(pk=trabajo_id)
+    return None
+
+
+class TrabajoPerdido(Exception):
+    """ El trabajo se reencoló y lo tomó otro worker: este debe abandonarlo. """
+
+
+def _de_esta_toma(trabajo):
+    return TrabajoPDF.objects.filter(pk=trabajo.pk, estado='Procesando', fecha_inicio=trabajo.fecha_inicio)
+
+
+def latido(trabajo):
+    """
+    Avisa que el worker sigue con el trabajo (para que reclamar_trabajo no lo
+    reencole). TrabajoPerdido si ya no es de esta toma.
+    """
+    if not _de_esta_toma(trabajo).update(fecha_latido=timezone.now()):
+        raise TrabajoPerdido(trabajo.pk)
+
+
+def purgar_trabajos(retencion=None):
+    """
+    Borra los trabajos terminados (Completado o Error) hace más de
+    PDF_TRABAJOS_RETENCION segundos, junto con su archivo. Los PDFs
+    cacheables siguen en la caché (cache_pdf), que tiene su propio límite.
+    Devuelve cuántos trabajos se borraron.
+    """
+    if retencion is None:
+        retencion = settings.PDF_TRABAJOS_RETENCION
+    vencidos = TrabajoPDF.objects.filter(
+        estado__in=('Completado', 'Error'),
+        fecha_fin__lt=timezone.now() - timedelta(seconds=retencion),
+    )
+    borrados = 0
+    for trabajo_id, archivo in vencidos.values_list('trabajo_id', 'archivo').order_by('trabajo_id')[:1000]:
+        if archivo:
+            try:
+                os.remove(archivo)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue # Abierto por una descarga (Windows): se reintenta en la próxima purga
+        borrados += TrabajoPDF.objects.filter(pk=trabajo_id).delete()[0]
+    return borrados
+
+
+def procesar_trabajo(trabajo):
+    """
+    Genera el archivo del trabajo en PDF_TRABAJOS_DIR y lo marca Completado o
+    Error. El archivo lleva un nombre propio de esta toma y el cierre es un
+    UPDATE condicionado a ella: un worker que perdió el trabajo no pisa el
+    archivo ni el estado del que lo tomó después.
+    """
+    carpeta = settings.PDF_TRABAJOS_DIR
+    os.makedirs(carpeta, exist_ok=True)
+    extension = trabajo.parametros.get('formato', 'pdf')
+    ruta = os.path.join(
+        carpeta, f"{trabajo.tipo.lower()}_{trabajo.objeto_id}_{trabajo.pk}_{uuid.uuid4().hex[:12]}.{extension}"
+    )
+    temporal = f"{ruta}.tmp"
+    cambios = {}
+    clave = None
+    try:
+        if trabajo.tipo == 'Exportacion':
+            from resultados.exportacion import exportar_trabajo
+
+            nombre, cambios['resumen'] = exportar_trabajo(
+                trabajo.parametros, temporal, al_avanzar=lambda: latido(trabajo)
+            )
+        else:
+            template_path, documento, _ = DOCUMENTOS[trabajo.tipo]
+            tiempos = {}
+            with medir_fase(tiempos, 'datos'):
+                clave = clave_documento(trabajo.tipo, trabajo.objeto_id)
+                contexto, nombre = documento(trabajo.objeto_id)
+            bytes_escritos = renderizar_pdf(template_path, contexto, temporal, tiempos)
+            registrar_metricas(trabajo.tipo, tiempos, bytes_escritos)
+        # El archivo solo aparece completo: la descarga nunca ve un PDF a medias
+        os.replace(temporal, ruta)
+    except TrabajoPerdido:
+        _borrar(temporal)
+        return trabajo
+    except Exception:
+        _borrar(temporal)
+        cambios.update(estado='Error', error=traceback.format_exc(limit=5))
+    else:
+        cambios.update(estado='Completado', archivo=ruta, nombre_descarga=nombre)
+    cambios['fecha_fin'] = timezone.now()
+
+    if not _de_esta_toma(trabajo).update(**cambios):
+        _borrar(ruta) # Lo terminó (o lo está generando) otro worker
+        return trabajo
+    if clave and cambios['estado'] == 'Completado':
+        cache_pdf.guardar(trabajo.tipo, trabajo.objeto_id, clave, ruta)
+    for campo, valor in cambios.items():
+        setattr(trabajo, campo, valor)
+    return trabajo
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,138 @@
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache, caches
+from django.db.models import CharField, Value
+
+from convenios.models import Convenio, ConvenioExamen, ConvenioPaquete
+
+CERO = Decimal('0.00')
+
+# --- Caché de la matriz de descuentos por convenio ---
+# Clave = convenio_id + sello de versión. Al invalidar se incrementa la versión,
+# así las entradas viejas dejan de leerse y expiran solas (CACHE_TIMEOUT).
+# Cada proceso guarda su copia de la matriz (LocMemCache), pero el sello vive
+# en la caché 'compartida' (base de datos): un cambio hecho en un worker deja
+# de servir la matriz vieja en todos en la siguiente lectura.
+CACHE_PREFIJO = 'descuentos_convenio'
+CACHE_TIMEOUT = 60 * 10
+estadisticas_cache = {'hits': 0, 'misses': 0}
+
+
+def aplicar_descuento(precio_base, descuento_pct):
+    """
+    Aplica un porcentaje de descuento a un precio de lista.
+    Fórmula: Precio * (1 - (Descuento / 100)), redondeado a centavos.
+    """
+    factor = (Decimal('100') - descuento_pct) / Decimal('100')
+    return (precio_base * factor).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class TablaDescuentos:
+    """
+    Matriz en memoria con los descuentos de un convenio.
+    Jerarquía: Específico (Nivel 1) > General (Nivel 2) > Sin convenio (0%).
+    """
+
+    def __init__(self, examenes=None, paquetes=None,
+                 general_examenes=CERO, general_paquetes=CERO):
+        self.examenes = examenes or {}
+        self.paquetes = paquetes or {}
+        self.general_examenes = general_examenes
+        self.general_paquetes = general_paquetes
+
+    @classmethod
+    def para_convenio(cls, convenio_id):
+        """
+        Devuelve la matriz del convenio desde la caché; si no está, la carga
+        y la guarda con la versión vigente.
+        """
+        if convenio_id is None:
+            return cls()
+
+        clave = f'{CACHE_PREFIJO}:{convenio_id}:v{version_descuentos(convenio_id)}'
+        tabla = cache.get(clave)
+        if tabla is not None:
+            estadisticas_cache['hits'] += 1
+            return tabla
+
+        estadisticas_cache['misses'] += 1
+        tabla = cls.cargar(convenio_id)
+        cache.set(clave, tabla, CACHE_TIMEOUT)
+        return tabla
+
+    @classmethod
+    def cargar(cls, convenio_id):
+        """
+        Carga los descuentos generales y TODOS los específicos del convenio
+        en una sola consulta (UNION).
+        """
+        def filas(queryset, nivel, campo_id, campo_pct):
+            return queryset.annotate(
+                nivel=Value(nivel, output_field=CharField())
+            ).values_list('nivel', campo_id, campo_pct).order_by()
+
+        convenio = Convenio.objects.filter(pk=convenio_id)
+        consulta = filas(convenio, 'GE', 'pk', 'descuento_general_examenes').union(
+            filas(convenio, 'GP', 'pk', 'descuento_general_paquetes'),
+            filas(ConvenioExamen.objects.filter(convenio_id=convenio_id),
+                  'E', 'examen_id', 'porcentaje_descuento'),
+            filas(ConvenioPaquete.objects.filter(convenio_id=convenio_id),
+                  'P', 'paquete_id', 'porcentaje_descuento'),
+            all=True,
+        )
+
+        tabla = cls()
+        for nivel, item_id, porcentaje in consulta:
+            if nivel == 'GE':
+                tabla.general_examenes = porcentaje
+            elif nivel == 'GP':
+                tabla.general_paquetes = porcentaje
+            elif nivel == 'E':
+                tabla.examenes[item_id] = porcentaje
+            else:
+                tabla.paquetes[item_id] = porcentaje
+        return tabla
+
+    def porcentaje_examen(self, examen_id):
+        return self.examenes.get(examen_id, self.general_examenes)
+
+    def porcentaje_paquete(self, paquete_id):
+        return self.paquetes.get(paquete_id, self.general_paquetes)
+
+    def precio_examen(self, examen):
+        return aplicar_descuento(examen.precio, self.porcentaje_examen(examen.pk))
+
+    def precio_paquete(self, paquete):
+        return aplicar_descuento(paquete.precio, self.porcentaje_paquete(paquete.pk))
+
+
+def _versiones():
+    return caches['compartida']
+
+
+def _clave_version(convenio_id):
+    return f'{CACHE_PREFIJO}:{convenio_id}:version'
+
+
+def version_descuentos(convenio_id):
+    """
+    Sello de versión vigente de la matriz del convenio. Si se perdió
+    (reinicio o purga de la caché) se crea uno nuevo basado en el reloj,
+    que nunca coincide con versiones anteriores.
+    """
+    versiones, clave = _versiones(), _clave_version(convenio_id)
+    version = versiones.get(clave)
+    if version is None:
+        nueva = time.time_ns()
+        # Si otro worker lo creó primero, gana el suyo
+        version = nueva if versiones.add(clave, nueva, None) else versiones.get(clave)
+    return version
+
+
+def invalidar_descuentos(convenio_id):
+    """ Llamar cada vez que cambian los descuentos (generales o específicos) del convenio. """
+    versiones = _versiones()
+    try:
+        versiones.incr(_clave_version(convenio_id))
+    except ValueError:
+        versiones.set(_clave_version(convenio_id), time.time_ns(), None)
@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from PIL import Image # Dependencia de xhtml2pdf (reportlab)
+
+# --- Recursos (CSS, imágenes) de los PDFs ---
+# xhtml2pdf pide cada URI del template a link_callback en cada render. Aquí
+# se resuelven una vez por proceso: el mapa URI -> ruta queda en memoria y
+# se precalienta al iniciar el worker (procesar_pdfs) con todos los
+# estáticos. Las imágenes más grandes que PDF_IMAGEN_MAX_PX se reducen una
+# sola vez a PDF_RECURSOS_DIR: el PDF no necesita el logo a resolución de
+# pantalla y decodificarlo en cada render era lo más caro del recurso.
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES_IMAGEN = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+_rutas = {}
+_candado = threading.Lock()
+
+
+def _max_px():
+    return getattr(settings, 'PDF_IMAGEN_MAX_PX', 600)
+
+
+def resolver(uri):
+    """
+    Ruta absoluta del recurso (estático o media) para xhtml2pdf. Las URIs
+    externas (http, data:) se devuelven tal cual. FileNotFoundError si es
+    un estático o media que no existe.
+    """
+    ruta = _rutas.get(uri)
+    if ruta is not None:
+        return ruta
+
+    ruta = _buscar(uri)
+    if ruta is None:
+        return uri
+    if ruta.lower().endswith(EXTENSIONES_IMAGEN):
+        ruta = preparar_imagen(ruta)
+    with _candado:
+        _rutas[uri] = ruta
+    return ruta
+
+
+def _buscar(uri):
+    """ Ruta original del recurso, o None si la URI no es local. """
+    static_url = settings.STATIC_URL
+    media_url = getattr(settings, 'MEDIA_URL', '')
+    media_root = getattr(settings, 'MEDIA_ROOT', '')
+
+    if uri.startswith(static_url):
+        ruta = finders.find(uri[len(static_url):])
+        if isinstance(ruta, (list, tuple)):
+            ruta = ruta[0] if ruta else None
+    elif media_url and media_root and uri.startswith(media_url):
+        ruta = os.path.join(media_root, uri[len(media_url):])
+    else:
+        return None
+
+    if not ruta or not os.path.isfile(ruta):
+        raise FileNotFoundError(f"Recurso del PDF no encontrado: {uri}")
+    return os.path.realpath(ruta)
+
+
+def preparar_imagen(ruta):
+    """
+    Versión reducida (lado mayor <= PDF_IMAGEN_MAX_PX) de la imagen en
+    PDF_RECURSOS_DIR, generada una sola vez; la original si ya es chica.
+    """
+    max_px = _max_px()
+    info = os.stat(ruta)
+    clave = hashlib.sha256(f"{ruta}:{info.st_mtime_ns}:{info.st_size}:{max_px}".encode()).hexdigest()[:32]
+    _, extension = os.path.splitext(ruta)
+    destino = os.path.join(settings.PDF_RECURSOS_DIR, f"{clave}{extension.lower()}")
+    if os.path.exists(destino):
+        return destino
+
+    with Image.open(ruta) as imagen:
+        if max(imagen.size) <= max_px:
+            return ruta
+        imagen.thumbnail((max_px, max_px))
+        os.makedirs(settings.PDF_RECURSOS_DIR, exist_ok=True)
+        # Se escribe aparte y se renombra: otro proceso nunca lee una imagen a medias
+        temporal = f"{destino}.{os.getpid()}.tmp"
+        imagen.save(temporal, format=imagen.format or 'PNG', optimize=True)
+    os.replace(temporal, destino)
+    return destino
+
+
+def precalentar():
+    """ Resuelve (y reduce) todos los estáticos de antemano. Devuelve cuántos quedaron en memoria. """
+    inicio = time.perf_counter()
+    for finder in finders.get_finders():
+        for ruta_relativa, _ in finder.list([]):
+            uri = settings.STATIC_URL + ruta_relativa.replace(os.sep, '/')
+            try:
+                resolver(uri)
+            except (OSError, Image.UnidentifiedImageError):
+                logger.warning("No se pudo preparar el recurso %s para los PDFs", uri, exc_info=True)
+    logger.info("Recursos de PDF precalentados: %d en %.1f ms", len(_rutas), (time.perf_counter() - inicio) * 1000)
+    return len(_rutas)
+
+
+def olvidar():
+    """ Vacía el mapa en memoria (ej: tras cambiar los estáticos o en pruebas). """
+    with _candado:
+        _rutas.clear()
+
+
+def link_callback(uri, rel):
+    """ link_callback de xhtml2pdf sin medición (ver medir_recursos). """
+    return resolver(uri)
+
+
+@contextmanager
+def medir_recursos(documento):
+    """
+    link_callback que mide cuánto tarda la resolución de recursos del render
+    y lo registra en el log al terminar:
+
+        with medir_recursos('Factura 12') as callback:
+            pisa.CreatePDF(html, dest=archivo, link_callback=callback)
+    """
+    medicion = {'recursos': 0, 'segundos': 0.0}
+
+    def callback(uri, rel):
+        inicio = time.perf_counter()
+        try:
+            return resolver(uri)
+        finally:
+            medicion['recursos'] += 1
+            medicion['segundos'] += time.perf_counter() - inicio
+
+    try:
+        yield callback
+    finally:
+        logger.info(
+            "%s: %d recurso(s) resuelto(s) en %.2f ms",
+            documento, medicion['recursos'], medicion['segundos'] * 1000
+        )
@@ -0,0 +1,104 @@
+from django.db.models import Prefetch
+
+from examenes.models import MetodoExamen
+from resultados.models import Resultado, ResultadoDetalle
+from .models import Orden
+
+# --- Datos del reporte de resultados ---
+# Arma todo lo que imprime el reporte (PDF, vista previa HTML y exportación
+# por lotes) en un número fijo de consultas: cabecera, detalles y métodos
+# activos (Prefetch), sin importar cuántos parámetros tenga la orden. El
+# template no debe consultar nada. El rango impreso es el valor de referencia
+# guardado en cada detalle: el mismo contra el que se calculó su bandera.
+
+# Orden de los parámetros en el reporte: categoría -> examen -> parámetro
+ORDEN_DETALLES_REPORTE = (
+    'valor_referencia__examen__categoria__nombre',
+    'valor_referencia__examen__nombre',
+    'valor_referencia__pk',
+)
+
+
+class GrupoExamen:
+    """ Un examen del reporte con sus métodos activos y sus parámetros (detalles). """
+
+    def __init__(self, examen):
+        self.examen = examen
+        self.metodos = examen.metodos_activos
+        self.parametros = []
+
+
+class GrupoCategoria:
+    """ Una categoría del reporte con sus exámenes, en orden de impresión. """
+
+    def __init__(self, categoria):
+        self.categoria = categoria
+        self.examenes = []
+
+
+def detalles_de_resultados(resultado_ids):
+    """
+    {resultado_id: [detalles]} en orden de reporte, con valor de referencia,
+    examen, categoría y los métodos activos del examen (examen.metodos_activos)
+    ya cargados: 2 consultas para cualquier cantidad de resultados.
+    """
+    detalles = ResultadoDetalle.objects.filter(resultado_id__in=resultado_ids).select_related(
+        'valor_referencia',
+        'valor_referencia__examen',
+        'valor_referencia__examen__categoria'
+    ).prefetch_related(
+        Prefetch(
+            'valor_referencia__examen__metodos',
+            queryset=MetodoExamen.objects.filter(estado='Activo').order_by('pk'),
+            to_attr='metodos_activos',
+        )
+    ).order_by(*ORDEN_DETALLES_REPORTE)
+
+    por_resultado = {resultado_id: [] for resultado_id in resultado_ids}
+    for detalle in detalles:
+        por_resultado[detalle.resultado_id].append(detalle)
+    return por_resultado
+
+
+def agrupar_detalles(detalles):
+    """ Detalles (en orden de reporte) -> [GrupoCategoria] -> [GrupoExamen] -> parámetros. """
+    grupos = []
+    for detalle in detalles:
+        examen = detalle.valor_referencia.examen
+        if not grupos or grupos[-1].categoria.pk != examen.categoria_id:
+            grupos.append(GrupoCategoria(examen.categoria))
+        examenes = grupos[-1].examenes
+        if not examenes or examenes[-1].examen.pk != examen.pk:
+            examenes.append(GrupoExamen(examen))
+        examenes[-1].parametros.append(detalle)
+    return grupos
+
+
+def resultados_para_reporte(resultados, tamano_lote):
+    """
+    Recorre los resultados por lotes, cada uno con sus detalles listos para
+    imprimir: 1 consulta de ids en total y 3 por lote (cabeceras, detalles
+    y métodos).
+    Produce listas de (resultado, [detalles]).
+    """
+    ids = list(resultados.values_list('pk', flat=True))
+    for i in range(0, len(ids), tamano_lote):
+        lote_ids = ids[i:i + tamano_lote]
+        cabeceras = Resultado.objects.filter(pk__in=lote_ids).select_related(
+            'orden', 'orden__paciente', 'orden__convenio', 'validado_por'
+        ).in_bulk()
+        detalles = detalles_de_resultados(lote_ids)
+        yield [(cabeceras[pk], detalles[pk]) for pk in lote_ids if pk in cabeceras]
+
+
+def reporte_de_orden(orden_id):
+    """
+    (orden, resultado, detalles) del reporte de una orden en 3 consultas, o
+    Orden.DoesNotExist / Resultado.DoesNotExist si no existe.
+    """
+    orden = Orden.objects.select_related(
+        'paciente', 'convenio', 'resultado', 'resultado__validado_por'
+    ).get(pk=orden_id)
+    resultado = orden.resultado
+    detalles = detalles_de_resultados([resultado.pk])[resultado.pk]
+    return orden, resultado, detalles
@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from convenios.models import Convenio
+from pacientes.models import Paciente
+from .busqueda_api import invalidar_busqueda
+from .models import OrdenExamen, OrdenExamenEfectivo, OrdenPaquete
+
+
+@receiver([post_save, post_delete], sender=Paciente)
+def invalidar_busqueda_pacientes(sender, **kwargs):
+    invalidar_busqueda('pacientes')
+
+
+@receiver([post_save, post_delete], sender=Convenio)
+def invalidar_busqueda_convenios(sender, **kwargs):
+    invalidar_busqueda('convenios')
+
+
+# --- Exámenes efectivos de la orden (ver OrdenExamenEfectivo) ---
+# Las altas con bulk_create no emiten señales: esas vistas llaman a
+# OrdenExamenEfectivo.registrar directamente.
+
+@receiver(post_save, sender=OrdenExamen)
+def registrar_examen_efectivo(sender, instance, created, **kwargs):
+    if created:
+        OrdenExamenEfectivo.registrar(instance.orden_id, examen_ids=[instance.examen_id])
+
+
+@receiver(post_save, sender=OrdenPaquete)
+def registrar_paquete_efectivo(sender, instance, created, **kwargs):
+    if created:
+        OrdenExamenEfectivo.registrar(instance.orden_id, paquete_ids=[instance.paquete_id])
+
+
+@receiver(post_delete, sender=OrdenExamen)
+def quitar_examen_efectivo(sender, instance, **kwargs):
+    OrdenExamenEfectivo.quitar(instance.orden_id, examen_id=instance.examen_id)
+
+
+@receiver(post_delete, sender=OrdenPaquete)
+def quitar_paquete_efectivo(sender, instance, **kwargs):
+    OrdenExamenEfectivo.quitar(instance.orden_id, paquete_id=instance.paquete_id)
@@ -1,3 +1,841 @@
-from django.test import TestCase
+from datetime import date, timedelta
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.template.loader import get_template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from categorias.models import CategoriaExamen
+from convenios.models import Convenio, ConvenioExamen, ConvenioPaquete
+from examenes.models import Examen, MetodoExamen, ValorReferencia
+from pacientes.models import Paciente
+from paquetes.models import Paquete, PaqueteExamen
+from roles.models import Rol
+from tipos_muestras.models import TipoMuestra
+from usuarios.models import Usuario
+from facturas.models import Factura
+from resultados.models import Resultado, ResultadoDetalle
+from .models import Orden, OrdenExamen, OrdenExamenEfectivo, OrdenPaquete, TrabajoPDF
+from . import cache_pdf, pdf, recursos_pdf
+from .pdf import DOCUMENTOS, clave_documento, documento_resultado, procesar_trabajo, reclamar_trabajo
+from .precios import estadisticas_cache, invalidar_descuentos, version_descuentos
+
+
+class OrdenTestMixin:
+    """ Datos mínimos (catálogo, paciente y convenio) para probar órdenes. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+        cls.tipo_muestra = TipoMuestra.objects.create(
+            nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+        )
+        cls.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+            dui='01234567-8', telefono='22223333', correo='ana@example.com'
+        )
+        cls.convenio = Convenio.objects.create(
+            nombre='Empresa Uno', tipo='Empresa', persona_contacto='Luis',
+            telefono_contacto='22224444', correo_contacto='rrhh@example.com',
+            condiciones_pago='Crédito 30 días',
+            descuento_general_examenes=Decimal('10.00'),
+            descuento_general_paquetes=Decimal('5.00'),
+        )
+        rol = Rol.objects.create(nombre='Recepcionista', descripcion='Recepción de pacientes')
+        cls.usuario = Usuario.objects.create_user(
+            username='recepcion', password='clave-segura-123', email='recepcion@example.com',
+            nombre='Rita', apellido='Recepción', dui='09876543-2', rol=rol
+        )
+
+    @classmethod
+    def crear_examenes(cls, cantidad, desde=0):
+        return [
+            Examen.objects.create(
+                nombre=f'Examen {i}', codigo=f'EX{i}', precio=Decimal('10.00') + i,
+                categoria=cls.categoria, tipo_muestra=cls.tipo_muestra
+            )
+            for i in range(desde, desde + cantidad)
+        ]
+
+    @classmethod
+    def crear_paquetes(cls, cantidad, desde=0):
+        return [
+            Paquete.objects.create(nombre=f'Paquete {i}', precio=Decimal('50.00') + i)
+            for i in range(desde, desde + cantidad)
+        ]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def crear_orden(self, examenes=(), paquetes=(), convenio=None):
+        orden = Orden.objects.create(paciente=self.paciente, convenio=convenio)
+        OrdenExamen.objects.bulk_create([
+            OrdenExamen(orden=orden, examen=e, precio_en_orden=e.precio) for e in examenes
+        ])
+        OrdenPaquete.objects.bulk_create([
+            OrdenPaquete(orden=orden, paquete=p, precio_en_orden=p.precio) for p in paquetes
+        ])
+        OrdenExamenEfectivo.registrar(orden.pk, [e.pk for e in examenes], [p.pk for p in paquetes])
+        return orden
+
+
+class CalcularTotalesTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.examenes = cls.crear_examenes(40)
+        cls.paquetes = cls.crear_paquetes(10)
+        # Descuentos específicos (Nivel 1) para algunos ítems
+        ConvenioExamen.objects.create(
+            convenio=cls.convenio, examen=cls.examenes[0], porcentaje_descuento=Decimal('50.00')
+        )
+        ConvenioPaquete.objects.create(
+            convenio=cls.convenio, paquete=cls.paquetes[0], porcentaje_descuento=Decimal('20.00')
+        )
+
+    def test_aplica_descuento_especifico_y_general(self):
+        orden = self.crear_orden(self.examenes[:2], self.paquetes[:2], convenio=self.convenio)
+        orden.calcular_totales()
+
+        precios = dict(orden.ordenexamen_set.values_list('examen_id', 'precio_en_orden'))
+        self.assertEqual(precios[self.examenes[0].pk], Decimal('5.00'))   # 10.00 - 50%
+        self.assertEqual(precios[self.examenes[1].pk], Decimal('9.90'))   # 11.00 - 10%
+        precios = dict(orden.ordenpaquete_set.values_list('paquete_id', 'precio_en_orden'))
+        self.assertEqual(precios[self.paquetes[0].pk], Decimal('40.00'))  # 50.00 - 20%
+        self.assertEqual(precios[self.paquetes[1].pk], Decimal('48.45'))  # 51.00 - 5%
+
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('103.35'))
+        self.assertEqual(orden.descuento_aplicado, Decimal('18.65'))
+        self.assertEqual(orden.iva, Decimal('13.44'))
+        self.assertEqual(orden.total_con_iva, Decimal('116.79'))
+        self.assertEqual(orden.estado_pago, 'Pendiente')
+
+    def test_sin_convenio_cobra_precio_de_lista(self):
+        orden = self.crear_orden(self.examenes[:3])
+        orden.calcular_totales()
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('33.00'))
+        self.assertEqual(orden.descuento_aplicado, Decimal('0.00'))
+
+    def test_numero_de_consultas_constante(self):
+        """
+        Sello de versión + matriz de descuentos (UNION) + 2 lecturas de ítems
+        + 2 bulk_update + pagos + UPDATE orden + UPDATE factura, más los savepoints.
+        """
+        pequena = self.crear_orden(self.examenes[:2], self.paquetes[:1], convenio=self.convenio)
+        grande = self.crear_orden(self.examenes, self.paquetes, convenio=self.convenio)
+
+        conteos = []
+        for orden in (pequena, grande):
+            cache.clear()
+            version_descuentos(self.convenio.pk)
+            orden = Orden.objects.get(pk=orden.pk)
+            with CaptureQueriesContext(connection) as ctx:
+                orden.calcular_totales()
+            conteos.append(len(ctx.captured_queries))
+
+        self.assertEqual(conteos, [11, 11])
+
+    def test_matriz_de_descuentos_en_cache(self):
+        orden = self.crear_orden(self.examenes[:5], convenio=self.convenio)
+        orden.calcular_totales()
+        hits = estadisticas_cache['hits']
+
+        # Con la matriz en caché (y sin precios que cambiar) solo quedan la
+        # lectura del sello compartido, las de ítems, pagos y los dos UPDATE,
+        # más los savepoints.
+        with self.assertNumQueries(8):
+            orden.calcular_totales()
+        self.assertEqual(estadisticas_cache['hits'], hits + 1)
+
+    def test_invalidacion_de_la_matriz(self):
+        orden = self.crear_orden(self.examenes[1:2], convenio=self.convenio)
+        orden.calcular_totales()
+        ConvenioExamen.objects.create(
+            convenio=self.convenio, examen=self.examenes[1], porcentaje_descuento=Decimal('100.00')
+        )
+        orden.calcular_totales()
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('9.90')) # Aún se usa la matriz cacheada
+
+        invalidar_descuentos(self.convenio.pk)
+        orden.calcular_totales()
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('0.00'))
+
+
+class RecalculoIncrementalTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.examenes = cls.crear_examenes(6)
+        cls.paquetes = cls.crear_paquetes(3)
+        ConvenioExamen.objects.create(
+            convenio=cls.convenio, examen=cls.examenes[1], porcentaje_descuento=Decimal('33.33')
+        )
+        ConvenioPaquete.objects.create(
+            convenio=cls.convenio, paquete=cls.paquetes[2], porcentaje_descuento=Decimal('12.50')
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def assertEquivaleARecalculoCompleto(self, orden):
+        self.assertEqual(orden.verificar_totales(), {})
+        incremental = Orden.objects.values(
+            'subtotal', 'descuento_aplicado', 'iva', 'total_con_iva', 'estado_pago'
+        ).get(pk=orden.pk)
+        orden.calcular_totales()
+        completo = Orden.objects.values(*incremental).get(pk=orden.pk)
+        self.assertEqual(incremental, completo)
+
+    def test_vistas_agregar_quitar_equivalen_a_recalculo_completo(self):
+        orden = self.crear_orden(convenio=self.convenio)
+        pasos = [
+            ('orden_add_examen', {'examen_id': self.examenes[0].pk}),
+            ('orden_add_examen', {'examen_id': self.examenes[1].pk}),
+            ('orden_add_paquete', {'paquete_id': self.paquetes[2].pk}),
+            ('orden_add_examen', {'examen_id': self.examenes[4].pk}),
+            ('orden_add_paquete', {'paquete_id': self.paquetes[0].pk}),
+        ]
+        for nombre_url, datos in pasos:
+            self.client.post(reverse(nombre_url, kwargs={'orden_pk': orden.pk}), datos)
+            self.assertEquivaleARecalculoCompleto(orden)
+
+        self.client.post(reverse('orden_remove_examen', kwargs={
+            'orden_pk': orden.pk, 'examen_pk': self.examenes[1].pk}))
+        self.assertEquivaleARecalculoCompleto(orden)
+        self.client.post(reverse('orden_remove_paquete', kwargs={
+            'orden_pk': orden.pk, 'paquete_pk': self.paquetes[2].pk}))
+        self.assertEquivaleARecalculoCompleto(orden)
+
+        self.assertEqual(orden.ordenexamen_set.count(), 2)
+        self.assertEqual(orden.ordenpaquete_set.count(), 1)
+
+    def test_item_duplicado_no_altera_totales(self):
+        orden = self.crear_orden(convenio=self.convenio)
+        url = reverse('orden_add_examen', kwargs={'orden_pk': orden.pk})
+        self.client.post(url, {'examen_id': self.examenes[0].pk})
+        self.client.post(url, {'examen_id': self.examenes[0].pk})
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('9.00'))
+        self.assertEquivaleARecalculoCompleto(orden)
+
+    def test_quitar_tras_cambio_de_precio_de_lista(self):
+        orden = self.crear_orden(convenio=self.convenio)
+        for examen in self.examenes[:2]:
+            orden.agregar_item(OrdenExamen(examen=examen))
+        # El catálogo sube después de agregar la línea: se descuenta lo que se sumó
+        Examen.objects.filter(pk=self.examenes[0].pk).update(precio=Decimal('99.00'))
+        orden.quitar_item(orden.ordenexamen_set.select_related('examen').get(examen=self.examenes[0]))
+        orden.refresh_from_db()
+        self.assertEqual(orden.subtotal, Decimal('7.33'))           # 11.00 - 33.33%
+        self.assertEqual(orden.descuento_aplicado, Decimal('3.67'))
+
+        # Línea sin precio base guardado (anterior al snapshot): recálculo completo
+        OrdenExamen.objects.filter(orden=orden).update(precio_base_en_orden=None)
+        orden.quitar_item(orden.ordenexamen_set.select_related('examen').get())
+        orden.refresh_from_db()
+        self.assertEqual((orden.subtotal, orden.descuento_aplicado), (Decimal('0.00'), Decimal('0.00')))
+
+    def test_verificacion_detecta_y_corrige_diferencias(self):
+        orden = self.crear_orden(self.examenes[:3], convenio=self.convenio)
+        orden.calcular_totales()
+        # Cambia el descuento general: los snapshots quedan desactualizados
+        Convenio.objects.filter(pk=self.convenio.pk).update(descuento_general_examenes=Decimal('20.00'))
+        invalidar_descuentos(self.convenio.pk)
+        orden = Orden.objects.get(pk=orden.pk)
+
+        self.assertIn('subtotal', orden.verificar_totales())
+        call_command('verificar_totales', '--corregir', stdout=StringIO())
+        self.assertEqual(orden.verificar_totales(), {})
+
+
+class AgregarItemsLoteTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.examenes = cls.crear_examenes(25)
+        cls.paquetes = cls.crear_paquetes(2)
+        cls.inactivo = cls.crear_examenes(1, desde=100)[0]
+        Examen.objects.filter(pk=cls.inactivo.pk).update(estado='Inactivo')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def test_agrega_omite_y_rechaza_en_un_solo_post(self):
+        orden = self.crear_orden(self.examenes[:1], convenio=self.convenio)
+        datos = {
+            'examen_id': [e.pk for e in self.examenes] + [self.inactivo.pk, 'abc'],
+            'paquete_id': [self.paquetes[0].pk, 9999],
+        }
+        response = self.client.post(
+            reverse('orden_add_items_lote', kwargs={'orden_pk': orden.pk}), datos
+        )
+        resumen = response.json()
+
+        self.assertEqual(resumen['agregados']['examenes'], [e.pk for e in self.examenes[1:]])
+        self.assertEqual(resumen['agregados']['paquetes'], [self.paquetes[0].pk])
+        self.assertEqual(resumen['omitidos']['examenes'], [self.examenes[0].pk])
+        self.assertEqual(resumen['rechazados']['examenes'], ['abc', self.inactivo.pk])
+        self.assertEqual(resumen['rechazados']['paquetes'], [9999])
+
+        self.assertEqual(orden.ordenexamen_set.count(), 25)
+        self.assertEqual(orden.verificar_totales(), {})
+        orden.refresh_from_db()
+        self.assertEqual(resumen['totales']['subtotal'], str(orden.subtotal))
+
+
+    def test_alta_concurrente_no_se_reporta_como_agregada(self):
+        orden = self.crear_orden(self.examenes[:1])
+        url = reverse('orden_add_items_lote', kwargs={'orden_pk': orden.pk})
+        # Otra petición agregó el examen después de que este lote leyó la orden
+        sin_items = {'examenes': set(), 'paquetes': set()}
+        with mock.patch('ordenes.views.AddItemsLoteToOrdenView._existentes', return_value=sin_items):
+            response = self.client.post(url, {'examen_id': [self.examenes[0].pk, self.examenes[1].pk]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(orden.ordenexamen_set.count(), 1)  # Todo o nada
+
+
+class ExamenesEfectivosTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.examenes = cls.crear_examenes(5)
+        cls.paquete = cls.crear_paquetes(1)[0]
+        for examen in cls.examenes[2:]:
+            PaqueteExamen.objects.create(paquete=cls.paquete, examen=examen)
+        PaqueteExamen.objects.filter(paquete=cls.paquete, examen=cls.examenes[4]).update(estado='Inactivo')
+
+    def efectivos(self, orden):
+        return sorted(Examen.objects.filter(orden.filtro_examenes('pk')).values_list('codigo', flat=True))
+
+    def test_altas_y_bajas_individuales(self):
+        orden = Orden.objects.create(paciente=self.paciente)
+        orden.agregar_item(OrdenExamen(examen=self.examenes[0]))
+        orden.agregar_item(OrdenExamen(examen=self.examenes[2]))  # También viene en el paquete
+        orden.agregar_item(OrdenPaquete(paquete=self.paquete))
+        self.assertEqual(self.efectivos(orden), ['EX0', 'EX2', 'EX3'])  # EX4 inactivo en el paquete
+
+        orden.quitar_item(orden.ordenexamen_set.get(examen=self.examenes[2]))
+        self.assertEqual(self.efectivos(orden), ['EX0', 'EX2', 'EX3'])  # Sigue por el paquete
+        orden.quitar_item(orden.ordenpaquete_set.get())
+        self.assertEqual(self.efectivos(orden), ['EX0'])
+
+    def test_alta_por_lote(self):
+        orden = Orden.objects.create(paciente=self.paciente)
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('orden_add_items_lote', kwargs={'orden_pk': orden.pk}), {
+            'examen_id': [self.examenes[1].pk], 'paquete_id': [self.paquete.pk],
+        })
+        self.assertEqual(self.efectivos(orden), ['EX1', 'EX2', 'EX3'])
+
+    def test_el_paquete_se_copia_al_agregarlo(self):
+        orden = Orden.objects.create(paciente=self.paciente)
+        OrdenPaquete.objects.create(orden=orden, paquete=self.paquete, precio_en_orden=self.paquete.precio)
+        PaqueteExamen.objects.create(paquete=self.paquete, examen=self.examenes[0])
+        PaqueteExamen.objects.filter(paquete=self.paquete, examen=self.examenes[2]).update(estado='Inactivo')
+        # Editar el paquete no cambia las órdenes ya creadas
+        self.assertEqual(self.efectivos(orden), ['EX2', 'EX3'])
+
+    def test_una_subconsulta_sobre_una_tabla(self):
+        orden = Orden.objects.create(paciente=self.paciente)
+        orden.agregar_item(OrdenPaquete(paquete=self.paquete))
+        with CaptureQueriesContext(connection) as consultas:
+            list(Examen.objects.filter(orden.filtro_examenes('pk')))
+        sql = consultas[0]['sql']
+        self.assertIn(OrdenExamenEfectivo._meta.db_table, sql)
+        self.assertNotIn(PaqueteExamen._meta.db_table, sql)
+
+
+class OrdenListaPaginadaTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Orden.objects.bulk_create([
+            Orden(paciente=cls.paciente, convenio=cls.convenio if i % 3 == 0 else None,
+                  prioridad='Urgente' if i % 5 == 0 else 'Rutina')
+            for i in range(120)
+        ])
+        # Varias órdenes comparten fecha: el desempate es orden_id
+        base = timezone.now()
+        for i, orden_id in enumerate(Orden.objects.values_list('orden_id', flat=True)):
+            Orden.objects.filter(pk=orden_id).update(fecha_creacion=base - timedelta(hours=i // 4))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+
+    def recorrer(self, params=None):
+        url = reverse('orden_lista')
+        params = dict(params or {})
+        vistos, paginas = [], []
+        while True:
+            response = self.client.get(url, params)
+            vistos += [o.pk for o in response.context['ordenes']]
+            paginas.append(response.context['pagina'])
+            if not response.context['pagina'].tiene_siguiente:
+                return vistos, paginas
+            params['cursor'] = response.context['pagina'].cursor_siguiente
+
+    def test_recorre_todas_las_ordenes_sin_repetir(self):
+        vistos, paginas = self.recorrer()
+        esperado = list(Orden.objects.order_by('-fecha_creacion', '-orden_id').values_list('pk', flat=True))
+        self.assertEqual(vistos, esperado)
+        self.assertEqual(len(paginas), 3)
+
+        # Volver a la página anterior devuelve exactamente la página previa
+        response = self.client.get(reverse('orden_lista'), {'cursor': paginas[2].cursor_anterior})
+        self.assertEqual([o.pk for o in response.context['ordenes']], esperado[50:100])
+
+    def test_filtros_en_servidor(self):
+        vistos, _ = self.recorrer({'prioridad': 'Urgente', 'convenio': self.convenio.pk})
+        esperado = Orden.objects.filter(prioridad='Urgente', convenio=self.convenio)
+        self.assertEqual(sorted(vistos), sorted(esperado.values_list('pk', flat=True)))
+
+    def test_paginas_profundas_mismo_numero_de_consultas(self):
+        _, paginas = self.recorrer()
+        url = reverse('orden_lista')
+        conteos = []
+        for cursor in (None, paginas[1].cursor_siguiente):
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(url, {'cursor': cursor} if cursor else {})
+            conteos.append(len(ctx.captured_queries))
+        self.assertEqual(conteos[0], conteos[1])
+
+    def test_cursor_invalido_vuelve_a_la_primera_pagina(self):
+        response = self.client.get(reverse('orden_lista'), {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['ordenes']), 50)
+
+
+class BusquedaApiTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Paciente.objects.bulk_create([
+            Paciente(
+                nombre=f'Ana {i:02d}', apellido='Prueba', fecha_nacimiento=date(1990, 1, 1), sexo='F',
+                dui=f'1000{i:04d}-0', telefono='22223333', correo=f'ana{i}@example.com',
+                busqueda=f'ana {i:02d} prueba', busqueda_inversa=f'prueba ana {i:02d}'
+            )
+            for i in range(30)
+        ])
+
+    def test_paginacion_con_cursor_desde_la_cache(self):
+        url = reverse('api_buscar_pacientes')
+        primera = self.client.get(url, {'q': 'ANA', 'limit': 25}).json()
+        self.assertEqual(len(primera['pacientes']), 25)
+        self.assertEqual(primera['siguiente'], '25')
+
+        with self.assertNumQueries(0):
+            segunda = self.client.get(url, {'q': 'ana', 'limit': 25, 'cursor': primera['siguiente']}).json()
+        self.assertEqual(len(segunda['pacientes']), 6)  # 30 + la paciente del mixin
+        self.assertIsNone(segunda['siguiente'])
+        ids = [p['id'] for p in primera['pacientes'] + segunda['pacientes']]
+        self.assertEqual(len(set(ids)), 31)
+
+    def test_etag_responde_304(self):
+        url = reverse('api_buscar_convenios')
+        respuesta = self.client.get(url, {'q': 'empresa'})
+        self.assertEqual(respuesta.json()['convenios'][0]['nombre'], 'Empresa Uno')
+        etag = respuesta['ETag']
+
+        respuesta = self.client.get(url, {'q': 'empresa'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta['ETag'], etag)
+
+    def test_cambios_invalidan_la_cache(self):
+        url = reverse('api_buscar_convenios')
+        etag = self.client.get(url, {'q': 'empresa'})['ETag']
+
+        self.convenio.nombre = 'Empresa Renombrada'
+        self.convenio.save()
+        respuesta = self.client.get(url, {'q': 'empresa'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['convenios'][0]['nombre'], 'Empresa Renombrada')
+
+        self.convenio.delete()
+        self.assertEqual(self.client.get(url, {'q': 'empresa'}).json()['convenios'], [])
+
+
+class ColaPDFTests(OrdenTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.orden = Orden.objects.create(paciente=cls.paciente)
+        Resultado.objects.create(orden=cls.orden)
+        cls.factura = Factura.objects.create(
+            orden=cls.orden, cliente_nombre='Ana López', numero_factura='FAC-000001',
+            subtotal=Decimal('21.00'), descuento=Decimal('0.00'), iva=Decimal('2.73'),
+            total=Decimal('23.73'), tipo_factura='Particular', creado_por=cls.usuario
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.usuario)
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        ajuste = override_settings(
+            PDF_TRABAJOS_DIR=os.path.join(carpeta.name, 'trabajos'),
+            PDF_CACHE_DIR=os.path.join(carpeta.name, 'cache'),
+        )
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        cache_pdf._escrito['bytes'] = None
+
+    def test_peticiones_iguales_comparten_el_trabajo(self):
+        url = reverse('orden_imprimir_resultados', kwargs={'pk': self.orden.pk})
+        primera = self.client.get(url, {'formato': 'json'})
+        segunda = self.client.get(url, {'formato': 'json'})
+        self.assertEqual(primera.status_code, 202)
+        self.assertEqual(primera.json()['trabajo'], segunda.json()['trabajo'])
+        self.assertEqual(TrabajoPDF.objects.count(), 1)
+
+        # Sin JSON se redirige a la página de espera
+        respuesta = self.client.get(url)
+        self.assertRedirects(respuesta, reverse('trabajo_pdf_estado', kwargs={'pk': primera.json()['trabajo']}))
+
+    def test_worker_genera_y_la_descarga_sirve_el_archivo(self):
+        url = reverse('factura_pdf', kwargs={'pk': self.factura.pk})
+        trabajo_id = self.client.get(url, {'formato': 'json'}).json()['trabajo']
+
+        trabajo = reclamar_trabajo()
+        self.assertEqual(trabajo.pk, trabajo_id)
+        self.assertIsNone(reclamar_trabajo())  # Ya tomado por este worker
+        procesar_trabajo(trabajo)
+
+        estado = self.client.get(reverse('trabajo_pdf_estado', kwargs={'pk': trabajo_id}), {'formato': 'json'}).json()
+        self.assertEqual(estado['estado'], 'Completado')
+        respuesta = self.client.get(estado['descarga'])
+        self.assertEqual(respuesta['Content-Type'], 'application/pdf')
+        self.assertIn('Factura_FAC-000001.pdf', respuesta['Content-Disposition'])
+        self.assertTrue(b''.join(respuesta.streaming_content).startswith(b'%PDF'))
+
+        # Terminado el trabajo, la factura ya no se vuelve a encolar: se sirve de la caché
+        self.assertEqual(self.client.get(url, {'formato': 'json'})['Content-Type'], 'application/pdf')
+
+    def test_worker_que_perdio_el_trabajo_no_lo_pisa(self):
+        TrabajoPDF.encolar('Resultado', self.orden.pk)
+        primero = reclamar_trabajo()
+        # Mientras late no se reencola
+        pdf.latido(primero)
+        self.assertIsNone(reclamar_trabajo())
+
+        # Sin latido pasado TIEMPO_MAXIMO_PROCESO lo toma otro worker
+        TrabajoPDF.objects.filter(pk=primero.pk).update(
+            fecha_latido=timezone.now() - pdf.TIEMPO_MAXIMO_PROCESO - timedelta(seconds=1)
+        )
+        segundo = reclamar_trabajo()
+        self.assertEqual(segundo.pk, primero.pk)
+        self.assertNotEqual(segundo.fecha_inicio, primero.fecha_inicio)
+        with self.assertRaises(pdf.TrabajoPerdido):
+            pdf.latido(primero)
+
+        # El primero termina tarde: ni su archivo ni su estado quedan
+        procesar_trabajo(primero)
+        self.assertEqual(TrabajoPDF.objects.get(pk=primero.pk).estado, 'Procesando')
+        self.assertEqual(os.listdir(settings.PDF_TRABAJOS_DIR), [])
+        procesar_trabajo(segundo)
+        terminado = TrabajoPDF.objects.get(pk=segundo.pk)
+        self.assertEqual(terminado.estado, 'Completado')
+        self.assertEqual(os.listdir(settings.PDF_TRABAJOS_DIR), [os.path.basename(terminado.archivo)])
+
+    def test_comando_procesa_la_cola(self):
+        TrabajoPDF.encolar('Resultado', self.orden.pk)
+        TrabajoPDF.encolar('Resultado', 999999)  # Orden inexistente -> Error
+        salida = StringIO()
+        call_command('procesar_pdfs', '--una-vez', stdout=salida, stderr=StringIO())
+        self.assertIn('2 trabajo(s)', salida.getvalue())
+        self.assertEqual(
+            dict(TrabajoPDF.objects.values_list('objeto_id', 'estado')),
+            {self.orden.pk: 'Completado', 999999: 'Error'}
+        )
+
+    def test_purga_de_trabajos_vencidos(self):
+        viejo = TrabajoPDF.encolar('Factura', self.factura.pk)
+        reciente = TrabajoPDF.encolar('Resultado', self.orden.pk)
+        procesar_trabajo(reclamar_trabajo())
+        procesar_trabajo(reclamar_trabajo())
+        fallido = TrabajoPDF.objects.create(tipo='Resultado', objeto_id=999999, estado='Error')
+        pendiente = TrabajoPDF.objects.create(tipo='Factura', objeto_id=999999)
+        hace_dos_dias = timezone.now() - timedelta(days=2)
+        TrabajoPDF.objects.filter(pk__in=[viejo.pk, fallido.pk]).update(fecha_fin=hace_dos_dias)
+        viejo.refresh_from_db()
+        reciente.refresh_from_db()
+
+        salida = StringIO()
+        call_command('procesar_pdfs', '--una-vez', stdout=salida, stderr=StringIO())
+        self.assertIn('2 trabajo(s) vencido(s)', salida.getvalue())
+        self.assertFalse(os.path.exists(viejo.archivo))
+        self.assertTrue(os.path.exists(reciente.archivo))
+        # El pendiente se procesó en la misma corrida; el reciente sigue
+        self.assertEqual(
+            set(TrabajoPDF.objects.values_list('pk', flat=True)), {reciente.pk, pendiente.pk}
+        )
+        self.assertEqual(pdf.purgar_trabajos(retencion=0), 2)
+
+    def generar(self, url):
+        self.client.get(url, {'formato': 'json'})
+        procesar_trabajo(reclamar_trabajo())
+
+    def test_membrete_renderizado_una_vez(self):
+        self.addCleanup(pdf._membretes.clear)
+        pdf._membretes.clear()
+        with mock.patch.object(pdf, 'get_template', wraps=get_template) as cargar:
+            resultado = documento_resultado(self.orden.pk)[0]['membrete']
+            factura = pdf.documento_factura(self.factura.pk)[0]['membrete']
+            pdf.documento_factura(self.factura.pk)
+        # Cada membrete se renderizó una sola vez
+        self.assertIs(pdf.membrete('Factura'), factura)
+        cargadas = [llamada.args[0] for llamada in cargar.call_args_list]
+        self.assertEqual(sorted(cargadas), sorted(pdf.MEMBRETES.values()))
+        self.assertIn('resultados@labavanzado.com', resultado)
+        self.assertIn('info@labavanzado.com', factura)
+
+        # Cambiar los datos de la empresa vuelve a renderizar el membrete
+        with self.settings(EMPRESA={**pdf.settings.EMPRESA, 'telefono': '2222-9999'}):
+            self.assertIn('2222-9999', pdf.membrete('Factura'))
+
+    def test_pdf_en_archivo_temporal(self):
+        contexto, _ = pdf.documento_factura(self.factura.pk)
+        with pdf.pdf_en_spool(DOCUMENTOS['Factura'][0], contexto) as chico:
+            self.assertFalse(chico.en_disco)
+            self.assertTrue(chico.read().startswith(b'%PDF'))
+
+        # Pasado el límite, la escritura única de pisa va directo a disco
+        with self.settings(PDF_SPOOL_MAX_BYTES=1024):
+            with pdf.pdf_en_spool(DOCUMENTOS['Factura'][0], contexto) as grande:
+                self.assertTrue(grande.en_disco)
+                self.assertTrue(grande.read().startswith(b'%PDF'))
+
+    def test_benchmark_de_memoria(self):
+        salida = StringIO()
+        call_command('benchmark_pdf_memoria', '--paginas', '1', stdout=salida, stderr=StringIO())
+        self.assertIn('TemporalPDF', salida.getvalue())
+        self.assertFalse(Paciente.objects.filter(dui='99999999-9').exists())  # Datos revertidos
+
+    def test_metricas_por_fase(self):
+        self.addCleanup(pdf.metricas_pdf.clear)
+        pdf.metricas_pdf.clear()
+        TrabajoPDF.encolar('Factura', self.factura.pk)
+        trabajo = procesar_trabajo(reclamar_trabajo())
+
+        metricas = pdf.metricas_pdf['Factura']
+        self.assertEqual(metricas['documentos'], 1)
+        self.assertEqual(metricas['bytes'], os.path.getsize(trabajo.archivo))
+        self.assertEqual(list(metricas['fases']), list(pdf.FASES_PDF))
+        self.assertTrue(all(fase['total_ms'] > 0 for fase in metricas['fases'].values()))
+        self.assertTrue(pdf.resumen_metricas()[0].startswith('Factura: 1 PDF(s)'))
+
+    def test_factura_emitida_se_sirve_desde_la_cache(self):
+        url = reverse('factura_pdf', kwargs={'pk': self.factura.pk})
+        self.generar(url)
+
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        contenido = b''.join(respuesta.streaming_content)
+        self.assertEqual(int(respuesta['Content-Length']), len(contenido))
+        self.assertEqual(respuesta['ETag'], f'"{clave_documento("Factura", self.factura.pk)}"')
+        self.assertEqual(TrabajoPDF.objects.count(), 1)  # No se volvió a encolar
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+
+        parcial = self.client.get(url, HTTP_RANGE='bytes=0-99')
+        self.assertEqual(parcial.status_code, 206)
+        self.assertEqual(parcial['Content-Range'], f'bytes 0-99/{len(contenido)}')
+        self.assertEqual(b''.join(parcial.streaming_content), contenido[:100])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={len(contenido)}-').status_code, 416)
+
+        # Un cambio en lo impreso cambia la clave: se vuelve a generar
+        Factura.objects.filter(pk=self.factura.pk).update(estado='Pagada')
+        self.assertEqual(self.client.get(url, {'formato': 'json'}).status_code, 202)
+
+    def test_resultado_solo_se_cachea_validado_y_se_invalida_al_devolver(self):
+        url = reverse('orden_imprimir_resultados', kwargs={'pk': self.orden.pk})
+        self.assertIsNone(clave_documento('Resultado', self.orden.pk))
+
+        Resultado.objects.filter(orden=self.orden).update(
+            estado='Validado', validado_por=self.usuario, fecha_validacion=timezone.now()
+        )
+        self.generar(url)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        rol = self.usuario.rol
+        rol.nombre = 'Jefe de Laboratorio'
+        rol.save()
+        self.client.post(
+            reverse('resultado_ingreso', kwargs={'orden_pk': self.orden.pk}),
+            {'estado': 'Validado', 'observaciones_generales': '', 'devolver_correccion': '1'}
+        )
+        self.assertEqual(os.listdir(cache_pdf.settings.PDF_CACHE_DIR), [])
+
+    def test_nombre_del_validador_cambia_la_clave(self):
+        Resultado.objects.filter(orden=self.orden).update(
+            estado='Validado', validado_por=self.usuario, fecha_validacion=timezone.now()
+        )
+        antes = clave_documento('Resultado', self.orden.pk)
+        Usuario.objects.filter(pk=self.usuario.pk).update(apellido='Otro Apellido')
+        self.assertNotEqual(clave_documento('Resultado', self.orden.pk), antes)
+
+    @override_settings(PDF_CACHE_MAX_BYTES=1000)
+    def test_guardar_solo_recorre_la_carpeta_al_pasar_el_margen(self):
+        os.makedirs(cache_pdf.settings.PDF_CACHE_DIR)
+        origen = os.path.join(cache_pdf.settings.PDF_CACHE_DIR, 'origen.tmp')
+        with open(origen, 'wb') as archivo:
+            archivo.write(b'x' * 40)
+        with mock.patch.object(cache_pdf, 'desalojar', wraps=cache_pdf.desalojar) as desalojar:
+            for i in range(4):
+                cache_pdf.guardar('Factura', i, 'clave', origen)
+        # El primero recorre la carpeta; el cuarto pasa los 100 bytes de margen
+        self.assertEqual(desalojar.call_args_list, [mock.call(1000), mock.call(900)])
+
+    def test_desalojo_lru(self):
+        os.makedirs(cache_pdf.settings.PDF_CACHE_DIR)
+        origen = os.path.join(cache_pdf.settings.PDF_CACHE_DIR, 'origen.tmp')
+        with open(origen, 'wb') as archivo:
+            archivo.write(b'x' * 100)
+        for i in range(3):
+            ruta = cache_pdf.guardar('Factura', i, 'clave', origen)
+            os.utime(ruta, (1000 + i, 1000 + i))
+        cache_pdf.buscar('Factura', 0, 'clave')  # La más vieja se vuelve la más reciente
+
+        cache_pdf.desalojar(250)
+        self.assertIsNotNone(cache_pdf.buscar('Factura', 0, 'clave'))
+        self.assertIsNone(cache_pdf.buscar('Factura', 1, 'clave'))
+        self.assertIsNotNone(cache_pdf.buscar('Factura', 2, 'clave'))
+
+
+class ReporteResultadosTests(OrdenTestMixin, TestCase):
+    """ El reporte se arma en consultas fijas y el template no consulta nada. """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        hematologia = CategoriaExamen.objects.create(nombre='Hematología', descripcion='Hemograma')
+        examenes = cls.crear_examenes(25)
+        for examen in examenes[:10]:
+            examen.categoria = hematologia
+            examen.save()
+        for examen in examenes:
+            MetodoExamen.objects.create(examen=examen, metodo='Automatizado')
+            MetodoExamen.objects.create(examen=examen, metodo='Manual', estado='Inactivo')
+        cls.orden = Orden.objects.create(paciente=cls.paciente, convenio=cls.convenio)
+        resultado = Resultado.objects.create(
+            orden=cls.orden, estado='Validado', validado_por=cls.usuario, fecha_validacion=timezone.now()
+        )
+        # 25 exámenes x 4 parámetros = 100 detalles
+        for examen in examenes:
+            for i in range(4):
+                valor = ValorReferencia.objects.create(
+                    examen=examen, rango_referencia=f'{i}-{i + 10}', unidad_medida='mg/dL'
+                )
+                ResultadoDetalle.objects.create(resultado=resultado, valor_referencia=valor, valor_obtenido='5')
+
+    def test_cien_parametros_en_consultas_fijas(self):
+        # Orden (con paciente, convenio, resultado y validador), detalles y métodos activos
+        with self.assertNumQueries(3):
+            contexto, _ = documento_resultado(self.orden.pk)
+        with self.assertNumQueries(0):
+            html = get_template(DOCUMENTOS['Resultado'][0]).render(contexto)
+
+        self.assertEqual(len(contexto['detalles']), 100)
+        grupos = contexto['grupos']
+        self.assertEqual([g.categoria.nombre for g in grupos], ['Hematología', 'Química'])
+        self.assertEqual([len(g.examenes) for g in grupos], [10, 15])
+        examen = grupos[0].examenes[0]
+        self.assertEqual([m.metodo for m in examen.metodos], ['Automatizado'])
+        self.assertEqual(len(examen.parametros), 4)
+        self.assertNotIn('Manual', html)
+
+    def test_rango_impreso_es_el_de_la_bandera(self):
+        # Un rango agregado después del ingreso no cambia el impreso: la
+        # bandera se calculó contra el valor de referencia del detalle
+        detalle = ResultadoDetalle.objects.filter(resultado__orden=self.orden).select_related(
+            'valor_referencia'
+        ).first()
+        detalle.valor_obtenido = '50'
+        detalle.save()
+        ValorReferencia.objects.create(
+            examen_id=detalle.valor_referencia.examen_id, sexo=self.paciente.sexo, rango_referencia='40-60'
+        )
+        contexto, _ = documento_resultado(self.orden.pk)
+        impreso = next(d for d in contexto['detalles'] if d.pk == detalle.pk)
+        self.assertEqual(impreso.bandera, 'H')
+        html = get_template(DOCUMENTOS['Resultado'][0]).render(contexto)
+        self.assertIn(detalle.valor_referencia.rango_referencia, html)
+        self.assertNotIn('40-60', html)
+
+    def test_vista_previa_html(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.get(reverse('orden_vista_previa_resultados', kwargs={'pk': self.orden.pk}))
+        self.assertContains(respuesta, 'INFORME DE RESULTADOS')
+        sin_resultado = Orden.objects.create(paciente=self.paciente)
+        respuesta = self.client.get(reverse('orden_vista_previa_resultados', kwargs={'pk': sin_resultado.pk}))
+        self.assertEqual(respuesta.status_code, 404)
+
+
+class RecursosPDFTests(TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        ajuste = override_settings(PDF_RECURSOS_DIR=carpeta.name, PDF_IMAGEN_MAX_PX=120)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        recursos_pdf.olvidar()
+        self.addCleanup(recursos_pdf.olvidar)
+        self.carpeta = carpeta.name
+
+    def test_imagen_reducida_una_vez_y_en_memoria(self):
+        ruta = recursos_pdf.resolver('/static/images/Avanzadicon.png')
+        self.assertEqual(os.path.dirname(ruta), self.carpeta)
+        with recursos_pdf.Image.open(ruta) as imagen:
+            self.assertLessEqual(max(imagen.size), 120)
+
+        with mock.patch.object(recursos_pdf.finders, 'find') as find:
+            self.assertEqual(recursos_pdf.resolver('/static/images/Avanzadicon.png'), ruta)
+        find.assert_not_called()
+
+        # Otro proceso (mapa vacío) reutiliza la imagen ya reducida
+        recursos_pdf.olvidar()
+        with mock.patch.object(recursos_pdf.Image, 'open') as abrir:
+            self.assertEqual(recursos_pdf.resolver('/static/images/Avanzadicon.png'), ruta)
+        abrir.assert_not_called()
+
+    def test_otros_recursos(self):
+        css = recursos_pdf.resolver('/static/css/custom.css')
+        self.assertTrue(css.endswith(os.path.join('static', 'css', 'custom.css')))
+        self.assertTrue(recursos_pdf.resolver('/static/images/user.png').endswith('user.png'))  # Ya es chica
+        self.assertEqual(recursos_pdf.resolver('https://example.com/logo.png'), 'https://example.com/logo.png')
+        with self.assertRaises(FileNotFoundError):
+            recursos_pdf.resolver('/static/css/no-existe.css')
+
+    def test_precalentar_y_medicion(self):
+        self.assertGreaterEqual(recursos_pdf.precalentar(), 3)
+        with self.assertLogs('ordenes.recursos_pdf', 'INFO') as log:
+            with recursos_pdf.medir_recursos('Factura 1') as callback:
+                callback('/static/css/custom.css', None)
+                callback('/static/images/Avanzadicon.png', None)
+        self.assertIn('Factura 1: 2 recurso(s) resuelto(s)', log.output[0])
@@ -16,6 +16,10 @@ urlpatterns = [
          views.AddPaqueteToOrdenView.as_view(), 
          name='orden_add_paquete'),
          
+    path('gestion/orden/<int:orden_pk>/add_items_lote/', 
+         views.AddItemsLoteToOrdenView.as_view(), 
+         name='orden_add_items_lote'),
+         
     path('gestion/orden/<int:orden_pk>/remove_examen/<int:examen_pk>/', 
          views.RemoveExamenFromOrdenView.as_view(), 
          name='orden_remove_examen'),
@@ -31,4 +35,11 @@ urlpatterns = [
     path('gestion/orden/<int:pk>/imprimir_resultados/', 
          views.OrdenResultadoPDFView.as_view(), 
          name='orden_imprimir_resultados'),
+    path('gestion/orden/<int:pk>/vista_previa_resultados/', 
+         views.OrdenResultadoVistaPreviaView.as_view(), 
+         name='orden_vista_previa_resultados'),
+
+    # --- Cola de PDFs (resultados y facturas) ---
+    path('gestion/pdf/<int:pk>/', views.TrabajoPDFEstadoView.as_view(), name='trabajo_pdf_estado'),
+    path('gestion/pdf/<int:pk>/descargar/', views.TrabajoPDFDescargarView.as_view(), name='trabajo_pdf_descargar'),
 ]
\ No newline at end of file
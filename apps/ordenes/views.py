@@ -1,42 +1,32 @@
+import mimetypes
 from decimal import Decimal
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
-from django.shortcuts import redirect, get_object_or_404
+from django.shortcuts import redirect, get_object_or_404, render
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, View
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db.models import Q # Para búsquedas
-from django.db import IntegrityError
-from django.http import HttpResponse
-from django.template.loader import get_template
-from django.utils import timezone
-from xhtml2pdf import pisa
-from .utils import link_callback
+from usuarios.permisos import CapacidadRequeridaMixin
+from django.db.models import CharField, Q, Value # Para búsquedas
+from django.db import IntegrityError, transaction
 from .models import Convenio
 
 # Importamos todos los modelos necesarios
-from .models import Orden, OrdenExamen, OrdenPaquete
-from .forms import OrdenCreateForm, OrdenUpdateForm, AddExamenForm, AddPaqueteForm
+from .models import Orden, OrdenExamen, OrdenExamenEfectivo, OrdenPaquete, TrabajoPDF
+from .forms import OrdenCreateForm, OrdenUpdateForm, AddExamenForm, AddPaqueteForm, OrdenFiltroForm
+from .paginacion import paginar_keyset
+from .busqueda_api import responder_busqueda
+from . import cache_pdf
+from .pdf import DOCUMENTOS, clave_documento, documento_resultado
 from examenes.models import Examen
-from pacientes.models import Paciente
+from pacientes.busqueda import buscar_pacientes, normalizar
 from paquetes.models import Paquete
 from pagos.forms import PagoForm # <-- Importar PagoForm
 from pagos.models import Pago # <-- Importar Pago
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, JsonResponse
 
 # --- REQUISITO: Mixin de Seguridad ---
-class PersonalAutorizadoRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
-    def test_func(self):
-        if not self.request.user.is_authenticated or not self.request.user.rol:
-            return False
-        roles_permitidos = [
-            'Administrador', 'Recepcionista', 'Analista', 
-            'Técnico', 'Jefe de Laboratorio'
-        ]
-        return self.request.user.rol.nombre in roles_permitidos
-
-    def handle_no_permission(self):
-        messages.error(self.request, "No tienes permiso para acceder a esta página.")
-        return redirect('dashboard' if self.request.user.is_authenticated else 'login')
+class PersonalAutorizadoRequiredMixin(CapacidadRequeridaMixin):
+    """ Personal del laboratorio que atiende órdenes. """
+    capacidad = 'gestionar_ordenes'
 
 # ===============================================
 # === CRUD para Orden (Principal)
@@ -46,8 +36,33 @@ class OrdenListView(PersonalAutorizadoRequiredMixin, ListView):
     model = Orden
     template_name = 'ordenes/orden_lista.html'
     context_object_name = 'ordenes'
-    # Optimizamos la consulta
-    queryset = Orden.objects.select_related('paciente', 'convenio').order_by('-fecha_creacion')
+    por_pagina = 50
+    # Orden estable (único) que recorre la paginación keyset
+    orden_lista = ('-fecha_creacion', '-orden_id')
+
+    def get_queryset(self):
+        # Optimizamos la consulta
+        queryset = Orden.objects.select_related('paciente', 'convenio')
+
+        self.filtro_form = OrdenFiltroForm(self.request.GET or None)
+        if self.filtro_form.is_valid():
+            queryset = self.filtro_form.filtrar(queryset)
+
+        self.pagina = paginar_keyset(
+            queryset, self.orden_lista,
+            cursor=self.request.GET.get('cursor'), por_pagina=self.por_pagina
+        )
+        return self.pagina.objetos
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['filtro_form'] = self.filtro_form
+        context['pagina'] = self.pagina
+        # Querystring de filtros (sin cursor) para los enlaces de paginación
+        filtros = self.request.GET.copy()
+        filtros.pop('cursor', None)
+        context['filtros_querystring'] = filtros.urlencode()
+        return context
 
 class OrdenCreateView(PersonalAutorizadoRequiredMixin, CreateView):
     model = Orden
@@ -143,13 +158,9 @@ class AddExamenToOrdenView(PersonalAutorizadoRequiredMixin, View):
             examen = get_object_or_404(Examen, pk=examen_id)
             
             try:
-                # Usamos el 'through' model para guardar el precio
-                OrdenExamen.objects.create(
-                    orden=orden,
-                    examen=examen,
-                    precio_en_orden=examen.precio # Guarda el precio actual del examen
-                )
-                orden.calcular_totales() # Recalculamos
+                # Usamos el 'through' model para guardar el precio.
+                # Solo se precia esta línea y los totales se ajustan por la diferencia.
+                orden.agregar_item(OrdenExamen(examen=examen))
                 messages.success(request, f"Examen '{examen.nombre}' añadido.")
             except IntegrityError:
                 messages.error(request, f"El examen '{examen.nombre}' ya está en la orden.")
@@ -167,12 +178,7 @@ class AddPaqueteToOrdenView(PersonalAutorizadoRequiredMixin, View):
             paquete = get_object_or_404(Paquete, pk=paquete_id)
             
             try:
-                OrdenPaquete.objects.create(
-                    orden=orden,
-                    paquete=paquete,
-                    precio_en_orden=paquete.precio # Guarda el precio del PAQUETE
-                )
-                orden.calcular_totales() # Recalculamos
+                orden.agregar_item(OrdenPaquete(paquete=paquete))
                 messages.success(request, f"Paquete '{paquete.nombre}' añadido.")
             except IntegrityError:
                 messages.error(request, f"El paquete '{paquete.nombre}' ya está en la orden.")
@@ -185,11 +191,9 @@ class RemoveExamenFromOrdenView(PersonalAutorizadoRequiredMixin, View):
         orden = get_object_or_404(Orden, pk=self.kwargs['orden_pk'])
         examen_id = self.kwargs['examen_pk']
         
-        item = get_object_or_404(OrdenExamen, orden=orden, examen_id=examen_id)
+        item = get_object_or_404(OrdenExamen.objects.select_related('examen'), orden=orden, examen_id=examen_id)
         examen_nombre = item.examen.nombre
-        item.delete()
-        
-        orden.calcular_totales() # Recalculamos
+        orden.quitar_item(item) # Ajuste incremental de totales
         messages.warning(request, f"Examen '{examen_nombre}' quitado de la orden.")
         
         return redirect(reverse('orden_update', kwargs={'pk': orden.pk}))
@@ -200,70 +204,162 @@ class RemovePaqueteFromOrdenView(PersonalAutorizadoRequiredMixin, View):
         orden = get_object_or_404(Orden, pk=self.kwargs['orden_pk'])
         paquete_id = self.kwargs['paquete_pk']
         
-        item = get_object_or_404(OrdenPaquete, orden=orden, paquete_id=paquete_id)
+        item = get_object_or_404(OrdenPaquete.objects.select_related('paquete'), orden=orden, paquete_id=paquete_id)
         paquete_nombre = item.paquete.nombre
-        item.delete()
-        
-        orden.calcular_totales() # Recalculamos
+        orden.quitar_item(item) # Ajuste incremental de totales
         messages.warning(request, f"Paquete '{paquete_nombre}' quitado de la orden.")
         
         return redirect(reverse('orden_update', kwargs={'pk': orden.pk}))
     
+
+class AddItemsLoteToOrdenView(PersonalAutorizadoRequiredMixin, View):
+    """
+    Vista de acción (AJAX) que añade VARIOS exámenes/paquetes en un solo POST.
+    Recibe listas 'examen_id' y 'paquete_id', las valida con una consulta,
+    inserta las líneas con bulk_create (con la orden bloqueada), reprecia la
+    orden UNA vez y devuelve un resumen JSON (agregados / omitidos / rechazados).
+    """
+    def post(self, request, *args, **kwargs):
+        orden = get_object_or_404(Orden, pk=self.kwargs['orden_pk'])
+
+        rechazados = {'examenes': [], 'paquetes': []}
+        solicitados = {
+            'examenes': self._leer_ids(request.POST.getlist('examen_id'), rechazados['examenes']),
+            'paquetes': self._leer_ids(request.POST.getlist('paquete_id'), rechazados['paquetes']),
+        }
+
+        # 1. Validación en UNA consulta: ítems activos que existen en el catálogo
+        examenes_qs = Examen.objects.filter(
+            pk__in=solicitados['examenes'], estado='Activo'
+        ).annotate(tipo=Value('E', output_field=CharField())).values_list('tipo', 'pk').order_by()
+        paquetes_qs = Paquete.objects.filter(
+            pk__in=solicitados['paquetes'], estado='Activo'
+        ).annotate(tipo=Value('P', output_field=CharField())).values_list('tipo', 'pk').order_by()
+        validos = {'examenes': set(), 'paquetes': set()}
+        for tipo, item_id in examenes_qs.union(paquetes_qs, all=True):
+            validos['examenes' if tipo == 'E' else 'paquetes'].add(item_id)
+
+        # 2 y 3. Con la orden bloqueada: ítems que ya tiene (se omiten), inserción
+        # en bloque y un único repreciado (todo o nada). Otro lote sobre la misma
+        # orden espera al bloqueo, así que el resumen es el de lo insertado. Un
+        # alta por otra vía que gane la carrera provoca IntegrityError (sin
+        # ignore_conflicts, que la saltaría en silencio y se reportaría como
+        # agregada) y se revierte el lote completo.
+        try:
+            with transaction.atomic():
+                orden = Orden.objects.select_for_update().get(pk=orden.pk)
+                existentes = self._existentes(orden, validos)
+
+                agregados, omitidos = {}, {}
+                for clave in ('examenes', 'paquetes'):
+                    rechazados[clave] += [i for i in solicitados[clave] if i not in validos[clave]]
+                    omitidos[clave] = [i for i in solicitados[clave] if i in existentes[clave]]
+                    agregados[clave] = [i for i in solicitados[clave]
+                                        if i in validos[clave] and i not in existentes[clave]]
+
+                OrdenExamen.objects.bulk_create([
+                    OrdenExamen(orden=orden, examen_id=i, precio_en_orden=Decimal('0.00'))
+                    for i in agregados['examenes']
+                ])
+                OrdenPaquete.objects.bulk_create([
+                    OrdenPaquete(orden=orden, paquete_id=i, precio_en_orden=Decimal('0.00'))
+                    for i in agregados['paquetes']
+                ])
+                # bulk_create no emite señales: se materializan aquí (2 consultas)
+                OrdenExamenEfectivo.registrar(orden.pk, agregados['examenes'], agregados['paquetes'])
+                if agregados['examenes'] or agregados['paquetes']:
+                    orden.calcular_totales()
+        except IntegrityError:
+            return JsonResponse(
+                {'error': "La orden fue modificada al mismo tiempo. Intente de nuevo."},
+                status=409
+            )
+
+        return JsonResponse({
+            'agregados': agregados,
+            'omitidos': omitidos,
+            'rechazados': rechazados,
+            'totales': {
+                'subtotal': orden.subtotal,
+                'descuento_aplicado': orden.descuento_aplicado,
+                'iva': orden.iva,
+                'total_con_iva': orden.total_con_iva,
+            },
+        })
+
+    @staticmethod
+    def _existentes(orden, validos):
+        """ Ids de los ítems válidos que la orden ya tiene. """
+        return {
+            'examenes': set(orden.ordenexamen_set.filter(
+                examen_id__in=validos['examenes']).values_list('examen_id', flat=True)),
+            'paquetes': set(orden.ordenpaquete_set.filter(
+                paquete_id__in=validos['paquetes']).values_list('paquete_id', flat=True)),
+        }
+
+    @staticmethod
+    def _leer_ids(valores, rechazados):
+        """ Convierte a enteros (sin duplicados, en orden); lo inválido va a rechazados. """
+        ids = []
+        for valor in valores:
+            try:
+                item_id = int(valor)
+            except (TypeError, ValueError):
+                rechazados.append(valor)
+                continue
+            if item_id not in ids:
+                ids.append(item_id)
+        return ids
    
 def buscar_pacientes_api(request):
-        """
-        Vista API para buscar pacientes por Nombre, Apellido o DUI.
-        Retorna un JSON para ser consumido por el Modal de Órdenes.
-        """
-        query = request.GET.get('q', '')
-        pacientes = []
-        
-        if query:
-            # Buscar por nombre, apellido o DUI
-            resultados = Paciente.objects.filter(
-                Q(nombre__icontains=query) | 
-                Q(apellido__icontains=query) |
-                Q(dui__icontains=query)
-            )[:20] # Limitamos a 20 resultados para no saturar
-            
-            for p in resultados:
-                pacientes.append({
-                    'id': p.pk,
-                    'nombre_completo': f"{p.nombre} {p.apellido}",
-                    'dui': p.dui,
-                    'telefono': p.telefono,
-                    'sexo': p.get_sexo_display()
-                })
-        
-        return JsonResponse({'pacientes': pacientes})
-    
+    """
+    Vista API para buscar pacientes por Nombre, Apellido o DUI.
+    Retorna un JSON para ser consumido por el Modal de Órdenes.
+    La búsqueda usa índices (ver pacientes.busqueda), no LIKE '%q%'; los
+    resultados se cachean y se paginan con limit/cursor (ver busqueda_api).
+    """
+    def buscar(query, limite):
+        return [
+            {
+                'id': p.pk,
+                'nombre_completo': f"{p.nombre} {p.apellido}",
+                'dui': p.dui,
+                'telefono': p.telefono,
+                'sexo': p.get_sexo_display()
+            }
+            for p in buscar_pacientes(query, limite=limite)
+        ]
+
+    return responder_busqueda(request, 'pacientes', buscar, normalizar=normalizar)
+
+
 def buscar_convenios_api(request):
     """
     API para buscar convenios por nombre o tipo.
-    Retorna JSON para el modal de órdenes.
+    Retorna JSON para el modal de órdenes (cacheado y paginado con limit/cursor).
     """
-    query = request.GET.get('q', '')
-    convenios = []
-    
-    if query:
+    def buscar(query, limite):
         resultados = Convenio.objects.filter(
             (Q(nombre__icontains=query) | Q(tipo__icontains=query)) &
             Q(estado='Activo')
-        )[:20]
-        
-        for c in resultados:
-            convenios.append({
+        ).order_by('nombre', 'pk')[:limite]
+        return [
+            {
                 'id': c.pk,
                 'nombre': c.nombre,
                 'tipo': c.tipo,
                 'descuento_general': c.descuento_general_examenes
-            })
-    
-    return JsonResponse({'convenios': convenios})
+            }
+            for c in resultados
+        ]
+
+    return responder_busqueda(request, 'convenios', buscar)
 
 class OrdenResultadoPDFView(PersonalAutorizadoRequiredMixin, View):
     """
-    Genera el PDF de resultados accediendo desde la Orden.
+    Solicita el PDF de resultados accediendo desde la Orden.
+    Un resultado validado ya generado se sirve desde la caché en disco; si no,
+    el render se hace en segundo plano (comando procesar_pdfs).
     """
     def get(self, request, pk):
         # Buscamos la ORDEN por su PK
@@ -274,50 +370,89 @@ class OrdenResultadoPDFView(PersonalAutorizadoRequiredMixin, View):
             messages.error(request, "Esta orden aún no tiene resultados registrados.")
             return redirect(reverse('orden_update', kwargs={'pk': pk}))
 
-        resultado = orden.resultado
-        
-        # Obtenemos los detalles ordenados para el reporte
-        detalles = resultado.detalles.select_related(
-            'valor_referencia', 
-            'valor_referencia__examen',
-            'valor_referencia__examen__categoria'
-        ).order_by(
-            'valor_referencia__examen__categoria__nombre',
-            'valor_referencia__examen__nombre',
-            'valor_referencia__pk'
-        )
+        respuesta = pdf_desde_cache(request, 'Resultado', orden.pk, f"Resultados_Orden_{orden.pk}.pdf")
+        if respuesta:
+            return respuesta
+        trabajo = TrabajoPDF.encolar('Resultado', orden.pk, request.user)
+        return respuesta_trabajo_pdf(request, trabajo)
 
-        # Usamos el mismo template que diseñamos antes
-        template_path = 'resultados/resultado_pdf.html'
-        
-        context = {
-            'resultado': resultado,
-            'orden': orden,
-            'paciente': orden.paciente,
-            'detalles': detalles,
-            'fecha_impresion': timezone.now(),
-            'empresa': {
-                'nombre': 'Laboratorio Clínico Avanzado',
-                'direccion': 'Calle Principal #123, San Salvador',
-                'telefono': '2222-0000',
-                'email': 'resultados@labavanzado.com'
-            }
-        }
-        
-        response = HttpResponse(content_type='application/pdf')
-        filename = f"Resultados_Orden_{orden.pk}.pdf"
-        response['Content-Disposition'] = f'inline; filename="{filename}"'
-        
-        template = get_template(template_path)
-        html = template.render(context)
 
-        # Generamos el PDF usando el utils.link_callback
-        pisa_status = pisa.CreatePDF(
-            html, dest=response, link_callback=link_callback
-        )
+class OrdenResultadoVistaPreviaView(PersonalAutorizadoRequiredMixin, View):
+    """ Vista previa HTML del reporte de resultados (mismos datos y template que el PDF). """
+    def get(self, request, pk):
+        contexto, _ = documento_resultado(pk)
+        return render(request, DOCUMENTOS['Resultado'][0], contexto)
 
-        if pisa_status.err:
-            return HttpResponse('Error al generar PDF <pre>' + html + '</pre>')
-            
-        return response
-    
+
+def pdf_desde_cache(request, tipo, objeto_id, nombre):
+    """
+    Si el documento es inmutable (resultado validado, factura) y ya está en
+    la caché en disco, lo sirve directo sin pasar por la cola. None si no.
+    """
+    clave = clave_documento(tipo, objeto_id)
+    ruta = clave and cache_pdf.buscar(tipo, objeto_id, clave)
+    if not ruta:
+        return None
+    try:
+        return cache_pdf.servir_pdf(request, ruta, nombre, etag=f'"{clave}"')
+    except OSError:
+        return None # Desalojado entre la búsqueda y la lectura: se regenera
+
+
+def respuesta_trabajo_pdf(request, trabajo):
+    """
+    Respuesta común al encolar un PDF: JSON (202) para clientes que lo piden
+    con ?formato=json o Accept: application/json; si no, la página de espera.
+    """
+    if request.GET.get('formato') == 'json' or 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse(datos_trabajo_pdf(trabajo), status=202 if not trabajo.terminado else 200)
+    return redirect(reverse('trabajo_pdf_estado', kwargs={'pk': trabajo.pk}))
+
+
+def datos_trabajo_pdf(trabajo):
+    datos = {
+        'trabajo': trabajo.pk,
+        'estado': trabajo.estado,
+        'estado_url': reverse('trabajo_pdf_estado', kwargs={'pk': trabajo.pk}),
+        'descarga': None,
+    }
+    if trabajo.resumen:
+        datos['resumen'] = trabajo.resumen
+    if trabajo.estado == 'Completado':
+        datos['descarga'] = reverse('trabajo_pdf_descargar', kwargs={'pk': trabajo.pk})
+    return datos
+
+
+class TrabajoPDFEstadoView(PersonalAutorizadoRequiredMixin, View):
+    """
+    Estado de un trabajo de PDF. En JSON para el polling; en HTML muestra
+    una página de espera que redirige a la descarga al terminar.
+    """
+    def get(self, request, pk):
+        trabajo = get_object_or_404(TrabajoPDF, pk=pk)
+        if request.GET.get('formato') == 'json':
+            return JsonResponse(datos_trabajo_pdf(trabajo))
+        if trabajo.estado == 'Completado':
+            return redirect(reverse('trabajo_pdf_descargar', kwargs={'pk': trabajo.pk}))
+        return render(request, 'ordenes/trabajo_pdf_estado.html', {
+            'titulo': "Generando PDF",
+            'trabajo': trabajo,
+        })
+
+
+class TrabajoPDFDescargarView(PersonalAutorizadoRequiredMixin, View):
+    """ Sirve el archivo terminado (PDF o exportación) desde disco. """
+    def get(self, request, pk):
+        trabajo = get_object_or_404(TrabajoPDF, pk=pk, estado='Completado')
+        content_type = mimetypes.guess_type(trabajo.nombre_descarga)[0] or 'application/octet-stream'
+        try:
+            respuesta = cache_pdf.servir_pdf(
+                request, trabajo.archivo, trabajo.nombre_descarga, etag=f'"trabajo-{trabajo.pk}"',
+                content_type=content_type
+            )
+            if trabajo.tipo == 'Exportacion':
+                respuesta['X-Ordenes-Exportadas'] = trabajo.resumen.get('exportados', 0)
+                respuesta['X-Ordenes-Con-Error'] = len(trabajo.resumen.get('errores', []))
+            return respuesta
+        except OSError:
+            raise Http404("El archivo del PDF ya no existe. Solicítelo de nuevo.")
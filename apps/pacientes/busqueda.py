@@ -0,0 +1,91 @@
+import re
+import unicodedata
+
+from django.db.models import Q
+
+from .models import Paciente
+
+LIMITE_RESULTADOS = 20
+
+# DUI completo o parcial: solo dígitos y, opcionalmente, el guion verificador
+DUI_PARCIAL = re.compile(r'^\d{1,8}(-\d?)?$')
+
+
+def normalizar(texto):
+    """ Minúsculas, sin tildes y con espacios simples: 'José  PÉREZ' -> 'jose perez'. """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def texto_busqueda(nombre, apellido):
+    """ Valores de las columnas indexadas (busqueda, busqueda_inversa) de un paciente. """
+    return normalizar(f"{nombre} {apellido}"), normalizar(f"{apellido} {nombre}")
+
+
+def normalizar_dui(query):
+    """ Devuelve el prefijo de DUI a buscar, o None si la consulta no parece un DUI. """
+    query = query.replace(' ', '')
+    # 9 dígitos sin guion: se inserta en su lugar (012345678 -> 01234567-8)
+    if re.fullmatch(r'\d{9}', query):
+        query = f"{query[:8]}-{query[8]}"
+    return query if DUI_PARCIAL.match(query) else None
+
+
+def prefijo(campo, valor):
+    """
+    "campo empieza con valor": LIKE 'valor%', que SQL Server resuelve con un
+    seek sobre el índice de la columna. Un rango [valor, sucesor) armado con
+    chr(ord(...) + 1) no sirve: depende del orden ordinal y las collations de
+    SQL Server ordenan ':' antes de los dígitos y '{' antes de las letras.
+    (Las columnas ya están normalizadas: no hace falta comparar sin mayúsculas.)
+    """
+    return Q(**{f'{campo}__startswith': valor})
+
+
+def buscar_pacientes(query, limite=LIMITE_RESULTADOS):
+    """
+    Búsqueda de pacientes pensada para el modal de órdenes (una consulta por
+    tecla). Todas las ramas son prefijos sobre índices (LIKE 'q%') con TOP N, sin LIKE '%q%':
+
+    1. Consulta con forma de DUI -> prefijo sobre el índice único de dui.
+    2. Texto -> el primer término se busca como prefijo de "nombre apellido"
+       y de "apellido nombre" (columnas normalizadas e indexadas); el resto
+       de términos debe aparecer como inicio de palabra en el mismo registro.
+
+    Ranking: coincidencia exacta, luego prefijo por nombre, luego por apellido.
+    """
+    dui = normalizar_dui(query)
+    if dui:
+        return list(Paciente.objects.filter(prefijo('dui', dui)).order_by('dui')[:limite])
+
+    q = normalizar(query)
+    if not q:
+        return []
+
+    primero, *resto = q.split(' ')
+    por_nombre = Paciente.objects.filter(prefijo('busqueda', primero))
+    por_apellido = Paciente.objects.filter(prefijo('busqueda_inversa', primero))
+    for termino in resto:
+        # Filtro residual: se evalúa solo sobre las filas que trajo el índice
+        por_nombre = por_nombre.filter(busqueda__contains=f' {termino}')
+        por_apellido = por_apellido.filter(busqueda_inversa__contains=f' {termino}')
+
+    candidatos = list(por_nombre.order_by('busqueda')[:limite])
+    candidatos += list(por_apellido.order_by('busqueda_inversa')[:limite])
+
+    def rango(paciente):
+        if paciente.busqueda == q or paciente.busqueda_inversa == q:
+            return 0
+        if paciente.busqueda.startswith(q):
+            return 1
+        if paciente.busqueda_inversa.startswith(q):
+            return 2
+        return 3
+
+    vistos, resultados = set(), []
+    for paciente in sorted(candidatos, key=lambda p: (rango(p), p.busqueda)):
+        if paciente.pk not in vistos:
+            vistos.add(paciente.pk)
+            resultados.append(paciente)
+    return resultados[:limite]
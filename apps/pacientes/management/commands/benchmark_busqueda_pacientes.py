@@ -0,0 +1,87 @@
+import random
+import statistics
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pacientes.busqueda import buscar_pacientes, texto_busqueda
+from pacientes.models import Paciente
+
+NOMBRES = ['Ana', 'José', 'María', 'Luis', 'Carmen', 'Jorge', 'Sofía', 'Óscar', 'Lucía', 'Mario',
+           'Elena', 'Raúl', 'Marta', 'Héctor', 'Rosa', 'Iván', 'Teresa', 'Andrés', 'Julia', 'Ramón']
+APELLIDOS = ['López', 'Pérez', 'Martínez', 'Hernández', 'García', 'Rodríguez', 'Sánchez', 'Ramírez',
+             'Flores', 'Rivera', 'Gómez', 'Díaz', 'Cruz', 'Morales', 'Ortiz', 'Castillo', 'Romero',
+             'Vásquez', 'Mejía', 'Aguilar']
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia de la búsqueda de pacientes sobre N pacientes sintéticos. "
+        "Los datos se crean dentro de una transacción que se revierte al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pacientes', type=int, default=500_000)
+        parser.add_argument('--consultas', type=int, default=1_000)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['semilla'])
+        try:
+            with transaction.atomic():
+                self._crear_pacientes(options['pacientes'], rnd)
+                self._medir(options['consultas'], rnd)
+                raise _Revertir
+        except _Revertir:
+            self.stdout.write("Datos sintéticos revertidos.")
+
+    def _crear_pacientes(self, total, rnd):
+        inicio = time.perf_counter()
+        lote = []
+        for i in range(total):
+            nombre = f"{rnd.choice(NOMBRES)} {rnd.choice(NOMBRES)}"
+            apellido = f"{rnd.choice(APELLIDOS)} {rnd.choice(APELLIDOS)}"
+            busqueda, busqueda_inversa = texto_busqueda(nombre, apellido)
+            lote.append(Paciente(
+                nombre=nombre, apellido=apellido, fecha_nacimiento=date(1950 + i % 60, 1 + i % 12, 1 + i % 28),
+                sexo='MF'[i % 2], dui=f"{90000000 - i:08d}-{i % 10}", telefono='70000000',
+                correo=f"p{i}@example.com", busqueda=busqueda, busqueda_inversa=busqueda_inversa,
+            ))
+            if len(lote) == 5000:
+                Paciente.objects.bulk_create(lote)
+                lote = []
+        if lote:
+            Paciente.objects.bulk_create(lote)
+        self.stdout.write(f"{total} pacientes creados en {time.perf_counter() - inicio:.1f} s")
+
+    def _medir(self, consultas, rnd):
+        # Mezcla de lo que se teclea en el modal: prefijos de nombre, de
+        # apellido, nombre + apellido y DUI parciales.
+        generadores = [
+            lambda: rnd.choice(NOMBRES)[:rnd.randint(2, 5)],
+            lambda: rnd.choice(APELLIDOS)[:rnd.randint(3, 6)],
+            lambda: f"{rnd.choice(NOMBRES)} {rnd.choice(APELLIDOS)[:3]}",
+            lambda: f"{rnd.choice(APELLIDOS)} {rnd.choice(NOMBRES)[:2]}",
+            lambda: f"{rnd.randint(89500000, 90000000)}"[:rnd.randint(4, 8)],
+        ]
+        tiempos = []
+        for _ in range(consultas):
+            query = rnd.choice(generadores)()
+            inicio = time.perf_counter()
+            buscar_pacientes(query)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        tiempos.sort()
+        p95 = tiempos[int(len(tiempos) * 0.95) - 1]
+        self.stdout.write(
+            f"{consultas} consultas: p50={statistics.median(tiempos):.2f} ms  "
+            f"p95={p95:.2f} ms  max={tiempos[-1]:.2f} ms"
+        )
+        estilo = self.style.SUCCESS if p95 < 50 else self.style.ERROR
+        self.stdout.write(estilo(f"Objetivo p95 < 50 ms: {'OK' if p95 < 50 else 'NO CUMPLE'}"))
+
+
+class _Revertir(Exception):
+    """ Fuerza el rollback de los datos sintéticos. """
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 12:51
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.lower().split())
+
+
+def poblar_busqueda(apps, schema_editor):
+    Paciente = apps.get_model('pacientes', 'Paciente')
+    lote = []
+    for paciente in Paciente.objects.only('nombre', 'apellido').iterator(chunk_size=2000):
+        paciente.busqueda = _normalizar(f"{paciente.nombre} {paciente.apellido}")
+        paciente.busqueda_inversa = _normalizar(f"{paciente.apellido} {paciente.nombre}")
+        lote.append(paciente)
+        if len(lote) == 2000:
+            Paciente.objects.bulk_update(lote, ['busqueda', 'busqueda_inversa'])
+            lote = []
+    if lote:
+        Paciente.objects.bulk_update(lote, ['busqueda', 'busqueda_inversa'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pacientes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paciente',
+            name='busqueda',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='paciente',
+            name='busqueda_inversa',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=201),
+        ),
+        migrations.RunPython(poblar_busqueda, migrations.RunPython.noop),
+    ]
@@ -29,6 +29,11 @@ class Paciente(models.Model):
     edad_al_registro = models.PositiveIntegerField(null=True, blank=True, verbose_name="Edad al Registro"
     )
 
+    # --- ÍNDICES DE BÚSQUEDA (se calculan en clean(), ver busqueda.py) ---
+    # Texto normalizado (minúsculas, sin tildes) para búsquedas por prefijo
+    busqueda = models.CharField(max_length=201, blank=True, editable=False, db_index=True)
+    busqueda_inversa = models.CharField(max_length=201, blank=True, editable=False, db_index=True)
+
     def __str__(self):
         return f"{self.nombre} {self.apellido}"
 
@@ -37,10 +42,13 @@ class Paciente(models.Model):
     @property
     def edad(self):
         """Calcula la edad precisa en el momento actual."""
+        return self.edad_en(date.today())
+
+    def edad_en(self, fecha):
+        """Edad en años cumplidos a una fecha dada (ej: la fecha de toma de muestra)."""
         if not self.fecha_nacimiento: return None
-        today = date.today()
-        return today.year - self.fecha_nacimiento.year - (
-            (today.month, today.day) < (self.fecha_nacimiento.month, self.fecha_nacimiento.day)
+        return fecha.year - self.fecha_nacimiento.year - (
+            (fecha.month, fecha.day) < (self.fecha_nacimiento.month, self.fecha_nacimiento.day)
         )
 
     def clean(self):
@@ -52,6 +60,10 @@ class Paciente(models.Model):
         if self.telefono:
             self.telefono = re.sub(r"[\s\-]", "", self.telefono)
 
+        # Columnas de búsqueda ("nombre apellido" y "apellido nombre")
+        from .busqueda import texto_busqueda
+        self.busqueda, self.busqueda_inversa = texto_busqueda(self.nombre, self.apellido)
+
     def puede_eliminarse(self):
         """
         Regla de negocio: Verifica si el paciente puede ser eliminado.
@@ -1,3 +1,61 @@
+from datetime import date
+
 from django.test import TestCase
 
-# Create your tests here.
+from .busqueda import buscar_pacientes, normalizar, normalizar_dui
+from .models import Paciente
+
+
+class BusquedaPacientesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        datos = [
+            ('Ana', 'López', '01234567-8'),
+            ('Ana María', 'Pérez López', '01234568-9'),
+            ('José', 'Anaya', '11111111-1'),
+            ('Luis', 'Martínez', '22222222-2'),
+        ]
+        cls.pacientes = {}
+        for i, (nombre, apellido, dui) in enumerate(datos):
+            cls.pacientes[dui] = Paciente.objects.create(
+                nombre=nombre, apellido=apellido, fecha_nacimiento=date(1990, 1, 1 + i), sexo='F',
+                dui=dui, telefono='22223333', correo=f'p{i}@example.com'
+            )
+
+    def nombres(self, query):
+        return [f"{p.nombre} {p.apellido}" for p in buscar_pacientes(query)]
+
+    def test_columna_normalizada_al_guardar(self):
+        paciente = self.pacientes['01234568-9']
+        self.assertEqual(paciente.busqueda, 'ana maria perez lopez')
+        self.assertEqual(paciente.busqueda_inversa, 'perez lopez ana maria')
+        self.assertEqual(normalizar('  JOSÉ   Pérez '), 'jose perez')
+
+    def test_prefijo_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(self.nombres('JOSE'), ['José Anaya'])
+        self.assertEqual(self.nombres('marti'), ['Luis Martínez'])
+
+    def test_ranking_nombre_antes_que_apellido(self):
+        # 'ana' es prefijo de dos nombres y de un apellido (Anaya)
+        self.assertEqual(self.nombres('ana'), ['Ana López', 'Ana María Pérez López', 'José Anaya'])
+        self.assertEqual(self.nombres('ana lopez')[0], 'Ana López')
+
+    def test_terminos_en_cualquier_orden(self):
+        self.assertEqual(self.nombres('perez ana'), ['Ana María Pérez López'])
+        self.assertEqual(self.nombres('lopez ana'), ['Ana López'])
+
+    def test_dui_por_prefijo(self):
+        self.assertEqual(normalizar_dui('012345678'), '01234567-8')
+        self.assertIsNone(normalizar_dui('ana'))
+        self.assertEqual(self.nombres('0123456'), ['Ana López', 'Ana María Pérez López'])
+        self.assertEqual(self.nombres('012345678'), ['Ana López'])
+
+    def test_prefijo_que_termina_en_9_o_z(self):
+        # Con un rango [valor, sucesor) estos prefijos no encontraban nada en SQL Server
+        self.assertEqual(self.nombres('012345689'), ['Ana María Pérez López'])
+        self.assertEqual(self.nombres('01234568-9'), ['Ana María Pérez López'])
+        self.assertEqual(self.nombres('martinez'), ['Luis Martínez'])
+
+    def test_limite(self):
+        self.assertEqual(len(buscar_pacientes('a', limite=2)), 2)
@@ -2,7 +2,7 @@ from datetime import date
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from usuarios.permisos import CapacidadRequeridaMixin
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 from django.core.exceptions import ValidationError # Importar para capturar
 from django.db.models.deletion import ProtectedError # Importar para capturar
@@ -11,20 +11,11 @@ from .forms import PacienteForm
 
 # --- Mixin de Seguridad ---
 
-class AdminRecepcionistaRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+class AdminRecepcionistaRequiredMixin(CapacidadRequeridaMixin):
     """
     Asegura que el usuario logueado tenga el rol 'Administrador' o 'Recepcionista'.
     """
-    def test_func(self):
-        if not self.request.user.is_authenticated or not self.request.user.rol:
-            return False
-        # El superusuario siempre tiene acceso (implícito si tiene rol Admin)
-        return self.request.user.rol.nombre in ['Administrador', 'Recepcionista']
-
-    def handle_no_permission(self):
-        messages.error(self.request, "No tienes permiso para acceder a esta página.")
-        # Asumiendo que 'dashboard' es tu vista principal
-        return redirect('dashboard' if self.request.user.is_authenticated else 'login')
+    capacidad = 'gestionar_pacientes'
 
 # --- Vistas del CRUD de Pacientes ---
 
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time, timedelta
+from django.template.loader import get_template
+from django.utils import timezone
+from pypdf import PdfWriter # Dependencia de xhtml2pdf
+from xhtml2pdf import pisa
+
+from convenios.models import Convenio
+from ordenes.pdf import DOCUMENTOS, contexto_resultado
+from ordenes.reporte import resultados_para_reporte
+from ordenes.recursos_pdf import medir_recursos, precalentar
+from .models import Resultado
+
+# Órdenes que se cargan y renderizan juntas: acota la memoria (HTML + PDFs en
+# vuelo) sin importar cuántas órdenes tenga el rango.
+TAMANO_LOTE = 50
+PROCESOS = min(4, os.cpu_count() or 1)
+# Un solo PDF concatenado se arma en memoria del worker (pypdf): pasado este
+# número de órdenes se debe usar el ZIP, que va escribiendo cada PDF a disco.
+MAX_ORDENES_PDF_UNICO = 300
+
+
+def resultados_validados(fecha_desde, fecha_hasta, convenio=None):
+    """ Resultados validados en el rango de fechas (inclusive), opcionalmente de un convenio. """
+    inicio = timezone.make_aware(datetime.combine(fecha_desde, time.min))
+    fin = timezone.make_aware(datetime.combine(fecha_hasta + timedelta(days=1), time.min))
+    resultados = Resultado.objects.filter(
+        estado='Validado', fecha_validacion__gte=inicio, fecha_validacion__lt=fin
+    )
+    if convenio:
+        resultados = resultados.filter(orden__convenio=convenio)
+    return resultados.order_by('fecha_validacion', 'pk')
+
+
+def lotes_de_resultados(resultados, tamano=TAMANO_LOTE):
+    """
+    Recorre los resultados por lotes, cada uno con sus detalles ya cargados:
+    1 consulta de ids en total y 3 por lote (ver ordenes.reporte), sin
+    importar cuántos parámetros tenga cada orden.
+    Produce listas de (resultado, [detalles]).
+    """
+    return resultados_para_reporte(resultados, tamano)
+
+
+def html_a_pdf(html, ruta):
+    """ Convierte el HTML en un PDF en `ruta`. Corre en los procesos hijos. """
+    try:
+        with open(ruta, 'wb') as archivo, medir_recursos(os.path.basename(ruta)) as link_callback:
+            pisa_status = pisa.CreatePDF(html, dest=archivo, link_callback=link_callback)
+    except Exception:
+        return False # Una orden con error no detiene el lote (se reporta aparte)
+    return not pisa_status.err
+
+
+def _iniciar_proceso():
+    # Con 'spawn' (Windows) el hijo arranca sin Django configurado
+    import django
+    django.setup()
+    precalentar()
+
+
+class _EnProceso:
+    """ Mismo contrato que ProcessPoolExecutor.map, sin procesos (1 CPU o pruebas). """
+
+    def map(self, funcion, *iterables):
+        return map(funcion, *iterables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def exportar_resultados(resultados, formato, destino, procesos=PROCESOS, al_avanzar=None):
+    """
+    Escribe en `destino` (archivo binario) los reportes de los resultados:
+    formato 'zip' (un PDF por orden) o 'pdf' (un solo PDF concatenado).
+    El HTML se genera aquí y la conversión a PDF (lo costoso) se reparte
+    entre `procesos`. `al_avanzar` se llama después de cada lote (latido del
+    worker). Devuelve (exportados, [órdenes con error]).
+    El PDF concatenado se arma en memoria: ValueError si pasa de
+    MAX_ORDENES_PDF_UNICO órdenes (el rango pudo crecer desde que se pidió).
+    """
+    if formato == 'pdf' and resultados.count() > MAX_ORDENES_PDF_UNICO:
+        raise ValueError(f"Más de {MAX_ORDENES_PDF_UNICO} órdenes: exporte en ZIP.")
+    template = get_template(DOCUMENTOS['Resultado'][0])
+    exportados, errores = 0, []
+    pool = ProcessPoolExecutor(procesos, initializer=_iniciar_proceso) if procesos > 1 else _EnProceso()
+
+    with tempfile.TemporaryDirectory() as carpeta, pool:
+        salida = zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED) if formato == 'zip' else PdfWriter()
+        for lote in lotes_de_resultados(resultados):
+            ordenes = [resultado.orden for resultado, _ in lote]
+            htmls = [
+                template.render(contexto_resultado(resultado.orden, resultado, detalles))
+                for resultado, detalles in lote
+            ]
+            rutas = [os.path.join(carpeta, f"Resultados_Orden_{orden.pk}.pdf") for orden in ordenes]
+
+            for orden, ruta, correcto in zip(ordenes, rutas, pool.map(html_a_pdf, htmls, rutas)):
+                if not correcto:
+                    errores.append(orden.pk)
+                    continue
+                if formato == 'zip':
+                    salida.write(ruta, os.path.basename(ruta))
+                    os.remove(ruta)
+                else:
+                    salida.append(ruta)
+                exportados += 1
+            if al_avanzar:
+                al_avanzar()
+
+        if formato == 'zip':
+            if errores:
+                salida.writestr('errores.txt', "No se pudo generar el PDF de las órdenes: " +
+                                ", ".join(f"#{pk}" for pk in errores))
+            salida.close()
+        else:
+            salida.write(destino)
+            salida.close()
+    return exportados, errores
+
+
+# --- Exportación en la cola de PDFs ---
+# La vista solo valida y encola un TrabajoPDF 'Exportacion' con los filtros;
+# el worker (procesar_pdfs) arma el archivo con exportar_trabajo y la
+# descarga se sirve desde disco como cualquier otro trabajo.
+
+def parametros_exportacion(fecha_desde, fecha_hasta, convenio, formato):
+    """ Filtros de la exportación, serializables para TrabajoPDF.parametros. """
+    return {
+        'fecha_desde': fecha_desde.isoformat(),
+        'fecha_hasta': fecha_hasta.isoformat(),
+        'convenio': convenio.pk if convenio else None,
+        'formato': formato,
+    }
+
+
+def clave_exportacion(parametros):
+    """
+    TrabajoPDF.clave de la exportación (SHA-256 de los filtros): la misma
+    exportación pedida dos veces comparte el trabajo, y dos distintas nunca.
+    """
+    return hashlib.sha256(json.dumps(parametros, sort_keys=True).encode()).hexdigest()
+
+
+def nombre_exportacion(parametros):
+    nombre = "Resultados_{}_{}".format(
+        parametros['fecha_desde'].replace('-', ''), parametros['fecha_hasta'].replace('-', '')
+    )
+    if parametros['convenio']:
+        nombre += f"_convenio_{parametros['convenio']}"
+    return f"{nombre}.{parametros['formato']}"
+
+
+def exportar_trabajo(parametros, ruta, al_avanzar=None):
+    """
+    Genera en `ruta` la exportación descrita por `parametros` (ver
+    parametros_exportacion). Corre en el worker. Devuelve (nombre de
+    descarga, resumen {'exportados', 'errores'}).
+    """
+    convenio = Convenio.objects.get(pk=parametros['convenio']) if parametros['convenio'] else None
+    resultados = resultados_validados(
+        date.fromisoformat(parametros['fecha_desde']), date.fromisoformat(parametros['fecha_hasta']), convenio
+    )
+    with open(ruta, 'wb') as destino:
+        exportados, errores = exportar_resultados(
+            resultados, parametros['formato'], destino, al_avanzar=al_avanzar
+        )
+    return nombre_exportacion(parametros), {'exportados': exportados, 'errores': errores}
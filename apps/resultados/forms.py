@@ -1,4 +1,5 @@
 from django import forms
+from convenios.models import Convenio
 from .models import Resultado
 
 class ResultadoHeaderForm(forms.ModelForm):
@@ -12,4 +13,36 @@ class ResultadoHeaderForm(forms.ModelForm):
         widgets = {
             'observaciones_generales': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'estado': forms.HiddenInput(), # El estado se maneja con el botón "Validar"
-        }
\ No newline at end of file
+        }
+
+class ExportacionResultadosForm(forms.Form):
+    """ Rango de fechas de validación (y convenio opcional) para la exportación por lotes. """
+    FORMATO_CHOICES = [('zip', 'ZIP (un PDF por orden)'), ('pdf', 'Un solo PDF')]
+
+    fecha_desde = forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    fecha_hasta = forms.DateField(widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+    convenio = forms.ModelChoiceField(
+        queryset=Convenio.objects.all(), required=False, empty_label="Todos (incluye particulares)",
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    formato = forms.ChoiceField(
+        choices=FORMATO_CHOICES, initial='zip', widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean(self):
+        datos = super().clean()
+        if datos.get('fecha_desde') and datos.get('fecha_hasta') and datos['fecha_desde'] > datos['fecha_hasta']:
+            raise forms.ValidationError("La fecha inicial no puede ser posterior a la final.")
+        return datos
+
+
+class ImportacionResultadosForm(forms.Form):
+    """ Archivo de resultados exportado por un equipo (CSV o ASTM). """
+    archivo = forms.FileField(
+        label="Archivo del equipo",
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.txt,.astm'})
+    )
+    descargar_rechazos = forms.BooleanField(
+        label="Descargar las líneas rechazadas (CSV)", required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
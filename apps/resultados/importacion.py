@@ -0,0 +1,238 @@
+import csv
+from itertools import chain
+
+from django.db import transaction
+from django.utils import timezone
+
+from examenes.models import Examen
+from examenes.rangos import ResolvedorRangos, edad_en_toma
+from muestras.models import Muestra
+from ordenes.models import OrdenExamenEfectivo
+from pacientes.models import Paciente
+from .models import Resultado, ResultadoDetalle
+
+# --- Importación de resultados de los equipos (CSV / ASTM) ---
+# El archivo se lee línea por línea y los detalles se escriben por lotes:
+# la memoria depende del tamaño del lote y de los diccionarios precargados
+# (muestras de resultados abiertos y exámenes), no del largo del archivo.
+#
+# Formatos aceptados:
+# - CSV (',' o ';'): codigo_barras, codigo_examen, valor[, ...]; con o sin encabezado.
+# - ASTM E1394 en texto: registros O (muestra en el campo 3) seguidos de sus
+#   registros R (examen '^^^GLU' en el campo 3, valor en el campo 4).
+
+# Cada lote arma IN de resultados y parámetros: SQL Server admite 2100 parámetros
+TAMANO_LOTE = 500
+MAX_RECHAZOS_EN_RESUMEN = 200
+
+
+class ResumenImportacion:
+    """ Contadores de una importación y los primeros rechazos (para mostrar en pantalla). """
+
+    def __init__(self):
+        self.lineas = 0
+        self.nuevos = 0
+        self.actualizados = 0
+        self.rechazados = 0
+        self.rechazos = []
+
+    @property
+    def importados(self):
+        return self.nuevos + self.actualizados
+
+
+def lineas_de_archivo(archivo):
+    """ Líneas de texto de un archivo binario (ej: archivo subido), decodificadas de a una. """
+    for numero, linea in enumerate(archivo):
+        if numero == 0:
+            linea = linea.removeprefix(b'\xef\xbb\xbf')
+        yield linea.decode('utf-8', errors='replace')
+
+
+def leer_registros(lineas):
+    """
+    Genera (número de línea, texto, codigo_barras, codigo_examen, valor) por
+    cada resultado del archivo. Las líneas mal formadas salen con
+    codigo_barras None; las que no son resultados (encabezados, registros
+    ASTM H/P/L/C, líneas vacías) se omiten.
+    """
+    lineas = iter(lineas)
+    primera = next(lineas, None)
+    if primera is None:
+        return
+    lineas = chain([primera], lineas)
+    if primera.lstrip().startswith('H|'):
+        yield from _leer_astm(lineas)
+    else:
+        yield from _leer_csv(lineas, ';' if primera.count(';') > primera.count(',') else ',')
+
+
+def _leer_csv(lineas, separador):
+    for numero, fila in enumerate(csv.reader(lineas, delimiter=separador), start=1):
+        if not any(campo.strip() for campo in fila):
+            continue
+        texto = separador.join(fila)
+        if numero == 1 and 'codigo' in texto.lower():
+            continue # Encabezado
+        if len(fila) < 3 or not fila[0].strip() or not fila[1].strip():
+            yield numero, texto, None, None, None
+            continue
+        yield numero, texto, fila[0].strip(), fila[1].strip(), fila[2].strip()
+
+
+def _leer_astm(lineas):
+    muestra = None
+    for numero, linea in enumerate(lineas, start=1):
+        texto = linea.strip()
+        campos = texto.split('|')
+        tipo = campos[0][-1:] # Algunos equipos anteponen el número de trama ("1H|...")
+        if tipo == 'O':
+            muestra = campos[2].split('^')[0].strip() if len(campos) > 2 else None
+        elif tipo == 'P':
+            muestra = None
+        elif tipo == 'R':
+            componentes = [c.strip() for c in campos[2].split('^')] if len(campos) > 3 else []
+            codigo = next((c for c in componentes if c), None)
+            if not muestra or not codigo:
+                yield numero, texto, None, None, None
+                continue
+            yield numero, texto, muestra, codigo, campos[3].strip()
+
+
+class ImportadorResultados:
+    """
+    Resuelve cada línea con diccionarios precargados (sin consultas por línea)
+    y hace el upsert de ResultadoDetalle por lotes. Solo se escriben
+    resultados en 'Pendiente' (los enviados a validación o validados no se
+    tocan). Cada rechazo se escribe en `rechazos` (CSV) si se indica.
+    """
+
+    def __init__(self, rechazos=None, tamano_lote=TAMANO_LOTE):
+        self.rechazos = csv.writer(rechazos) if rechazos is not None else None
+        self.tamano_lote = tamano_lote
+        self.resumen = ResumenImportacion()
+        if self.rechazos:
+            self.rechazos.writerow(['linea', 'motivo', 'contenido'])
+
+    def cargar_diccionarios(self):
+        # codigo_barras -> (resultado_id, orden_id, sexo, edad a la toma)
+        self.muestras = {}
+        abiertas = Muestra.objects.filter(
+            orden__resultado__estado='Pendiente', codigo_barras__isnull=False
+        ).values_list(
+            'codigo_barras', 'orden__resultado__resultado_id', 'orden_id',
+            'orden__paciente__sexo', 'orden__paciente__fecha_nacimiento', 'fecha_toma',
+        )
+        for codigo_barras, resultado_id, orden_id, sexo, nacimiento, fecha_toma in abiertas.iterator():
+            edad = edad_en_toma(Paciente(fecha_nacimiento=nacimiento), fecha_toma, None)
+            self.muestras[codigo_barras] = (resultado_id, orden_id, sexo, edad)
+
+        # orden_id -> exámenes solicitados (directos o por paquete)
+        self.examenes_orden = {}
+        solicitados = OrdenExamenEfectivo.objects.filter(
+            orden__resultado__estado='Pendiente'
+        ).values_list('orden_id', 'examen_id')
+        for orden_id, examen_id in solicitados.iterator():
+            self.examenes_orden.setdefault(orden_id, set()).add(examen_id)
+
+        # Examen.codigo -> examen_id, y sus valores de referencia
+        self.examenes = dict(Examen.objects.values_list('codigo', 'examen_id'))
+        self.rangos = ResolvedorRangos.cargar(Examen.objects.values('examen_id'))
+
+    def importar(self, lineas):
+        """ Procesa las líneas de texto del archivo y devuelve el ResumenImportacion. """
+        self.cargar_diccionarios()
+        lote = {}
+        for numero, texto, codigo_barras, codigo_examen, valor in leer_registros(lineas):
+            self.resumen.lineas += 1
+            motivo, clave = self.resolver(codigo_barras, codigo_examen, valor)
+            if motivo:
+                self.rechazar(numero, motivo, texto)
+                continue
+            lote[clave] = (valor, numero, texto) # Si la línea se repite en el lote, gana la última
+            if len(lote) >= self.tamano_lote:
+                self.guardar_lote(lote)
+                lote = {}
+        if lote:
+            self.guardar_lote(lote)
+        return self.resumen
+
+    def resolver(self, codigo_barras, codigo_examen, valor):
+        """ (motivo de rechazo, None) o (None, (resultado_id, ValorReferencia)). """
+        if codigo_barras is None:
+            return "Línea mal formada", None
+        if not valor:
+            return "Sin valor", None
+        muestra = self.muestras.get(codigo_barras)
+        if muestra is None:
+            return "Muestra desconocida o con resultado ya enviado a validación", None
+        resultado_id, orden_id, sexo, edad = muestra
+        examen_id = self.examenes.get(codigo_examen.upper())
+        if examen_id is None:
+            return "Código de examen desconocido", None
+        if examen_id not in self.examenes_orden.get(orden_id, ()):
+            return "Examen no solicitado en la orden", None
+        valor_referencia = self.rangos.resolver(examen_id, sexo, edad)
+        if valor_referencia is None:
+            candidatos = self.rangos.rangos(examen_id)
+            if len(candidatos) != 1:
+                return "Sin valor de referencia aplicable al paciente", None
+            valor_referencia = candidatos[0]
+        return None, (resultado_id, valor_referencia)
+
+    def rechazar(self, numero, motivo, texto):
+        self.resumen.rechazados += 1
+        if len(self.resumen.rechazos) < MAX_RECHAZOS_EN_RESUMEN:
+            self.resumen.rechazos.append((numero, motivo, texto))
+        if self.rechazos:
+            self.rechazos.writerow([numero, motivo, texto])
+
+    def guardar_lote(self, lote):
+        """
+        Upsert del lote en una transacción: bloquea los resultados que siguen
+        en 'Pendiente', 1 consulta de existentes, un delete, un bulk_create,
+        un bulk_update y la fecha_modificacion de los resultados tocados.
+        Los existentes se buscan por examen: un detalle guardado contra otro
+        rango del examen pasa al rango resuelto y los repetidos se borran.
+        """
+        resultado_ids = {resultado_id for resultado_id, _ in lote}
+        examen_ids = {valor_referencia.examen_id for _, valor_referencia in lote}
+        with transaction.atomic():
+            abiertos = set(Resultado.objects.select_for_update().filter(
+                pk__in=resultado_ids, estado='Pendiente'
+            ).values_list('pk', flat=True))
+            # (resultado_id, examen_id) -> detalles guardados del examen
+            existentes = {}
+            for d in ResultadoDetalle.objects.filter(
+                resultado_id__in=abiertos, valor_referencia__examen_id__in=examen_ids
+            ).select_related('valor_referencia'):
+                existentes.setdefault((d.resultado_id, d.valor_referencia.examen_id), []).append(d)
+            nuevos, cambiados, sobrantes = [], [], []
+            for (resultado_id, valor_referencia), (valor, numero, texto) in lote.items():
+                if resultado_id not in abiertos:
+                    self.rechazar(numero, "El resultado se envió a validación durante la importación", texto)
+                    continue
+                guardados = existentes.get((resultado_id, valor_referencia.examen_id), [])
+                # El del mismo rango primero; si no hay, el primero de otro rango se mueve
+                guardados.sort(key=lambda d: d.valor_referencia_id != valor_referencia.pk)
+                if not guardados:
+                    detalle = ResultadoDetalle(
+                        resultado_id=resultado_id, valor_referencia=valor_referencia, valor_obtenido=valor
+                    )
+                    nuevos.append(detalle)
+                else:
+                    detalle = guardados[0]
+                    detalle.valor_referencia = valor_referencia
+                    detalle.valor_obtenido = valor
+                    cambiados.append(detalle)
+                    sobrantes.extend(d.pk for d in guardados[1:])
+                detalle.evaluar(valor_referencia)
+            ResultadoDetalle.objects.filter(pk__in=sobrantes).delete()
+            ResultadoDetalle.objects.bulk_create(nuevos)
+            ResultadoDetalle.objects.bulk_update(cambiados, ['valor_referencia', 'valor_obtenido', 'bandera'])
+            # Los bulk no pasan por save(): la bandeja de validación debe ver el cambio
+            Resultado.objects.filter(
+                pk__in={detalle.resultado_id for detalle in nuevos + cambiados}
+            ).update(fecha_modificacion=timezone.now())
+        self.resumen.nuevos += len(nuevos)
+        self.resumen.actualizados += len(cambiados)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from resultados.importacion import TAMANO_LOTE, ImportadorResultados
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa los resultados exportados por los equipos (CSV o ASTM) a las "
+        "órdenes con resultado en 'Pendiente', usando el código de barras de la "
+        "muestra y el código del examen. Las líneas rechazadas van a un CSV."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Archivo de resultados del equipo.")
+        parser.add_argument('--rechazos', help="Ruta del CSV con las líneas rechazadas y el motivo.")
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE,
+                            help="Detalles escritos por transacción.")
+
+    def handle(self, *args, **options):
+        rechazos = open(options['rechazos'], 'w', newline='', encoding='utf-8') if options['rechazos'] else None
+        try:
+            with open(options['archivo'], encoding='utf-8-sig', errors='replace', newline='') as archivo:
+                resumen = ImportadorResultados(rechazos, tamano_lote=options['lote']).importar(archivo)
+        except FileNotFoundError as error:
+            raise CommandError(f"No se encontró el archivo: {error.filename}")
+        finally:
+            if rechazos:
+                rechazos.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resumen.lineas} línea(s): {resumen.nuevos} nuevo(s), "
+            f"{resumen.actualizados} actualizado(s), {resumen.rechazados} rechazada(s)."
+        ))
+        if resumen.rechazados and not options['rechazos']:
+            for numero, motivo, _ in resumen.rechazos[:20]:
+                self.stdout.write(f"  Línea {numero}: {motivo}")
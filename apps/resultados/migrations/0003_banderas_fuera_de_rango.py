@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('examenes', '0003_valorreferencia_criticos'),
+        ('resultados', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultadodetalle',
+            name='bandera',
+            field=models.CharField(blank=True, choices=[('', 'Sin evaluar'), ('N', 'Normal'), ('L', 'Bajo'), ('H', 'Alto'), ('LL', 'Crítico bajo'), ('HH', 'Crítico alto'), ('A', 'Anormal')], default='', max_length=2),
+        ),
+        migrations.AddIndex(
+            model_name='resultadodetalle',
+            index=models.Index(fields=['bandera', 'resultado'], name='resultado_detalle_bandera_idx'),
+        ),
+    ]
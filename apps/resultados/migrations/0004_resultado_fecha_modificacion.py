@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resultados', '0003_banderas_fuera_de_rango'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultado',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='resultado',
+            index=models.Index(fields=['estado', 'fecha_modificacion'], name='resultado_estado_modif_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+from examenes.rangos import compilar_rango
+
+LOTE = 2000
+
+
+def rellenar_banderas(apps, schema_editor):
+    """
+    Calcula la bandera de los detalles que existían antes de 0003, con la misma
+    regla que ResultadoDetalle.evaluar (compilar_rango sobre el rango del
+    parámetro). Recorre por pk en lotes para no cargar la tabla completa.
+    """
+    ResultadoDetalle = apps.get_model('resultados', 'ResultadoDetalle')
+    predicados = {}  # valor_referencia_id -> predicado compilado
+    ultimo = 0
+    while True:
+        lote = list(
+            ResultadoDetalle.objects.filter(pk__gt=ultimo, bandera='')
+            .select_related('valor_referencia').order_by('pk')[:LOTE]
+        )
+        if not lote:
+            break
+        cambiados = []
+        for detalle in lote:
+            valor = detalle.valor_referencia
+            evaluar = predicados.get(valor.pk)
+            if evaluar is None:
+                evaluar = predicados[valor.pk] = compilar_rango(
+                    valor.rango_referencia, valor.tipo_resultado, valor.critico_minimo, valor.critico_maximo
+                )
+            detalle.bandera = evaluar(detalle.valor_obtenido)
+            if detalle.bandera:
+                cambiados.append(detalle)
+        ResultadoDetalle.objects.bulk_update(cambiados, ['bandera'])
+        ultimo = lote[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('examenes', '0003_valorreferencia_criticos'),
+        ('resultados', '0004_resultado_fecha_modificacion'),
+    ]
+
+    operations = [
+        # Sin reverso: al revertir 0003 la columna se elimina de todos modos
+        migrations.RunPython(rellenar_banderas, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from ordenes.models import Orden
 from examenes.models import ValorReferencia # ¡Importante!
+from examenes.rangos import BANDERAS_ANORMALES, predicado
 from usuarios.models import Usuario
 
 class Resultado(models.Model):
@@ -40,14 +41,52 @@ class Resultado(models.Model):
     
     # Fecha de emisión (cuando se crea el primer borrador)
     fecha_emision = models.DateTimeField(default=timezone.now)
+    # Último cambio: lo usa la bandeja de validación para pedir solo lo nuevo.
+    # Los UPDATE masivos deben actualizarla a mano (auto_now solo aplica en save).
+    fecha_modificacion = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Resultados para {self.orden}"
 
+    @classmethod
+    def validar_en_bloque(cls, ids, usuario):
+        """
+        Valida de una vez los resultados `ids` que sigan 'En Espera' y pasa sus
+        órdenes a 'Completada': UPDATEs por conjunto dentro de una transacción.
+        Las filas se bloquean al leerlas, así otro validador o un 'devolver a
+        corrección' simultáneo no las cambia a medias.
+        Devuelve (ids validados, {id: (orden_id, estado actual)} de los que no
+        se validaron; (None, None) si el resultado ya no existe).
+        """
+        ids = set(ids)
+        ahora = timezone.now()
+        with transaction.atomic():
+            validables = dict(cls.objects.select_for_update().filter(
+                pk__in=ids, estado='En Espera'
+            ).values_list('pk', 'orden_id'))
+            if validables:
+                cls.objects.filter(pk__in=validables).update(
+                    estado='Validado', validado_por=usuario,
+                    fecha_validacion=ahora, fecha_modificacion=ahora,
+                )
+                Orden.objects.filter(pk__in=validables.values()).update(estado='Completada')
+
+        omitidos = {
+            pk: (orden_id, estado)
+            for pk, orden_id, estado in cls.objects.filter(
+                pk__in=ids - validables.keys()
+            ).values_list('pk', 'orden_id', 'estado')
+        }
+        omitidos.update({pk: (None, None) for pk in ids - validables.keys() - omitidos.keys()})
+        return sorted(validables), omitidos
+
     class Meta:
         db_table = 'Resultados'
         verbose_name = "Resultado (Encabezado)"
         verbose_name_plural = "Resultados (Encabezados)"
+        indexes = [
+            models.Index(fields=['estado', 'fecha_modificacion'], name='resultado_estado_modif_idx'),
+        ]
 
 class ResultadoDetalle(models.Model):
     """
@@ -74,8 +113,30 @@ class ResultadoDetalle(models.Model):
     # Se usa CharField para permitir "120.5" y "Negativo"
     valor_obtenido = models.CharField(max_length=100, blank=False)
     
-    # (Opcional) Podemos añadir lógica futura aquí para marcar esto
-    # fuera_de_rango = models.BooleanField(default=False)
+    # Bandera calculada al guardar contra el valor de referencia (ver evaluar)
+    BANDERA_CHOICES = [
+        ('', 'Sin evaluar'),
+        ('N', 'Normal'),
+        ('L', 'Bajo'),
+        ('H', 'Alto'),
+        ('LL', 'Crítico bajo'),
+        ('HH', 'Crítico alto'),
+        ('A', 'Anormal'),
+    ]
+    bandera = models.CharField(max_length=2, choices=BANDERA_CHOICES, default='', blank=True)
+
+    def evaluar(self, valor_referencia=None):
+        """ Calcula la bandera del valor obtenido (no guarda). """
+        self.bandera = predicado(valor_referencia or self.valor_referencia)(self.valor_obtenido)
+        return self.bandera
+
+    @property
+    def fuera_de_rango(self):
+        return self.bandera in BANDERAS_ANORMALES
+
+    def save(self, *args, **kwargs):
+        self.evaluar()
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.valor_referencia.examen.codigo}: {self.valor_obtenido}"
@@ -85,4 +146,40 @@ class ResultadoDetalle(models.Model):
         verbose_name = "Resultado (Detalle)"
         verbose_name_plural = "Resultados (Detalles)"
         # Un parámetro solo debe tener un resultado por informe
-        unique_together = ('resultado', 'valor_referencia')
\ No newline at end of file
+        unique_together = ('resultado', 'valor_referencia')
+        # Filtrar resultados anormales (bandeja, reportes) sin leer los valores
+        indexes = [
+            models.Index(fields=['bandera', 'resultado'], name='resultado_detalle_bandera_idx'),
+        ]
+
+def emparejar_detalles(parametros, detalles):
+    """
+    Empareja los detalles guardados con los parámetros que se muestran (ver
+    ResolvedorRangos.parametros). Un detalle guardado contra otro valor de
+    referencia del mismo examen (ingresado cuando se listaban todos, o el
+    rango se agregó/editó después) pasa al parámetro del examen si este es
+    el único y no tiene detalle propio; los demás de ese examen sobran.
+    Requiere detalle.valor_referencia cargado (select_related).
+    Devuelve ({parametro_id: detalle}, [detalles sobrantes]).
+    """
+    emparejados = {}
+    por_examen = {}
+    for parametro in parametros:
+        por_examen.setdefault(parametro.examen_id, []).append(parametro)
+    ids = {parametro.pk for parametro in parametros}
+    otros = {} # examen_id -> detalles de otro valor de referencia
+    for detalle in detalles:
+        if detalle.valor_referencia_id in ids:
+            emparejados[detalle.valor_referencia_id] = detalle
+        else:
+            otros.setdefault(detalle.valor_referencia.examen_id, []).append(detalle)
+
+    sobrantes = []
+    for examen_id, anteriores in otros.items():
+        candidatos = por_examen.get(examen_id, [])
+        if len(candidatos) != 1:
+            continue # Examen que ya no está en la orden, o sin rango aplicable: no se toca
+        if candidatos[0].pk not in emparejados:
+            emparejados[candidatos[0].pk] = anteriores.pop(0)
+        sobrantes.extend(anteriores)
+    return emparejados, sobrantes
@@ -1,3 +1,618 @@
-from django.test import TestCase
+import importlib
+import io
+import os
+import tempfile
+import tracemalloc
+import zipfile
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from pypdf import PdfReader
+
+from categorias.models import CategoriaExamen
+from convenios.models import Convenio
+from examenes.models import Examen, MetodoExamen, ValorReferencia
+from muestras.models import Muestra
+from ordenes.models import Orden, OrdenExamen, OrdenPaquete, TrabajoPDF
+from ordenes.pdf import procesar_trabajo, reclamar_trabajo
+from pacientes.models import Paciente
+from paquetes.models import Paquete, PaqueteExamen
+from roles.models import Rol
+from tipos_muestras.models import TipoMuestra
+from usuarios.models import Usuario
+from .importacion import ImportadorResultados
+from .exportacion import exportar_resultados, lotes_de_resultados, resultados_validados
+from .models import Resultado, ResultadoDetalle
+from .views import MARGEN_CAMBIOS_BANDEJA, ValidacionListView
+
+
+class ExportacionResultadosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+        tipo_muestra = TipoMuestra.objects.create(
+            nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+        )
+        cls.parametros = []
+        for i in range(3):
+            examen = Examen.objects.create(
+                nombre=f'Examen {i}', codigo=f'EX{i}', precio=Decimal('10.00'),
+                categoria=categoria, tipo_muestra=tipo_muestra
+            )
+            MetodoExamen.objects.create(examen=examen, metodo=f'Método {i}')
+            cls.parametros += [
+                ValorReferencia.objects.create(examen=examen, rango_referencia='70-110', unidad_medida='mg/dL'),
+                ValorReferencia.objects.create(examen=examen, rango_referencia='<5', unidad_medida='U/L'),
+            ]
+        cls.convenio = Convenio.objects.create(
+            nombre='Empresa Uno', tipo='Empresa', persona_contacto='Luis',
+            telefono_contacto='22224444', correo_contacto='rrhh@example.com',
+            condiciones_pago='Crédito 30 días',
+        )
+        rol = Rol.objects.create(nombre='Jefe de Laboratorio', descripcion='Valida resultados')
+        cls.usuario = Usuario.objects.create_user(
+            username='jefe', password='clave-segura-123', email='jefe@example.com',
+            nombre='Julia', apellido='Jefa', dui='09876543-2', rol=rol
+        )
+        paciente = Paciente.objects.create(
+            nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+            dui='01234567-8', telefono='22223333', correo='ana@example.com'
+        )
+
+        validacion = datetime(2026, 3, 10, 15, 0, tzinfo=dt_timezone.utc)
+        for i in range(5):
+            orden = Orden.objects.create(paciente=paciente, convenio=cls.convenio if i < 3 else None)
+            resultado = Resultado.objects.create(
+                orden=orden, estado='Validado', validado_por=cls.usuario, fecha_validacion=validacion
+            )
+            ResultadoDetalle.objects.bulk_create([
+                ResultadoDetalle(resultado=resultado, valor_referencia=p, valor_obtenido=str(90 + i))
+                for p in cls.parametros[:2 + i]  # Cantidad de parámetros distinta por orden
+            ])
+        # No validado: nunca se exporta
+        Resultado.objects.create(orden=Orden.objects.create(paciente=paciente), estado='En Espera')
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def test_consultas_constantes_por_lote(self):
+        resultados = resultados_validados(date(2026, 3, 10), date(2026, 3, 10))
+        with self.assertNumQueries(4):  # ids + cabeceras + detalles + métodos
+            lotes = list(lotes_de_resultados(resultados))
+        self.assertEqual(len(lotes[0]), 5)
+        self.assertEqual([len(detalles) for _, detalles in lotes[0]], [2, 3, 4, 5, 6])
+
+        with CaptureQueriesContext(connection) as consultas:
+            lotes = list(lotes_de_resultados(resultados, tamano=2))
+        self.assertEqual(len(lotes), 3)
+        self.assertEqual(len(consultas), 1 + 3 * 3)
+
+    def test_zip_filtrado_por_convenio(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        datos = {
+            'fecha_desde': '2026-03-10', 'fecha_hasta': '2026-03-10',
+            'convenio': self.convenio.pk, 'formato': 'zip',
+        }
+        with override_settings(PDF_TRABAJOS_DIR=carpeta.name):
+            # La vista solo encola; la misma exportación pedida dos veces comparte el trabajo
+            encolado = self.client.post(reverse('resultado_exportar'), datos, HTTP_ACCEPT='application/json')
+            self.assertEqual(encolado.status_code, 202)
+            self.client.post(reverse('resultado_exportar'), datos, HTTP_ACCEPT='application/json')
+            self.assertEqual(TrabajoPDF.objects.filter(tipo='Exportacion').count(), 1)
+
+            trabajo = procesar_trabajo(reclamar_trabajo())
+            self.assertEqual(trabajo.estado, 'Completado', trabajo.error)
+            self.assertEqual(trabajo.nombre_descarga, f'Resultados_20260310_20260310_convenio_{self.convenio.pk}.zip')
+            respuesta = self.client.get(reverse('trabajo_pdf_descargar', kwargs={'pk': trabajo.pk}))
+        self.assertEqual(respuesta['Content-Type'], 'application/zip')
+        self.assertEqual(respuesta['X-Ordenes-Exportadas'], '3')
+        contenido = b''.join(respuesta.streaming_content)
+        self.assertEqual(int(respuesta['Content-Length']), len(contenido))
+        with zipfile.ZipFile(io.BytesIO(contenido)) as archivo:
+            nombres = archivo.namelist()
+            self.assertEqual(len(nombres), 3)
+            self.assertTrue(archivo.read(nombres[0]).startswith(b'%PDF'))
+
+    def test_exportaciones_distintas_no_comparten_trabajo(self):
+        # Sin convenio, ambas usan objeto_id 0: las separa la clave de los filtros
+        for formato in ('zip', 'pdf', 'zip'):
+            self.client.post(reverse('resultado_exportar'), {
+                'fecha_desde': '2026-03-10', 'fecha_hasta': '2026-03-10', 'formato': formato,
+            }, HTTP_ACCEPT='application/json')
+        trabajos = TrabajoPDF.objects.filter(tipo='Exportacion').order_by('pk')
+        self.assertEqual([t.parametros['formato'] for t in trabajos], ['zip', 'pdf'])
+        self.assertEqual({t.objeto_id for t in trabajos}, {0})
+        self.assertEqual(len({t.clave for t in trabajos}), 2)
+
+    def test_pdf_unico_en_varios_procesos(self):
+        resultados = resultados_validados(date(2026, 3, 1), date(2026, 3, 31))
+        destino = io.BytesIO()
+        exportados, errores = exportar_resultados(resultados, 'pdf', destino, procesos=2)
+        self.assertEqual((exportados, errores), (5, []))
+        self.assertGreaterEqual(len(PdfReader(destino).pages), 5)
+
+        # El tope del PDF en memoria se respeta aunque no pase por la vista
+        with mock.patch('resultados.exportacion.MAX_ORDENES_PDF_UNICO', 4), self.assertRaises(ValueError):
+            exportar_resultados(resultados, 'pdf', io.BytesIO(), procesos=1)
+
+    def test_rango_sin_resultados(self):
+        respuesta = self.client.post(reverse('resultado_exportar'), {
+            'fecha_desde': '2026-04-01', 'fecha_hasta': '2026-04-30', 'formato': 'zip',
+        })
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertContains(respuesta, "No hay resultados validados")
+
+
+class ResultadoIngresoTests(TestCase):
+    """ El hub de ingreso cuesta lo mismo con 6 que con 60 parámetros. """
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaExamen.objects.create(nombre='Hematología', descripcion='Hemograma')
+        tipo_muestra = TipoMuestra.objects.create(
+            nombre='Sangre total', descripcion='Tubo lila', condiciones_almacenamiento='2-8 °C'
+        )
+        rol = Rol.objects.create(nombre='Técnico', descripcion='Ingresa resultados')
+        cls.usuario = Usuario.objects.create_user(
+            username='tecnico', password='clave-segura-123', email='tecnico@example.com',
+            nombre='Tomás', apellido='Técnico', dui='09876543-2', rol=rol
+        )
+        paciente = Paciente.objects.create(
+            nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+            dui='01234567-8', telefono='22223333', correo='ana@example.com'
+        )
+
+        def crear_orden(examenes, desde):
+            orden = Orden.objects.create(paciente=paciente)
+            directos = []
+            for i in range(desde, desde + examenes):
+                examen = Examen.objects.create(
+                    nombre=f'Examen {i}', codigo=f'EX{i}', precio=Decimal('10.00'),
+                    categoria=categoria, tipo_muestra=tipo_muestra
+                )
+                # Valores alternativos: solo uno aplica a la paciente (F, 35 años)
+                ValorReferencia.objects.bulk_create([
+                    ValorReferencia(examen=examen, sexo='M', rango_referencia='1-10'),
+                    ValorReferencia(examen=examen, sexo='F', edad_maxima=17, rango_referencia='2-20'),
+                    ValorReferencia(examen=examen, sexo='F', edad_minima=18, rango_referencia='3-30'),
+                    ValorReferencia(examen=examen, rango_referencia='4-40'),
+                ])
+                directos.append(examen)
+            # La mitad de los exámenes llega por un paquete
+            paquete = Paquete.objects.create(nombre=f'Perfil {desde}', precio=Decimal('30.00'))
+            mitad = len(directos) // 2
+            for examen in directos[:mitad]:
+                PaqueteExamen.objects.create(paquete=paquete, examen=examen)
+            OrdenPaquete.objects.create(orden=orden, paquete=paquete, precio_en_orden=paquete.precio)
+            for examen in directos[mitad:]:
+                OrdenExamen.objects.create(orden=orden, examen=examen, precio_en_orden=examen.precio)
+            Resultado.objects.create(orden=orden)
+            return orden
+
+        cls.paciente = paciente
+        cls.orden_chica = crear_orden(6, desde=0)     # 6 parámetros
+        cls.orden_grande = crear_orden(60, desde=100) # 60 parámetros
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    def url(self, orden):
+        return reverse('resultado_ingreso', kwargs={'orden_pk': orden.pk})
+
+    def valores(self, orden, funcion):
+        parametros = ValorReferencia.objects.filter(
+            Q(examen__ordenes=orden) | Q(examen__paquetes__ordenes=orden), sexo='F', edad_minima=18
+        ).values_list('pk', flat=True)
+        datos = {'estado': 'Pendiente', 'observaciones_generales': '', 'guardar_borrador': '1'}
+        datos.update({f'valor_obtenido_{pk}': funcion(i) for i, pk in enumerate(parametros)})
+        return datos
+
+    def contar(self, metodo, *args):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = metodo(*args)
+        self.assertIn(respuesta.status_code, (200, 302))
+        return len(consultas)
+
+    def test_mostrar_con_consultas_constantes(self):
+        respuesta = self.client.get(self.url(self.orden_grande))
+        parametros = respuesta.context['parametros_list']
+        self.assertEqual(len(parametros), 60)
+        self.assertEqual({p.rango_referencia for p in parametros}, {'3-30'})
+        self.assertEqual(
+            self.contar(self.client.get, self.url(self.orden_chica)),
+            self.contar(self.client.get, self.url(self.orden_grande)),
+        )
+
+    def test_guardar_con_consultas_constantes(self):
+        # Primer guardado: todos nuevos (bulk_create)
+        chica = self.contar(self.client.post, self.url(self.orden_chica), self.valores(self.orden_chica, str))
+        grande = self.contar(self.client.post, self.url(self.orden_grande), self.valores(self.orden_grande, str))
+        self.assertEqual(chica, grande)
+        self.assertEqual(ResultadoDetalle.objects.filter(resultado__orden=self.orden_grande).count(), 60)
+
+        # Segundo guardado: mezcla de cambiados (bulk_update), vaciados (delete) e iguales
+        def mezcla(i):
+            return '' if i % 3 == 0 else (f'{i}.5' if i % 3 == 1 else str(i))
+
+        chica = self.contar(self.client.post, self.url(self.orden_chica), self.valores(self.orden_chica, mezcla))
+        datos = self.valores(self.orden_grande, mezcla)
+        with self.assertNumQueries(chica):
+            self.client.post(self.url(self.orden_grande), datos)
+
+        guardados = dict(ResultadoDetalle.objects.filter(
+            resultado__orden=self.orden_grande
+        ).values_list('valor_obtenido', 'valor_referencia_id'))
+        self.assertEqual(len(guardados), 40)
+        self.assertIn('1.5', guardados)
+
+    def test_banderas_al_guardar(self):
+        datos = self.valores(self.orden_chica, lambda i: ['2', '15', '31', 'Hemolizada', '3', '30'][i])
+        self.client.post(self.url(self.orden_chica), datos)
+        detalles = ResultadoDetalle.objects.filter(resultado__orden=self.orden_chica)
+        self.assertEqual(
+            sorted(detalles.values_list('valor_obtenido', 'bandera')),
+            [('15', 'N'), ('2', 'L'), ('3', 'N'), ('30', 'N'), ('31', 'H'), ('Hemolizada', '')]
+        )
+        # Al editar el rango, el siguiente guardado recalcula aunque el valor no cambie
+        ValorReferencia.objects.filter(rango_referencia='3-30').update(rango_referencia='3-10')
+        self.client.post(self.url(self.orden_chica), datos)
+        self.assertEqual(detalles.filter(bandera__in=['L', 'H']).count(), 4)  # 2, 15, 31 y 30
+
+    def test_detalle_guardado_contra_otro_rango_del_examen(self):
+        # Ingresados cuando el hub listaba todos los rangos del examen
+        examen = Examen.objects.get(codigo='EX0')
+        otros = ValorReferencia.objects.filter(examen=examen).exclude(sexo='F', edad_minima=18)
+        resultado = self.orden_chica.resultado
+        for valor, parametro in zip(['5', '6'], otros):
+            ResultadoDetalle.objects.create(resultado=resultado, valor_referencia=parametro, valor_obtenido=valor)
+        aplicable = ValorReferencia.objects.get(examen=examen, sexo='F', edad_minima=18)
+
+        contexto = self.client.get(self.url(self.orden_chica)).context
+        self.assertEqual(contexto['detalles_map'][aplicable.pk], '5')
+
+        datos = self.valores(self.orden_chica, lambda i: '40')
+        self.client.post(self.url(self.orden_chica), datos)
+        self.assertEqual(
+            list(ResultadoDetalle.objects.filter(resultado=resultado, valor_referencia__examen=examen).values_list(
+                'valor_referencia_id', 'valor_obtenido', 'bandera'
+            )),
+            [(aplicable.pk, '40', 'H')]
+        )
+
+    def test_migracion_rellena_banderas(self):
+        datos = self.valores(self.orden_chica, lambda i: ['2', '15', '31', 'Hemolizada', '3', '30'][i])
+        self.client.post(self.url(self.orden_chica), datos)
+        detalles = ResultadoDetalle.objects.filter(resultado__orden=self.orden_chica)
+        esperadas = sorted(detalles.values_list('valor_obtenido', 'bandera'))
+        detalles.update(bandera='')  # Como quedaron las filas previas a 0003
+
+        migracion = importlib.import_module('resultados.migrations.0005_rellenar_banderas')
+        with mock.patch.object(migracion, 'LOTE', 4):
+            migracion.rellenar_banderas(django_apps, None)
+        self.assertEqual(sorted(detalles.values_list('valor_obtenido', 'bandera')), esperadas)
+
+    def test_rango_segun_edad_a_la_toma(self):
+        # Nacida el 17/05/2008: a la toma (16/05/2026) tenía 17 años; hoy ya cumplió 18
+        Paciente.objects.filter(pk=self.paciente.pk).update(fecha_nacimiento=date(2008, 5, 17))
+        Muestra.objects.create(
+            orden=self.orden_chica, tipo_muestra=TipoMuestra.objects.get(), responsable_toma=self.usuario,
+            fecha_toma=datetime(2026, 5, 16, 12, 0, tzinfo=dt_timezone.utc)
+        )
+        respuesta = self.client.get(self.url(self.orden_chica))
+        self.assertEqual({p.rango_referencia for p in respuesta.context['parametros_list']}, {'2-20'})
+
+
+class BandejaValidacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+        tipo_muestra = TipoMuestra.objects.create(
+            nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+        )
+        cls.parametros = [
+            ValorReferencia.objects.create(
+                examen=Examen.objects.create(
+                    nombre=f'Examen {i}', codigo=f'EX{i}', precio=Decimal('10.00'),
+                    categoria=categoria, tipo_muestra=tipo_muestra
+                ),
+                rango_referencia='70-110'
+            )
+            for i in range(4)
+        ]
+        cls.jefe = Usuario.objects.create_user(
+            username='jefe', password='clave-segura-123', email='jefe@example.com',
+            nombre='Julia', apellido='Jefa', dui='09876543-2',
+            rol=Rol.objects.create(nombre='Jefe de Laboratorio', descripcion='Valida resultados')
+        )
+        cls.tecnico = Usuario.objects.create_user(
+            username='tecnico', password='clave-segura-123', email='tecnico@example.com',
+            nombre='Tomás', apellido='Técnico', dui='09876543-3',
+            rol=Rol.objects.create(nombre='Técnico', descripcion='Ingresa resultados')
+        )
+        cls.paciente = Paciente.objects.create(
+            nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+            dui='01234567-8', telefono='22223333', correo='ana@example.com'
+        )
+        # (prioridad, valores): el valor 200 queda fuera de rango
+        cls.resultados = [
+            cls.crear_resultado('Rutina', ['90', '200']),
+            cls.crear_resultado('Urgente', ['90', '91', '200', '200']),
+            cls.crear_resultado('Preferente', ['90']),
+            cls.crear_resultado('Urgente', []),
+        ]
+        Resultado.objects.create(orden=Orden.objects.create(paciente=cls.paciente))  # Pendiente: no aparece
+
+    @classmethod
+    def crear_resultado(cls, prioridad, valores):
+        resultado = Resultado.objects.create(
+            orden=Orden.objects.create(paciente=cls.paciente, prioridad=prioridad), estado='En Espera'
+        )
+        for parametro, valor in zip(cls.parametros, valores):
+            ResultadoDetalle.objects.create(resultado=resultado, valor_referencia=parametro, valor_obtenido=valor)
+        return resultado
+
+    def setUp(self):
+        self.client.force_login(self.jefe)
+
+    def test_urgentes_primero_con_conteos(self):
+        respuesta = self.client.get(reverse('validacion_lista'))
+        filas = [
+            (r.pk, r.total_detalles, r.detalles_anormales) for r in respuesta.context['resultados']
+        ]
+        urgente, urgente_vacio, preferente, rutina = (
+            self.resultados[1], self.resultados[3], self.resultados[2], self.resultados[0]
+        )
+        self.assertEqual(filas, [
+            (urgente.pk, 4, 2), (urgente_vacio.pk, 0, 0), (preferente.pk, 1, 0), (rutina.pk, 2, 1),
+        ])
+
+    def test_consultas_constantes_y_paginacion(self):
+        url = reverse('validacion_lista')
+        self.client.get(url)  # Sesión y usuario ya cargados
+        with CaptureQueriesContext(connection) as pocas:
+            self.client.get(url)
+        for _ in range(10):
+            self.crear_resultado('Rutina', ['200', '90', '80'])
+        with CaptureQueriesContext(connection) as muchas:
+            self.client.get(url)
+        self.assertEqual(len(pocas), len(muchas))
+
+        with mock.patch.object(ValidacionListView, 'por_pagina', 3):
+            primera = self.client.get(url).context
+            segunda = self.client.get(url, {'cursor': primera['pagina'].cursor_siguiente}).context
+        vistos = [r.pk for r in primera['resultados']] + [r.pk for r in segunda['resultados']]
+        self.assertEqual(len(set(vistos)), 6)
+        self.assertEqual(vistos[:2], [self.resultados[1].pk, self.resultados[3].pk])
+
+    def test_cambios_desde(self):
+        url = reverse('validacion_cambios')
+        # Lo creado en setUpTestData no debe caer dentro del margen de solapamiento
+        Resultado.objects.update(fecha_modificacion=timezone.now() - timedelta(hours=1))
+        desde = timezone.now()
+        validado = self.resultados[0]
+        validado.estado = 'Validado'
+        validado.save()
+        nuevo = self.crear_resultado('Urgente', ['200'])
+
+        datos = self.client.get(url, {'desde': desde.isoformat()}).json()
+        self.assertEqual(datos['retirados'], [validado.pk])
+        self.assertEqual([item['id'] for item in datos['cambiados']], [nuevo.pk])
+        self.assertTrue(datos['cambiados'][0]['urgente'])
+        self.assertIn(f'data-resultado="{nuevo.pk}"', datos['cambiados'][0]['html'])
+
+        # Cambio que se confirmó tarde: su fecha_modificacion ya quedó antes de la consulta
+        tardio = self.resultados[2]
+        Resultado.objects.filter(pk=tardio.pk).update(
+            fecha_modificacion=parse_datetime(datos['desde']) + MARGEN_CAMBIOS_BANDEJA / 2
+        )
+        # El 'desde' devuelto se solapa con la consulta anterior: repite lo del margen y no lo pierde
+        datos = self.client.get(url, {'desde': datos['desde']}).json()
+        self.assertEqual(datos['retirados'], [validado.pk])
+        self.assertEqual({item['id'] for item in datos['cambiados']}, {nuevo.pk, tardio.pk})
+        self.assertEqual(self.client.get(url, {'desde': 'ayer'}).status_code, 400)
+
+    def test_solo_validadores(self):
+        self.client.force_login(self.tecnico)
+        self.assertEqual(self.client.get(reverse('validacion_lista')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('validacion_cambios'), {'desde': '2026-01-01'}).status_code, 403)
+
+    def test_validacion_masiva(self):
+        urgente, vacio = self.resultados[1], self.resultados[3]
+        # Otro validador se adelantó con uno de los seleccionados
+        Resultado.objects.filter(pk=vacio.pk).update(estado='Validado')
+
+        respuesta = self.client.post(reverse('validacion_masiva'), {
+            'resultados': [r.pk for r in self.resultados if r is not vacio] + [vacio.pk, 99999]
+        }, follow=True)
+
+        validados = Resultado.objects.filter(estado='Validado', validado_por=self.jefe)
+        self.assertEqual(validados.count(), 3)
+        self.assertEqual(
+            Orden.objects.filter(resultado__in=validados, estado='Completada').count(), 3
+        )
+        self.assertIsNotNone(validados.get(pk=urgente.pk).fecha_validacion)
+        avisos = [str(m) for m in respuesta.context['messages']]
+        self.assertIn("3 resultado(s) validados y sus órdenes finalizadas.", avisos)
+        self.assertIn(f"Orden #{vacio.orden_id} (Validado)", avisos[1])
+        self.assertIn("Resultado #99999 (ya no existe)", avisos[1])
+
+    def test_validacion_masiva_con_consultas_fijas(self):
+        def contar(resultados):
+            with CaptureQueriesContext(connection) as consultas:
+                validados, _ = Resultado.validar_en_bloque([r.pk for r in resultados], self.jefe)
+            self.assertEqual(len(validados), len(resultados))
+            return len(consultas)
+
+        pocos = contar(self.resultados[:2])
+        muchos = contar([self.crear_resultado('Rutina', ['90']) for _ in range(30)])
+        self.assertEqual(pocos, muchos)
+
+    def test_validacion_masiva_solo_validadores(self):
+        self.client.force_login(self.tecnico)
+        respuesta = self.client.post(reverse('validacion_masiva'), {'resultados': [self.resultados[0].pk]})
+        self.assertEqual(respuesta.status_code, 403)
+        self.assertFalse(Resultado.objects.filter(estado='Validado').exists())
+
+
+class ImportacionResultadosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = CategoriaExamen.objects.create(nombre='Química', descripcion='Química sanguínea')
+        cls.tipo_muestra = TipoMuestra.objects.create(
+            nombre='Suero', descripcion='Tubo rojo', condiciones_almacenamiento='2-8 °C'
+        )
+        examenes = {}
+        for codigo, rango in [('GLU', '70-110'), ('COL', '<200'), ('TRI', '<150')]:
+            examenes[codigo] = Examen.objects.create(
+                nombre=codigo, codigo=codigo, precio=Decimal('5.00'), categoria=categoria, tipo_muestra=cls.tipo_muestra
+            )
+            ValorReferencia.objects.create(examen=examenes[codigo], rango_referencia=rango)
+        cls.usuario = Usuario.objects.create_user(
+            username='tecnico', password='clave-segura-123', email='tecnico@example.com',
+            nombre='Tomás', apellido='Técnico', dui='09876543-2',
+            rol=Rol.objects.create(nombre='Técnico', descripcion='Ingresa resultados')
+        )
+        paciente = Paciente.objects.create(
+            nombre='Ana', apellido='López', fecha_nacimiento=date(1990, 5, 17), sexo='F',
+            dui='01234567-8', telefono='22223333', correo='ana@example.com'
+        )
+        # GLU directo y COL por paquete; TRI no se pidió
+        cls.orden = Orden.objects.create(paciente=paciente)
+        OrdenExamen.objects.create(orden=cls.orden, examen=examenes['GLU'], precio_en_orden=Decimal('5.00'))
+        paquete = Paquete.objects.create(nombre='Lípidos', precio=Decimal('8.00'))
+        PaqueteExamen.objects.create(paquete=paquete, examen=examenes['COL'])
+        OrdenPaquete.objects.create(orden=cls.orden, paquete=paquete, precio_en_orden=paquete.precio)
+        cls.resultado = Resultado.objects.create(orden=cls.orden)
+        cls.crear_muestra(cls.orden, 'M001')
+        # Ya enviada a validación: no se toca
+        en_espera = Orden.objects.create(paciente=paciente)
+        OrdenExamen.objects.create(orden=en_espera, examen=examenes['GLU'], precio_en_orden=Decimal('5.00'))
+        Resultado.objects.create(orden=en_espera, estado='En Espera')
+        cls.crear_muestra(en_espera, 'M002')
+
+    @classmethod
+    def crear_muestra(cls, orden, codigo_barras):
+        Muestra.objects.create(
+            orden=orden, tipo_muestra=cls.tipo_muestra, responsable_toma=cls.usuario, codigo_barras=codigo_barras
+        )
+
+    def valores(self):
+        return dict(ResultadoDetalle.objects.filter(resultado=self.resultado).values_list(
+            'valor_referencia__examen__codigo', 'valor_obtenido'
+        ))
+
+    def test_csv(self):
+        lineas = [
+            'codigo_barras;codigo_examen;valor\n',
+            'M001;GLU;120\n',
+            'M001;col;150\n',
+            'M002;GLU;90\n',
+            'M999;GLU;1\n',
+            'M001;XXX;1\n',
+            'M001;TRI;1\n',
+            'basura\n',
+        ]
+        antes = timezone.now() - timedelta(days=1)
+        Resultado.objects.filter(pk=self.resultado.pk).update(fecha_modificacion=antes)
+        resumen = ImportadorResultados().importar(lineas)
+        self.assertEqual((resumen.lineas, resumen.nuevos, resumen.rechazados), (7, 2, 5))
+        # La bandeja de validación ve el resultado como cambiado
+        self.assertGreater(Resultado.objects.get(pk=self.resultado.pk).fecha_modificacion, antes)
+        self.assertEqual(self.valores(), {'GLU': '120', 'COL': '150'})
+        self.assertEqual(
+            ResultadoDetalle.objects.get(resultado=self.resultado, valor_referencia__examen__codigo='GLU').bandera, 'H'
+        )
+        self.assertEqual([numero for numero, _, _ in resumen.rechazos], [4, 5, 6, 7, 8])
+        self.assertEqual(resumen.rechazos[2][1], "Código de examen desconocido")
+        self.assertEqual(resumen.rechazos[3][1], "Examen no solicitado en la orden")
+
+        # Reimportar actualiza en lugar de duplicar
+        resumen = ImportadorResultados().importar(['M001,GLU,95\n'])
+        self.assertEqual((resumen.nuevos, resumen.actualizados), (0, 1))
+        self.assertEqual(self.valores()['GLU'], '95')
+
+    def test_detalle_guardado_contra_otro_rango_del_examen(self):
+        glucosa = Examen.objects.get(codigo='GLU')
+        anterior = ValorReferencia.objects.get(examen=glucosa)
+        ResultadoDetalle.objects.create(resultado=self.resultado, valor_referencia=anterior, valor_obtenido='80')
+        # Rango agregado después del ingreso, que ahora aplica a la paciente
+        nuevo = ValorReferencia.objects.create(examen=glucosa, sexo='F', rango_referencia='60-100')
+
+        resumen = ImportadorResultados().importar(['M001,GLU,105\n'])
+        self.assertEqual((resumen.nuevos, resumen.actualizados), (0, 1))
+        self.assertEqual(
+            list(ResultadoDetalle.objects.filter(resultado=self.resultado).values_list(
+                'valor_referencia_id', 'valor_obtenido', 'bandera'
+            )),
+            [(nuevo.pk, '105', 'H')]
+        )
+
+    def test_astm(self):
+        lineas = [
+            'H|\\^&|||Analizador^1.0\n',
+            'P|1\n',
+            'O|1|M001^1||^^^GLU\\^^^COL\n',
+            'R|1|^^^GLU^^|65|mg/dL||L\n',
+            'R|2|^^^COL|180|mg/dL\n',
+            'P|2\n',
+            'R|1|^^^GLU|90|mg/dL\n',  # Sin registro O: no se sabe de qué muestra es
+            'L|1|N\n',
+        ]
+        resumen = ImportadorResultados().importar(lineas)
+        self.assertEqual((resumen.nuevos, resumen.rechazados), (2, 1))
+        self.assertEqual(self.valores(), {'GLU': '65', 'COL': '180'})
+
+    def test_comando_con_reporte_de_rechazos(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            archivo, rechazos = os.path.join(carpeta, 'equipo.csv'), os.path.join(carpeta, 'rechazos.csv')
+            with open(archivo, 'w', encoding='utf-8-sig') as f:
+                f.write('M001,GLU,101\nM777,GLU,5\n')
+            salida = io.StringIO()
+            call_command('importar_resultados', archivo, rechazos=rechazos, stdout=salida)
+            with open(rechazos, encoding='utf-8') as f:
+                reporte = f.read().splitlines()
+        self.assertIn("1 nuevo(s), 0 actualizado(s), 1 rechazada(s)", salida.getvalue())
+        self.assertEqual(reporte[0], 'linea,motivo,contenido')
+        self.assertTrue(reporte[1].startswith('2,Muestra desconocida'))
+        self.assertEqual(self.valores(), {'GLU': '101'})
+
+    def test_vista(self):
+        self.client.force_login(self.usuario)
+        url = reverse('resultado_importar')
+        archivo = SimpleUploadedFile('equipo.csv', '\ufeffM001,GLU,88\nM001,ZZZ,1\n'.encode('utf-8'))
+        respuesta = self.client.post(url, {'archivo': archivo})
+        self.assertEqual(respuesta.context['resumen'].importados, 1)
+        self.assertContains(respuesta, "Código de examen desconocido")
+
+        archivo = SimpleUploadedFile('equipo.csv', b'M001,ZZZ,1\n')
+        respuesta = self.client.post(url, {'archivo': archivo, 'descargar_rechazos': 'on'})
+        self.assertEqual(respuesta['X-Lineas-Rechazadas'], '1')
+        self.assertIn(b'ZZZ', b''.join(respuesta.streaming_content))
+
+    def test_memoria_no_crece_con_el_archivo(self):
+        def pico(cantidad):
+            lineas = (f'M{i:06d},GLU,{i}\n' for i in range(cantidad))
+            tracemalloc.start()
+            ImportadorResultados().importar(lineas)
+            _, maximo = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return maximo
+
+        pico(1000)  # Calienta cachés de Django (consultas, templates)
+        chico, grande = pico(5000), pico(100000)
+        self.assertLess(grande, chico * 2)
@@ -11,9 +11,29 @@ urlpatterns = [
     path('gestion/validaciones/lista/', 
          views.ValidacionListView.as_view(), 
          name='validacion_lista'),
+
+    # Cambios de la bandeja desde una fecha (JSON para refrescarla)
+    path('gestion/validaciones/cambios/', 
+         views.ValidacionCambiosView.as_view(), 
+         name='validacion_cambios'),
+
+    # Validación masiva desde la bandeja
+    path('gestion/validaciones/validar/', 
+         views.ValidacionMasivaView.as_view(), 
+         name='validacion_masiva'),
     
     # "Gestionar" (El Hub de Ingreso/Validación)
     path('gestion/orden/<int:orden_pk>/ingresar_resultados/', 
          views.ResultadoIngresoView.as_view(), 
          name='resultado_ingreso'),
+
+    # Exportación por lotes (día/convenio)
+    path('gestion/resultados/exportar/', 
+         views.ExportacionResultadosView.as_view(), 
+         name='resultado_exportar'),
+
+    # Importación de archivos de los equipos (CSV / ASTM)
+    path('gestion/resultados/importar/', 
+         views.ImportacionResultadosView.as_view(), 
+         name='resultado_importar'),
 ]
\ No newline at end of file
@@ -1,16 +1,29 @@
+import tempfile
+from datetime import timedelta
 from django.urls import reverse
 from django.contrib import messages
-from django.shortcuts import redirect, get_object_or_404
-from django.views.generic import UpdateView, ListView
+from django.http import FileResponse, JsonResponse
+from django.shortcuts import redirect, get_object_or_404, render
+from django.views.generic import UpdateView, ListView, View
 from django.utils import timezone
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Case, F, Func, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.template.loader import render_to_string
+from django.utils.dateparse import parse_datetime
 
-from ordenes.models import Orden
-from examenes.models import Examen, ValorReferencia
-from .models import Resultado, ResultadoDetalle
-from .forms import ResultadoHeaderForm
-from ordenes.views import PersonalAutorizadoRequiredMixin
+from ordenes.models import Orden, TrabajoPDF
+from examenes.rangos import BANDERAS_ANORMALES, ResolvedorRangos, edad_en_toma
+from muestras.models import primera_toma
+from .models import Resultado, ResultadoDetalle, emparejar_detalles
+from .exportacion import MAX_ORDENES_PDF_UNICO, clave_exportacion, parametros_exportacion, resultados_validados
+from .forms import ExportacionResultadosForm, ImportacionResultadosForm, ResultadoHeaderForm
+from .importacion import ImportadorResultados, lineas_de_archivo
+from ordenes import cache_pdf
+from ordenes.paginacion import paginar_keyset
+from ordenes.views import PersonalAutorizadoRequiredMixin, respuesta_trabajo_pdf
+from usuarios.permisos import tiene_capacidad
 
 # --- LISTA 1: GESTIÓN DE RESULTADOS (Solo Pendientes) ---
 class ResultadoListView(PersonalAutorizadoRequiredMixin, ListView):
@@ -32,29 +45,149 @@ class ResultadoListView(PersonalAutorizadoRequiredMixin, ListView):
         return context
 
 # --- LISTA 2: VALIDACIONES (Solo En Espera) ---
-class ValidacionListView(PersonalAutorizadoRequiredMixin, ListView):
+# Urgentes primero, luego por antigüedad (único gracias al pk)
+ORDEN_BANDEJA = ('rango_prioridad', 'fecha_emision', 'resultado_id')
+MAX_CAMBIOS_BANDEJA = 200
+# fecha_modificacion se fija antes del COMMIT: un cambio puede hacerse visible
+# después de que su hora ya quedó detrás del cursor. Cada consulta vuelve a
+# cubrir este margen (el cliente reemplaza filas por id, así que repetir es inocuo).
+MARGEN_CAMBIOS_BANDEJA = timedelta(seconds=30)
+# Tope de la validación masiva (parámetros de un IN en SQL Server: máx. 2100)
+MAX_VALIDACION_MASIVA = 500
+
+
+def bandeja_validacion():
+    """
+    Resultados en espera de validación con sus conteos (parámetros, valores
+    fuera de rango) y el rango de prioridad de la orden, en una sola consulta.
+    Los conteos son subconsultas correlacionadas (servidas por los índices de
+    detalles) en lugar de un GROUP BY sobre todas las columnas del listado.
+    """
+    detalles = ResultadoDetalle.objects.filter(resultado=OuterRef('pk')).order_by().values('resultado')
+    contar = Func(F('pk'), function='COUNT')
+    return Resultado.objects.filter(estado='En Espera').select_related(
+        'orden', 'orden__paciente'
+    ).annotate(
+        total_detalles=Coalesce(Subquery(detalles.annotate(n=contar).values('n')), 0),
+        detalles_anormales=Coalesce(Subquery(
+            detalles.filter(bandera__in=BANDERAS_ANORMALES).annotate(n=contar).values('n')
+        ), 0),
+        rango_prioridad=Case(
+            When(orden__prioridad='Urgente', then=Value(0)),
+            When(orden__prioridad='Preferente', then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField(),
+        ),
+    )
+
+
+class ValidadorRequiredMixin:
+    """ REQUISITO: Solo Jefes/Admins validan. """
+
+    def dispatch(self, request, *args, **kwargs):
+        if not tiene_capacidad(request.user, 'validar_resultados'):
+            raise PermissionDenied("Acceso denegado.")
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ValidacionListView(PersonalAutorizadoRequiredMixin, ValidadorRequiredMixin, ListView):
     model = Resultado
     template_name = 'resultados/validacion_lista.html'
     context_object_name = 'resultados'
-    
+    por_pagina = 50
+
     def get_queryset(self):
-        # REQUISITO: Solo Jefes/Admins
-        roles_validadores = ['Jefe de Laboratorio', 'Administrador']
-        if not self.request.user.rol.nombre in roles_validadores:
-            raise PermissionDenied("Acceso denegado.")
-        
         # Solo mostramos resultados que ya fueron llenados ('En Espera')
-        return Resultado.objects.filter(
-            estado='En Espera'
-        ).select_related('orden', 'orden__paciente').order_by('fecha_emision')
-    
+        self.pagina = paginar_keyset(
+            bandeja_validacion(), ORDEN_BANDEJA,
+            cursor=self.request.GET.get('cursor'), por_pagina=self.por_pagina
+        )
+        return self.pagina.objetos
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['titulo'] = "Bandeja de Validación"
+        context['pagina'] = self.pagina
+        # Marca de tiempo desde la que la página pide cambios (ver ValidacionCambiosView)
+        context['desde'] = (timezone.now() - MARGEN_CAMBIOS_BANDEJA).isoformat()
         return context
 
+
+class ValidacionCambiosView(PersonalAutorizadoRequiredMixin, ValidadorRequiredMixin, View):
+    """
+    JSON para refrescar la bandeja sin recargarla: resultados que cambiaron
+    desde `?desde=<ISO 8601>`. Los que siguen en espera vienen con su fila
+    ya renderizada; los que salieron (validados o devueltos) solo con el id.
+    La respuesta trae el `desde` de la siguiente consulta, MARGEN_CAMBIOS_BANDEJA
+    antes de ahora: los cambios de ese margen pueden llegar dos veces.
+    """
+
+    def get(self, request):
+        desde = parse_datetime(request.GET.get('desde', ''))
+        if desde is None:
+            return JsonResponse({'error': "Parámetro 'desde' inválido (ISO 8601)."}, status=400)
+        if timezone.is_naive(desde):
+            desde = timezone.make_aware(desde)
+
+        ahora = timezone.now()
+        cambiados = Resultado.objects.filter(fecha_modificacion__gt=desde, fecha_modificacion__lte=ahora)
+        en_espera = list(bandeja_validacion().filter(
+            pk__in=cambiados.values('pk')
+        ).order_by(*ORDEN_BANDEJA)[:MAX_CAMBIOS_BANDEJA])
+        retirados = list(cambiados.exclude(estado='En Espera').values_list('pk', flat=True)[:MAX_CAMBIOS_BANDEJA])
+
+        return JsonResponse({
+            'desde': (ahora - MARGEN_CAMBIOS_BANDEJA).isoformat(),
+            'cambiados': [
+                {
+                    'id': resultado.pk,
+                    'urgente': resultado.rango_prioridad == 0,
+                    'html': render_to_string('resultados/validacion_fila.html', {'resultado': resultado}, request),
+                }
+                for resultado in en_espera
+            ],
+            'retirados': retirados,
+        })
+
+
+class ValidacionMasivaView(PersonalAutorizadoRequiredMixin, ValidadorRequiredMixin, View):
+    """
+    Valida de una vez los resultados marcados en la bandeja (ver
+    Resultado.validar_en_bloque) e informa los que cambiaron de estado
+    mientras tanto (otro validador, devueltos a corrección).
+    """
+
+    def post(self, request):
+        try:
+            ids = {int(pk) for pk in request.POST.getlist('resultados')}
+        except ValueError:
+            ids = set()
+        if not ids:
+            messages.warning(request, "Seleccione al menos un resultado para validar.")
+            return redirect('validacion_lista')
+        if len(ids) > MAX_VALIDACION_MASIVA:
+            messages.error(request, f"Se pueden validar hasta {MAX_VALIDACION_MASIVA} resultados a la vez.")
+            return redirect('validacion_lista')
+
+        validados, omitidos = Resultado.validar_en_bloque(ids, request.user)
+        if validados:
+            messages.success(request, f"{len(validados)} resultado(s) validados y sus órdenes finalizadas.")
+        if omitidos:
+            detalle = ", ".join(
+                f"Orden #{orden_id} ({estado})" if orden_id else f"Resultado #{pk} (ya no existe)"
+                for pk, (orden_id, estado) in sorted(omitidos.items())
+            )
+            messages.warning(request, f"No se validaron {len(omitidos)} resultado(s) porque cambiaron de estado: {detalle}.")
+        return redirect('validacion_lista')
+
+
 # --- VISTA DE FORMULARIO (El Hub Inteligente) ---
 class ResultadoIngresoView(PersonalAutorizadoRequiredMixin, UpdateView):
+    """
+    Ingreso y validación de resultados de una orden.
+    Mostrar y guardar cuestan un número fijo de consultas sin importar
+    cuántos parámetros tenga la orden (ver guardar_detalles).
+    """
     model = Resultado
     form_class = ResultadoHeaderForm
     template_name = 'resultados/resultado_form.html'
@@ -62,57 +195,113 @@ class ResultadoIngresoView(PersonalAutorizadoRequiredMixin, UpdateView):
 
     def get_object(self):
         orden_pk = self.kwargs.get('orden_pk')
-        orden = get_object_or_404(Orden, pk=orden_pk)
-        resultado, created = Resultado.objects.get_or_create(orden=orden)
-        return resultado
+        try:
+            return Resultado.objects.select_related('orden', 'orden__paciente', 'validado_por').annotate(
+                fecha_toma=primera_toma('orden_id')
+            ).get(orden_id=orden_pk)
+        except Resultado.DoesNotExist:
+            orden = get_object_or_404(Orden, pk=orden_pk)
+            resultado, created = Resultado.objects.get_or_create(orden=orden)
+            return resultado
+
+    def get_parametros(self):
+        """
+        Un parámetro por examen de la orden (directo o por paquete): el valor
+        de referencia que aplica al sexo y edad del paciente a la fecha de
+        toma. Una sola consulta para todos los exámenes (ver ResolvedorRangos).
+        """
+        orden = self.object.orden
+        paciente = orden.paciente
+        edad = edad_en_toma(paciente, getattr(self.object, 'fecha_toma', None), orden.fecha_creacion)
+        return ResolvedorRangos.cargar(orden.filtro_examenes()).parametros(paciente.sexo, edad)
+
+    def es_validador(self):
+        return tiene_capacidad(self.request.user, 'validar_resultados')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         orden = self.object.orden
         
-        # (Lógica de búsqueda de parámetros igual que antes...)
-        examenes_directos_q = Q(ordenes=orden)
-        examenes_paquetes_q = Q(paquetes__in=orden.paquetes.all())
-        todos_examenes = Examen.objects.filter(examenes_directos_q | examenes_paquetes_q).distinct()
-        
-        context['parametros_list'] = ValorReferencia.objects.filter(
-            examen__in=todos_examenes, estado='Activo'
-        ).select_related('examen')
-        
-        detalles = ResultadoDetalle.objects.filter(resultado=self.object)
-        context['detalles_map'] = {d.valor_referencia.pk: d.valor_obtenido for d in detalles}
+        parametros = self.get_parametros()
+        context['parametros_list'] = parametros
+        # Cada detalle con su parámetro (también los guardados contra otro rango del examen)
+        emparejados, _ = emparejar_detalles(parametros, self.detalles_guardados())
+        context['detalles_map'], context['banderas_map'] = {}, {}
+        for parametro in parametros:
+            detalle = emparejados.get(parametro.pk)
+            if detalle is None:
+                continue
+            context['detalles_map'][parametro.pk] = detalle.valor_obtenido
+            bandera = detalle.bandera if detalle.valor_referencia_id == parametro.pk else detalle.evaluar(parametro)
+            if bandera in BANDERAS_ANORMALES:
+                context['banderas_map'][parametro.pk] = bandera
         
         context['titulo'] = f"Resultados - Orden #{orden.pk}"
         context['orden'] = orden
         
-        # PERMISOS
-        roles_validadores = ['Jefe de Laboratorio', 'Administrador']
-        es_jefe = self.request.user.rol and self.request.user.rol.nombre in roles_validadores
-        
         # Determinar qué botones mostrar según el estado
         context['modo_ingreso'] = self.object.estado == 'Pendiente'
-        context['modo_validacion'] = self.object.estado == 'En Espera' and es_jefe
+        context['modo_validacion'] = self.object.estado == 'En Espera' and self.es_validador()
         
         return context
 
+    def detalles_guardados(self):
+        return ResultadoDetalle.objects.filter(resultado=self.object).select_related('valor_referencia')
+
+    def guardar_detalles(self, parametros):
+        """
+        Compara lo enviado con los detalles existentes y aplica solo las
+        diferencias: un bulk_create (nuevos), un bulk_update (cambiados) y un
+        delete (vaciados). Cada valor se marca con su bandera (fuera de rango)
+        contra el parámetro ya cargado. Un detalle guardado contra otro rango
+        del mismo examen pasa al parámetro actual (ver emparejar_detalles).
+        Llamar dentro de transaction.atomic.
+        """
+        existentes, sobrantes = emparejar_detalles(parametros, self.detalles_guardados())
+        nuevos, cambiados, vaciados = [], [], [detalle.pk for detalle in sobrantes]
+        for param in parametros:
+            val = self.request.POST.get(f'valor_obtenido_{param.pk}', '').strip()
+            detalle = existentes.get(param.pk)
+            if val and detalle is None:
+                detalle = ResultadoDetalle(resultado=self.object, valor_referencia=param, valor_obtenido=val)
+                detalle.evaluar(param)
+                nuevos.append(detalle)
+            elif val:
+                # La bandera se recalcula aunque el valor no cambie (el rango pudo editarse)
+                bandera, movido = detalle.bandera, detalle.valor_referencia_id != param.pk
+                valor_anterior, detalle.valor_obtenido = detalle.valor_obtenido, val
+                detalle.valor_referencia = param
+                if detalle.evaluar(param) != bandera or valor_anterior != val or movido:
+                    cambiados.append(detalle)
+            elif detalle is not None:
+                vaciados.append(detalle.pk)
+
+        if vaciados:
+            ResultadoDetalle.objects.filter(pk__in=vaciados).delete()
+        if nuevos:
+            ResultadoDetalle.objects.bulk_create(nuevos)
+        if cambiados:
+            ResultadoDetalle.objects.bulk_update(cambiados, ['valor_referencia', 'valor_obtenido', 'bandera'])
+        if nuevos or cambiados or vaciados:
+            # Los bulk no pasan por save(): la bandeja de validación debe ver el cambio
+            Resultado.objects.filter(pk=self.object.pk).update(fecha_modificacion=timezone.now())
+
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
+        # Estado guardado, antes de que el form copie el campo oculto 'estado' al objeto
+        estado_actual = self.object.estado
         form = self.get_form()
-        context = self.get_context_data()
-        
-        # 1. Guardar Valores (Detalles)
-        for param in context['parametros_list']:
-            val = request.POST.get(f'valor_obtenido_{param.pk}', '').strip()
-            if val:
-                ResultadoDetalle.objects.update_or_create(
-                    resultado=self.object, valor_referencia=param,
-                    defaults={'valor_obtenido': val}
-                )
-            else:
-                ResultadoDetalle.objects.filter(resultado=self.object, valor_referencia=param).delete()
-
-        if form.is_valid():
-            resultado = form.save(commit=False)
+        if not form.is_valid():
+            return self.form_invalid(form)
+
+        resultado = form.save(commit=False)
+        es_validador = self.es_validador()
+
+        with transaction.atomic():
+            # 1. Guardar Valores (Detalles). Un resultado validado no tiene
+            # campos editables: no se toca.
+            if estado_actual != 'Validado':
+                self.guardar_detalles(self.get_parametros())
             
             # --- LÓGICA DE BOTONES ---
             
@@ -121,7 +310,7 @@ class ResultadoIngresoView(PersonalAutorizadoRequiredMixin, UpdateView):
                 resultado.estado = 'Pendiente'
                 messages.info(request, "Borrador guardado. Sigue en tu bandeja.")
                 resultado.save()
-                return redirect(reverse('resultado_ingreso', kwargs={'orden_pk': resultado.orden.pk}))
+                return redirect(reverse('resultado_ingreso', kwargs={'orden_pk': resultado.orden_id}))
 
             # B. Técnico envía a validar (Pasa a En Espera -> Desaparece de su lista)
             elif 'enviar_validacion' in request.POST:
@@ -134,24 +323,111 @@ class ResultadoIngresoView(PersonalAutorizadoRequiredMixin, UpdateView):
             elif 'devolver_correccion' in request.POST:
                 resultado.estado = 'Pendiente'
                 resultado.validado_por = None
+                cache_pdf.invalidar('Resultado', resultado.orden_id)
                 messages.warning(request, "Resultados devueltos al técnico para corrección.")
                 resultado.save()
                 return redirect(reverse('validacion_lista'))
 
             # D. Jefe valida (Pasa a Validado -> Orden Completada)
             elif 'validar_finalizar' in request.POST:
-                if not context['modo_validacion']:
+                if not (estado_actual == 'En Espera' and es_validador):
                     raise PermissionDenied
                 
                 resultado.estado = 'Validado'
                 resultado.validado_por = request.user
                 resultado.fecha_validacion = timezone.now()
-                resultado.orden.estado = 'Completada'
-                resultado.orden.save()
+                Orden.objects.filter(pk=resultado.orden_id).update(estado='Completada')
                 resultado.save()
                 messages.success(request, "Orden finalizada y validada exitosamente.")
                 return redirect(reverse('validacion_lista'))
 
-            return redirect(reverse('orden_update', kwargs={'pk': resultado.orden.pk}))
-        else:
-            return self.form_invalid(form)
\ No newline at end of file
+        return redirect(reverse('orden_update', kwargs={'pk': resultado.orden_id}))
+
+
+# --- EXPORTACIÓN POR LOTES (Resultados validados por fecha/convenio) ---
+class ExportacionResultadosView(PersonalAutorizadoRequiredMixin, View):
+    """
+    Descarga en un solo archivo (ZIP o PDF concatenado) todos los resultados
+    validados en un rango de fechas, opcionalmente de un convenio.
+    La vista solo valida y encola un TrabajoPDF: el worker (procesar_pdfs)
+    arma el archivo y se descarga desde la página de espera, como los PDFs.
+    """
+    template_name = 'resultados/exportacion_resultados.html'
+
+    def get(self, request):
+        return self.mostrar(ExportacionResultadosForm())
+
+    def post(self, request):
+        form = ExportacionResultadosForm(request.POST)
+        if not form.is_valid():
+            return self.mostrar(form)
+
+        datos = form.cleaned_data
+        resultados = resultados_validados(datos['fecha_desde'], datos['fecha_hasta'], datos['convenio'])
+        cantidad = resultados.count()
+        if not cantidad:
+            messages.warning(request, "No hay resultados validados con esos filtros.")
+            return self.mostrar(form)
+        if datos['formato'] == 'pdf' and cantidad > MAX_ORDENES_PDF_UNICO:
+            form.add_error('formato', f"Son {cantidad} órdenes: para más de {MAX_ORDENES_PDF_UNICO} use el ZIP.")
+            return self.mostrar(form)
+
+        parametros = parametros_exportacion(
+            datos['fecha_desde'], datos['fecha_hasta'], datos['convenio'], datos['formato']
+        )
+        trabajo = TrabajoPDF.encolar(
+            'Exportacion', parametros['convenio'] or 0, request.user, parametros, clave_exportacion(parametros)
+        )
+        return respuesta_trabajo_pdf(request, trabajo)
+
+    def mostrar(self, form):
+        return render(self.request, self.template_name, {
+            'titulo': "Exportar Resultados Validados",
+            'form': form,
+        })
+
+
+# --- IMPORTACIÓN DE RESULTADOS DE EQUIPOS (CSV / ASTM) ---
+class ImportacionResultadosView(PersonalAutorizadoRequiredMixin, View):
+    """
+    Carga el archivo de un equipo sobre los resultados en 'Pendiente' (ver
+    resultados.importacion). El archivo se procesa por partes sin leerlo
+    completo en memoria; el reporte de rechazos se puede descargar como CSV.
+    """
+    template_name = 'resultados/importacion_resultados.html'
+
+    def get(self, request):
+        return self.mostrar(ImportacionResultadosForm())
+
+    def post(self, request):
+        form = ImportacionResultadosForm(request.POST, request.FILES)
+        if not form.is_valid():
+            return self.mostrar(form)
+
+        descargar = form.cleaned_data['descargar_rechazos']
+        rechazos = tempfile.TemporaryFile('w+', encoding='utf-8', newline='') if descargar else None
+        resumen = ImportadorResultados(rechazos).importar(lineas_de_archivo(form.cleaned_data['archivo']))
+
+        if descargar and resumen.rechazados:
+            rechazos.flush()
+            archivo = rechazos.detach() # El binario: al descartar el wrapper de texto no se cierra
+            archivo.seek(0)
+            respuesta = FileResponse(archivo, as_attachment=True, filename="rechazos_importacion.csv",
+                                     content_type='text/csv')
+            respuesta['X-Resultados-Importados'] = resumen.importados
+            respuesta['X-Lineas-Rechazadas'] = resumen.rechazados
+            return respuesta
+
+        if resumen.importados:
+            messages.success(request, f"{resumen.importados} resultado(s) importados "
+                                      f"({resumen.nuevos} nuevos, {resumen.actualizados} actualizados).")
+        if resumen.rechazados:
+            messages.warning(request, f"{resumen.rechazados} línea(s) rechazadas.")
+        return self.mostrar(ImportacionResultadosForm(), resumen)
+
+    def mostrar(self, form, resumen=None):
+        return render(self.request, self.template_name, {
+            'titulo': "Importar Resultados de Equipos",
+            'form': form,
+            'resumen': resumen,
+        })
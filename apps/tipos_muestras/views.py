@@ -2,7 +2,7 @@ from django.urls import reverse_lazy
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from usuarios.permisos import CapacidadRequeridaMixin
 from django.core.exceptions import ValidationError
 from django.db.models.deletion import ProtectedError
 from .models import TipoMuestra
@@ -10,18 +10,11 @@ from .forms import TipoMuestraForm
 
 # --- REQUISITO: Mixin de Seguridad para Administradores y Técnicos ---
 # (Este Mixin es idéntico al de Categorias)
-class AdminTecnicoRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+class AdminTecnicoRequiredMixin(CapacidadRequeridaMixin):
     """
     Asegura que el usuario logueado tenga el rol 'Administrador' o 'Tecnico'.
     """
-    def test_func(self):
-        if not self.request.user.is_authenticated or not self.request.user.rol:
-            return False
-        return self.request.user.rol.nombre in ['Administrador', 'Tecnico']
-
-    def handle_no_permission(self):
-        messages.error(self.request, "No tienes permiso para acceder a esta página.")
-        return redirect('dashboard' if self.request.user.is_authenticated else 'login')
+    capacidad = 'gestionar_catalogos'
 
 # --- CRUD de Tipos de Muestra ---
 
@@ -46,6 +46,13 @@ class Usuario(AbstractUser):
     def __str__(self):
         return f"{self.nombre} {self.apellido} ({self.username})"
 
+    def get_full_name(self):
+        # AbstractUser usa first_name/last_name, que aquí no existen
+        return f"{self.nombre} {self.apellido}".strip()
+
+    def get_short_name(self):
+        return self.nombre
+
     # --- REGLAS DE NEGOCIO (MOVIDAS AL MODELO) ---
     
     def puede_eliminarse(self):
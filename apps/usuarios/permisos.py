@@ -0,0 +1,83 @@
+import threading
+
+from django.contrib import messages
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.shortcuts import redirect
+
+from .models import Usuario
+
+# --- Autorización por rol ---
+# Qué puede hacer cada rol se define solo aquí (PERMISOS). El backend carga
+# el usuario de la sesión junto con su rol (una consulta por petición, que
+# también usa el menú para mostrar el rol), y las capacidades de cada rol se
+# calculan una vez por proceso: cada verificación es una búsqueda en un set.
+# La caché se vacía al guardar o borrar un Rol (ver usuarios.signals) y,
+# como se indexa también por el nombre, un rol renombrado desde otro proceso
+# tampoco conserva capacidades viejas.
+
+# capacidad -> roles que la tienen (los nombres son los de la tabla Roles)
+PERMISOS = {
+    'gestionar_ordenes': {'Administrador', 'Recepcionista', 'Analista', 'Técnico', 'Jefe de Laboratorio'},
+    'validar_resultados': {'Administrador', 'Jefe de Laboratorio'},
+    'gestionar_pacientes': {'Administrador', 'Recepcionista'},
+    'gestionar_examenes': {'Administrador', 'Tecnico', 'Jefe de Laboratorio'},
+    'gestionar_catalogos': {'Administrador', 'Tecnico'}, # Categorías y tipos de muestra
+    'gestionar_convenios': {'Administrador', 'Jefe de Laboratorio'},
+    'administrar_usuarios': {'Administrador'}, # Usuarios y roles
+}
+
+_capacidades = {} # (rol_id, nombre) -> frozenset de capacidades
+_candado = threading.Lock()
+
+
+class UsuarioConRolBackend(ModelBackend):
+    """ ModelBackend que trae el rol del usuario de la sesión en la misma consulta. """
+
+    def get_user(self, user_id):
+        try:
+            usuario = Usuario._default_manager.select_related('rol').get(pk=user_id)
+        except Usuario.DoesNotExist:
+            return None
+        return usuario if self.user_can_authenticate(usuario) else None
+
+
+def capacidades_de_rol(rol):
+    """ frozenset de capacidades del rol (None -> vacío), calculado una vez por proceso. """
+    if rol is None:
+        return frozenset()
+    clave = (rol.pk, rol.nombre)
+    encontradas = _capacidades.get(clave)
+    if encontradas is None:
+        encontradas = frozenset(capacidad for capacidad, roles in PERMISOS.items() if rol.nombre in roles)
+        with _candado:
+            _capacidades[clave] = encontradas
+    return encontradas
+
+
+def tiene_capacidad(usuario, capacidad):
+    """ True si el usuario está autenticado y su rol tiene la capacidad. """
+    if not usuario.is_authenticated or usuario.rol_id is None:
+        return False
+    return capacidad in capacidades_de_rol(usuario.rol)
+
+
+def invalidar_capacidades():
+    """ Descarta las capacidades calculadas (al guardar o borrar un Rol). """
+    with _candado:
+        _capacidades.clear()
+
+
+class CapacidadRequeridaMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Deja pasar solo a usuarios cuyo rol tiene `capacidad` (ver PERMISOS); al
+    resto lo devuelve al panel (o al login) con un mensaje.
+    """
+    capacidad = None
+
+    def test_func(self):
+        return tiene_capacidad(self.request.user, self.capacidad)
+
+    def handle_no_permission(self):
+        messages.error(self.request, "No tienes permiso para acceder a esta página.")
+        return redirect('dashboard' if self.request.user.is_authenticated else 'login')
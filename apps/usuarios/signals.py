@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from roles.models import Rol
+from .permisos import invalidar_capacidades
+
+
+@receiver([post_save, post_delete], sender=Rol)
+def invalidar_capacidades_rol(sender, instance, **kwargs):
+    invalidar_capacidades()
@@ -1,3 +1,49 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from roles.models import Rol
+from .models import Usuario
+from .permisos import UsuarioConRolBackend, capacidades_de_rol, tiene_capacidad
+
+
+def crear_usuario(username, rol, dui):
+    return Usuario.objects.create_user(
+        username=username, password='clave-segura-123', email=f'{username}@example.com',
+        nombre=username.title(), apellido='Prueba', dui=dui, rol=rol
+    )
+
+
+class PermisosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.recepcion = Rol.objects.create(nombre='Recepcionista', descripcion='Recepción de pacientes')
+        cls.usuario = crear_usuario('recepcion', cls.recepcion, '01234567-8')
+        cls.sin_rol = crear_usuario('visitante', None, '09876543-2')
+
+    def test_usuario_de_la_sesion_con_su_rol(self):
+        with self.assertNumQueries(1):
+            usuario = UsuarioConRolBackend().get_user(self.usuario.pk)
+            self.assertEqual(usuario.rol.nombre, 'Recepcionista')
+        capacidades_de_rol(usuario.rol)
+        with self.assertNumQueries(0):
+            self.assertTrue(tiene_capacidad(usuario, 'gestionar_pacientes'))
+            self.assertFalse(tiene_capacidad(usuario, 'validar_resultados'))
+
+    def test_renombrar_el_rol_cambia_sus_capacidades(self):
+        self.assertIn('gestionar_pacientes', capacidades_de_rol(self.recepcion))
+        self.recepcion.nombre = 'Jefe de Laboratorio'
+        self.recepcion.save()
+        usuario = UsuarioConRolBackend().get_user(self.usuario.pk)
+        self.assertNotIn('gestionar_pacientes', capacidades_de_rol(usuario.rol))
+        self.assertIn('validar_resultados', capacidades_de_rol(usuario.rol))
+
+    def test_mixins(self):
+        self.client.force_login(self.usuario)
+        self.assertEqual(self.client.get(reverse('paciente_list')).status_code, 200)
+        self.assertRedirects(self.client.get(reverse('categoria_list')), reverse('dashboard'))
+
+        self.client.force_login(self.sin_rol)
+        self.assertRedirects(self.client.get(reverse('paciente_list')), reverse('dashboard'))
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('paciente_list')).status_code, 302)
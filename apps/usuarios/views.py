@@ -2,7 +2,8 @@ from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
 from django.contrib.auth import login, logout
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.mixins import LoginRequiredMixin
+from .permisos import CapacidadRequeridaMixin
 from django.views.generic import ListView, CreateView, UpdateView, DetailView, DeleteView
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import update_session_auth_hash
@@ -43,21 +44,11 @@ def logout_view(request):
 
 # --- Mixin de Seguridad ---
 
-class AdminRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+class AdminRequiredMixin(CapacidadRequeridaMixin):
     """
     Verifica que el usuario esté logueado Y que su rol sea 'Administrador'.
     """
-    def test_func(self):
-        if not self.request.user.is_authenticated:
-            return False
-        # Comprueba que el usuario tenga un rol asignado antes de leer .nombre
-        if self.request.user.rol:
-            return self.request.user.rol.nombre == 'Administrador'
-        return False
-
-    def handle_no_permission(self):
-        messages.error(self.request, "No tienes permiso para acceder a esta página.")
-        return redirect('dashboard')
+    capacidad = 'administrar_usuarios'
 
 # --- CRUD de Usuarios (para Administradores) ---
 